@@ -0,0 +1,471 @@
+"""
+# @file bos_stub.py
+# @Synopsis  local stand-in of the BOS http api for benchmarks, objects are
+# kept in memory. Latency, bandwidth and errors can be injected. Supported:
+# put, get(with range), head and list objects, multipart upload
+# @author Ming Gu(guming@itv.baidu.com))
+# @version 1.0
+# @date 2016-12-31
+"""
+import sys
+import time
+import json
+import random
+import urllib
+import urlparse
+import hashlib
+import base64
+import argparse
+import threading
+import BaseHTTPServer
+import SocketServer
+
+# bytes read or written at a time
+CHUNK_SIZE = 64 * 1024
+USER_META_PREFIX = 'x-bce-meta-'
+
+
+class Bandwidth(object):
+    """
+    # @Synopsis  token bucket of the bytes sent and received by all
+    # connections, thread safe. A rate of 0 means unlimited
+    """
+    def __init__(self, rate):
+        self.rate = rate
+        self.next_time = time.time()
+        self.lock = threading.Lock()
+
+    def consume(self, size):
+        """
+        # @Synopsis  block until the rate allows size bytes
+        # @Args size
+        # @Returns   None
+        """
+        if self.rate <= 0:
+            return
+        self.lock.acquire()
+        try:
+            cur_time = time.time()
+            self.next_time = max(self.next_time, cur_time) + float(size) / self.rate
+            wait_seconds = self.next_time - cur_time
+        finally:
+            self.lock.release()
+        if wait_seconds > 0:
+            time.sleep(wait_seconds)
+
+
+class Store(object):
+    """
+    # @Synopsis  in-memory objects and multipart uploads, thread safe
+    """
+    def __init__(self):
+        self.objects = {}
+        self.uploads = {}
+        self.upload_cnt = 0
+        self.lock = threading.Lock()
+
+    def put(self, bucket, key, data, etag, meta):
+        """
+        # @Synopsis  put an object
+        # @Args bucket
+        # @Args key
+        # @Args data
+        # @Args etag
+        # @Args meta dict of user metadata headers
+        # @Returns   None
+        """
+        self.lock.acquire()
+        try:
+            self.objects[(bucket, key)] = (data, etag, meta, time.time())
+        finally:
+            self.lock.release()
+
+    def get(self, bucket, key):
+        """
+        # @Synopsis  get an object
+        # @Args bucket
+        # @Args key
+        # @Returns   tuple of data, etag, meta and mtime, None if not found
+        """
+        self.lock.acquire()
+        try:
+            return self.objects.get((bucket, key))
+        finally:
+            self.lock.release()
+
+    def list(self, bucket, prefix, marker, delimiter, max_keys):
+        """
+        # @Synopsis  list objects in key order
+        # @Args bucket
+        # @Args prefix
+        # @Args marker keys not greater than marker are skipped
+        # @Args delimiter
+        # @Args max_keys
+        # @Returns   tuple of list of (key, size, etag, mtime), list of common
+        # prefixes and whether truncated
+        """
+        self.lock.acquire()
+        try:
+            keys = sorted(key for b, key in self.objects if b == bucket)
+            contents = []
+            common_prefixes = []
+            for key in keys:
+                if not key.startswith(prefix) or (marker and key <= marker):
+                    continue
+                if len(contents) + len(common_prefixes) >= max_keys:
+                    return contents, common_prefixes, True
+                rest = key[len(prefix):]
+                if delimiter and delimiter in rest:
+                    common_prefix = prefix + rest[:rest.index(delimiter) + len(delimiter)]
+                    if common_prefix in common_prefixes or (marker and common_prefix <= marker):
+                        continue
+                    common_prefixes.append(common_prefix)
+                    continue
+                data, etag, meta, mtime = self.objects[(bucket, key)]
+                contents.append((key, len(data), etag, mtime))
+            return contents, common_prefixes, False
+        finally:
+            self.lock.release()
+
+    def initiate(self, bucket, key):
+        """
+        # @Synopsis  initiate a multipart upload
+        # @Args bucket
+        # @Args key
+        # @Returns   upload id
+        """
+        self.lock.acquire()
+        try:
+            self.upload_cnt += 1
+            upload_id = 'upload{}'.format(self.upload_cnt)
+            self.uploads[upload_id] = (bucket, key, {})
+            return upload_id
+        finally:
+            self.lock.release()
+
+    def putPart(self, upload_id, part_number, data, etag):
+        """
+        # @Synopsis  put a part
+        # @Args upload_id
+        # @Args part_number
+        # @Args data
+        # @Args etag
+        # @Returns   False if the upload does not exist
+        """
+        self.lock.acquire()
+        try:
+            if upload_id not in self.uploads:
+                return False
+            self.uploads[upload_id][2][part_number] = (data, etag)
+            return True
+        finally:
+            self.lock.release()
+
+    def complete(self, upload_id, part_list, meta):
+        """
+        # @Synopsis  concatenate the parts as the object
+        # @Args upload_id
+        # @Args part_list list of part number and etag
+        # @Args meta dict of user metadata headers
+        # @Returns   tuple of bucket, key and etag, None if the upload or a
+        # part does not exist
+        """
+        self.lock.acquire()
+        try:
+            upload = self.uploads.pop(upload_id, None)
+            if upload is None:
+                return None
+            bucket, key, parts = upload
+            datas = []
+            for part_number, etag in part_list:
+                if parts.get(part_number, (None, None))[1] != etag.strip('"'):
+                    return None
+                datas.append(parts[part_number][0])
+            etag = hashlib.md5(''.join(p[1] for p in part_list)).hexdigest() + \
+                    '-{}'.format(len(part_list))
+            self.objects[(bucket, key)] = (''.join(datas), etag, meta, time.time())
+            return bucket, key, etag
+        finally:
+            self.lock.release()
+
+    def abort(self, upload_id):
+        """
+        # @Synopsis  abort a multipart upload
+        # @Args upload_id
+        # @Returns   None
+        """
+        self.lock.acquire()
+        try:
+            self.uploads.pop(upload_id, None)
+        finally:
+            self.lock.release()
+
+
+class BosStubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    # @Synopsis  http handler of the BOS api, keep-alive. Paths are
+    # /bucket/key, authorization is not checked
+    """
+    protocol_version = 'HTTP/1.1'
+    # the headers of a response are buffered and sent at once, without
+    # waiting for delayed acks, as BOS does
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        """
+        # @Synopsis  requests are not logged
+        # @Returns   None
+        """
+        pass
+
+    def parseRequest(self):
+        """
+        # @Synopsis  parse the path of the request
+        # @Returns   tuple of bucket, key and dict of query parameters
+        """
+        url = urlparse.urlparse(self.path)
+        path = urllib.unquote(url.path).lstrip('/')
+        bucket, _, key = path.partition('/')
+        query = dict(urlparse.parse_qsl(url.query, keep_blank_values=True))
+        return bucket, key, query
+
+    def readBody(self):
+        """
+        # @Synopsis  read the request body, limited by the bandwidth
+        # @Returns   body
+        """
+        remain_size = int(self.headers.get('content-length', 0))
+        chunks = []
+        while remain_size > 0:
+            chunk = self.rfile.read(min(CHUNK_SIZE, remain_size))
+            if not chunk:
+                break
+            self.server.bandwidth.consume(len(chunk))
+            chunks.append(chunk)
+            remain_size -= len(chunk)
+        return ''.join(chunks)
+
+    def getUserMeta(self):
+        """
+        # @Synopsis  user metadata headers of the request
+        # @Returns   dict
+        """
+        return dict((k, v) for k, v in self.headers.items()
+                if k.lower().startswith(USER_META_PREFIX))
+
+    def reply(self, status, body='', headers=None, content_length=None):
+        """
+        # @Synopsis  send a response, the body is limited by the bandwidth
+        # @Args status
+        # @Args body
+        # @Args headers dict
+        # @Args content_length length sent, the length of body by default
+        # @Returns   None
+        """
+        self.send_response(status)
+        self.send_header('x-bce-request-id', 'stub')
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.send_header('Content-Length', str(len(body) if content_length is None
+            else content_length))
+        self.end_headers()
+        if self.command == 'HEAD':
+            return
+        for offset in range(0, len(body), CHUNK_SIZE):
+            chunk = body[offset:offset + CHUNK_SIZE]
+            self.server.bandwidth.consume(len(chunk))
+            self.wfile.write(chunk)
+
+    def replyJson(self, status, obj):
+        """
+        # @Synopsis  send a json response
+        # @Args status
+        # @Args obj
+        # @Returns   None
+        """
+        self.reply(status, json.dumps(obj), {'Content-Type': 'application/json'})
+
+    def replyError(self, status, code, message):
+        """
+        # @Synopsis  send an error response in the BOS format
+        # @Args status
+        # @Args code
+        # @Args message
+        # @Returns   None
+        """
+        self.replyJson(status, {'code': code, 'message': message, 'requestId': 'stub'})
+
+    def inject(self):
+        """
+        # @Synopsis  apply the injected latency and errors
+        # @Returns   True if an error is injected and sent
+        """
+        if self.server.latency > 0:
+            time.sleep(self.server.latency)
+        if self.server.error_rate > 0 and random.random() < self.server.error_rate:
+            # the body of the request is drained to keep the connection usable
+            self.readBody()
+            self.replyError(503, 'ServiceUnavailable', 'injected error')
+            return True
+        return False
+
+    def do_PUT(self):
+        """
+        # @Synopsis  put object or upload part
+        # @Returns   None
+        """
+        if self.inject():
+            return
+        bucket, key, query = self.parseRequest()
+        data = self.readBody()
+        md5 = hashlib.md5(data)
+        content_md5 = self.headers.get('content-md5')
+        if content_md5 and base64.standard_b64decode(content_md5) != md5.digest():
+            return self.replyError(400, 'BadDigest', 'content md5 mismatch')
+        etag = md5.hexdigest()
+        if 'partNumber' in query:
+            if not self.server.store.putPart(query.get('uploadId'), int(query['partNumber']),
+                    data, etag):
+                return self.replyError(404, 'NoSuchUpload', 'no such upload')
+        else:
+            self.server.store.put(bucket, key, data, etag, self.getUserMeta())
+        self.reply(200, '', {'ETag': '"{}"'.format(etag)})
+
+    def do_POST(self):
+        """
+        # @Synopsis  initiate or complete a multipart upload
+        # @Returns   None
+        """
+        if self.inject():
+            return
+        bucket, key, query = self.parseRequest()
+        body = self.readBody()
+        if 'uploads' in query:
+            upload_id = self.server.store.initiate(bucket, key)
+            return self.replyJson(200, {'bucket': bucket, 'key': key, 'uploadId': upload_id})
+        if 'uploadId' in query:
+            part_list = [(x['partNumber'], x['eTag']) for x in json.loads(body)['parts']]
+            result = self.server.store.complete(query['uploadId'], part_list,
+                    self.getUserMeta())
+            if result is None:
+                return self.replyError(400, 'InvalidPart', 'invalid part list')
+            return self.replyJson(200, {'location': '/{}/{}'.format(bucket, key),
+                'bucket': bucket, 'key': key, 'eTag': result[2]})
+        self.replyError(400, 'InvalidArgument', 'unsupported post')
+
+    def do_DELETE(self):
+        """
+        # @Synopsis  abort a multipart upload
+        # @Returns   None
+        """
+        if self.inject():
+            return
+        bucket, key, query = self.parseRequest()
+        if 'uploadId' in query:
+            self.server.store.abort(query['uploadId'])
+        self.reply(204)
+
+    def do_HEAD(self):
+        """
+        # @Synopsis  get object meta
+        # @Returns   None
+        """
+        self.do_GET()
+
+    def do_GET(self):
+        """
+        # @Synopsis  get object, with range, or list objects of a bucket
+        # @Returns   None
+        """
+        if self.inject():
+            return
+        bucket, key, query = self.parseRequest()
+        if key == '':
+            return self.listObjects(bucket, query)
+        obj = self.server.store.get(bucket, key)
+        if obj is None:
+            return self.replyError(404, 'NoSuchKey', 'no such key')
+        data, etag, meta, mtime = obj
+        headers = dict(meta)
+        headers.update({
+            'ETag': '"{}"'.format(etag),
+            'Content-Type': 'application/octet-stream',
+            'Last-Modified': self.date_time_string(mtime),
+            })
+        byte_range = self.headers.get('range')
+        if byte_range and self.command == 'GET':
+            start, end = byte_range.split('=')[1].split('-')
+            start = int(start)
+            end = min(int(end) if end else len(data) - 1, len(data) - 1)
+            headers['Content-Range'] = 'bytes {}-{}/{}'.format(start, end, len(data))
+            return self.reply(206, data[start:end + 1], headers)
+        self.reply(200, data, headers, len(data))
+
+    def listObjects(self, bucket, query):
+        """
+        # @Synopsis  list objects of a bucket
+        # @Args bucket
+        # @Args query
+        # @Returns   None
+        """
+        prefix = query.get('prefix', '')
+        marker = query.get('marker', '')
+        delimiter = query.get('delimiter', '')
+        max_keys = int(query.get('maxKeys', 1000))
+        contents, common_prefixes, truncated = self.server.store.list(bucket, prefix,
+                marker, delimiter, max_keys)
+        result = {
+            'name': bucket,
+            'prefix': prefix,
+            'marker': marker,
+            'maxKeys': max_keys,
+            'isTruncated': truncated,
+            'contents': [{
+                'key': key,
+                'size': size,
+                'eTag': etag,
+                'lastModified': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(mtime)),
+                'storageClass': 'STANDARD',
+                'owner': {'id': 'stub', 'displayName': 'stub'},
+                } for key, size, etag, mtime in contents],
+            'commonPrefixes': [{'prefix': x} for x in common_prefixes],
+            }
+        if delimiter:
+            result['delimiter'] = delimiter
+        if truncated:
+            result['nextMarker'] = max([x[0] for x in contents] + common_prefixes)
+        self.replyJson(200, result)
+
+
+class BosStubServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    # @Synopsis  threaded BOS stub server
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, latency=0, bandwidth=0, error_rate=0):
+        BaseHTTPServer.HTTPServer.__init__(self, address, BosStubHandler)
+        self.store = Store()
+        self.latency = latency
+        self.bandwidth = Bandwidth(bandwidth)
+        self.error_rate = error_rate
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='local stand-in of BOS for benchmarks')
+    parser.add_argument('--host', default='127.0.0.1', help='listen host')
+    parser.add_argument('--port', type=int, default=8080, help='listen port')
+    parser.add_argument('--latency', type=float, default=0, help=('seconds added to each '
+        'request'))
+    parser.add_argument('--bandwidth', type=int, default=0, help=('bytes per second sent '
+        'and received by all connections, 0 for unlimited'))
+    parser.add_argument('--error-rate', type=float, default=0, help=('ratio of requests '
+        'failed by 503'))
+    args = parser.parse_args()
+    server = BosStubServer((args.host, args.port), args.latency, args.bandwidth,
+            args.error_rate)
+    sys.stdout.write('serving BOS stub on {}:{}\n'.format(args.host, args.port))
+    sys.stdout.flush()
+    server.serve_forever()
@@ -0,0 +1,428 @@
+"""
+# @file run_bench.py
+# @Synopsis  end to end benchmark of hdfs2bos and bos-client against the
+# local BOS stub and the fake hadoop client. File size distributions and
+# thread numbers are swept, files/sec, MB/sec and latency percentiles of each
+# stage are reported as json
+# @author Ming Gu(guming@itv.baidu.com))
+# @version 1.0
+# @date 2016-12-31
+"""
+import os
+import sys
+import time
+import json
+import random
+import socket
+import shutil
+import argparse
+import tempfile
+import subprocess
+import ConfigParser
+import collections
+
+BENCH_PATH = os.path.split(os.path.realpath(__file__))[0]
+PROJECT_PATH = os.path.join(BENCH_PATH, '..')
+BUCKET_NAME = 'bench'
+# file size distributions, lists of (file_cnt, min_size, max_size), sizes are
+# drawn uniformly in log scale between min_size and max_size
+DISTRIBUTIONS = collections.OrderedDict([
+    ('small', [(2000, 1024, 64 * 1024)]),
+    ('medium', [(200, 1024 * 1024, 16 * 1024 * 1024)]),
+    ('large', [(4, 64 * 1024 * 1024, 256 * 1024 * 1024)]),
+    ('mixed', [(1000, 1024, 64 * 1024), (50, 1024 * 1024, 16 * 1024 * 1024),
+        (2, 64 * 1024 * 1024, 256 * 1024 * 1024)]),
+    ])
+PERCENTILES = [50, 90, 99]
+# bytes of random data the files are cut from
+RANDOM_BLOCK_SIZE = 1024 * 1024
+
+
+def generateFiles(data_path, distribution, seed=0):
+    """
+    # @Synopsis  generate the files of a distribution, skipped if generated
+    # @Args data_path directory of the files
+    # @Args distribution list of (file_cnt, min_size, max_size)
+    # @Args seed random seed, the same seed generates the same sizes
+    # @Returns   tuple of file_cnt and total_size
+    """
+    rand = random.Random(seed)
+    sizes = []
+    for file_cnt, min_size, max_size in distribution:
+        for i in range(file_cnt):
+            sizes.append(int(round(min_size * (float(max_size) / min_size) ** rand.random())))
+    if not os.path.exists(data_path):
+        block = os.urandom(RANDOM_BLOCK_SIZE)
+        tmp_path = data_path + '.tmp'
+        shutil.rmtree(tmp_path, True)
+        for i, size in enumerate(sizes):
+            # spread over sub-directories as real data is
+            dir_path = os.path.join(tmp_path, 'dir{}'.format(i % 10))
+            if not os.path.exists(dir_path):
+                os.makedirs(dir_path)
+            data_file = open(os.path.join(dir_path, 'file{}'.format(i)), 'wb')
+            offset = rand.randint(0, RANDOM_BLOCK_SIZE - 1)
+            remain_size = size
+            while remain_size > 0:
+                chunk = block[offset:offset + remain_size]
+                data_file.write(chunk)
+                remain_size -= len(chunk)
+                offset = 0
+            data_file.close()
+        os.rename(tmp_path, data_path)
+    return len(sizes), sum(sizes)
+
+
+def getFreePort():
+    """
+    # @Synopsis  a free local port
+    # @Returns   port
+    """
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def startServer(script_name, options):
+    """
+    # @Synopsis  start a stub in a process and wait for it to listen
+    # @Args script_name bos_stub.py or webhdfs_stub.py
+    # @Args options list of command line options other than the port
+    # @Returns   tuple of process and port
+    """
+    port = getFreePort()
+    process = subprocess.Popen([sys.executable, os.path.join(BENCH_PATH, script_name),
+        '--port', str(port)] + options, stdout=open(os.devnull, 'w'))
+    for i in range(100):
+        try:
+            socket.create_connection(('127.0.0.1', port), 1).close()
+            return process, port
+        except socket.error as e:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError('{} failed to start on port {}'.format(script_name, port))
+
+
+def startStub(args):
+    """
+    # @Synopsis  start the BOS stub in a process and wait for it to listen
+    # @Args args command line arguments
+    # @Returns   tuple of process and port
+    """
+    return startServer('bos_stub.py', ['--latency', str(args.latency),
+        '--bandwidth', str(args.bandwidth), '--error-rate', str(args.error_rate)])
+
+
+def startWebHDFSStub(data_root_path, args):
+    """
+    # @Synopsis  start the WebHDFS stub serving the generated files in a
+    # process and wait for it to listen
+    # @Args data_root_path directory of the generated files
+    # @Args args command line arguments
+    # @Returns   tuple of process and port
+    """
+    return startServer('webhdfs_stub.py', ['--root', data_root_path,
+        '--latency', str(args.hdfs_latency)])
+
+
+def prepareProject(tool, work_path):
+    """
+    # @Synopsis  copy a project to the work directory as build.sh does, so that
+    # its config and logs are separated from the installed ones
+    # @Args tool hdfs2bos or bos-client
+    # @Args work_path
+    # @Returns   project path in the work directory
+    """
+    project_path = os.path.join(work_path, tool)
+    for sub_dir in ['conf', 'dao', 'bll', 'entry']:
+        shutil.copytree(os.path.join(PROJECT_PATH, tool, sub_dir),
+                os.path.join(project_path, sub_dir),
+                ignore=shutil.ignore_patterns('*.pyc', 'all.cfg'))
+    os.makedirs(os.path.join(project_path, 'log'))
+    os.makedirs(os.path.join(project_path, 'data', 'journal'))
+    return project_path
+
+
+def writeConfig(project_path, port, webhdfs_port, thread_num, metrics_path, args):
+    """
+    # @Synopsis  write all.cfg of a project from its template
+    # @Args project_path
+    # @Args port port of the BOS stub
+    # @Args webhdfs_port port of the WebHDFS stub, None for the cli backend
+    # @Args thread_num
+    # @Args metrics_path metrics textfile
+    # @Args args command line arguments
+    # @Returns   None
+    """
+    config = ConfigParser.RawConfigParser()
+    config.read(os.path.join(project_path, 'conf', 'all.cfg.template'))
+    config.set('BOS', 'host', '127.0.0.1:{}'.format(port))
+    config.set('BOS', 'access_key_id', 'bench')
+    config.set('BOS', 'secret_access_key', 'bench')
+    if config.has_section('HDFS'):
+        config.set('HDFS', 'client_path', os.path.join(BENCH_PATH, 'hadoop_client'))
+        if webhdfs_port is None:
+            config.set('HDFS', 'backend', 'cli')
+        else:
+            config.set('HDFS', 'backend', 'webhdfs')
+            config.set('HDFS', 'webhdfs_host', '127.0.0.1')
+            config.set('HDFS', 'webhdfs_port', webhdfs_port)
+            config.set('HDFS', 'webhdfs_user', 'bench')
+    for option in ['thread_num', 'download_thread_num', 'upload_thread_num',
+            'stream_thread_num']:
+        if config.has_option('TRANSFER', option):
+            config.set('TRANSFER', option, thread_num)
+    config.set('TRANSFER', 'adaptive_concurrency', 1 if args.adaptive else 0)
+    config.set('TRANSFER', 'process_num', args.process_num)
+    config.set('METRICS', 'textfile', metrics_path)
+    # written once at the end
+    config.set('METRICS', 'textfile_interval', 3600)
+    config.set('LOG', 'mail_interval', 3600)
+    config_file = open(os.path.join(project_path, 'conf', 'all.cfg'), 'w')
+    config.write(config_file)
+    config_file.close()
+
+
+def parseMetrics(metrics_path):
+    """
+    # @Synopsis  latency percentiles of each stage from the metrics textfile,
+    # interpolated within the histogram buckets
+    # @Args metrics_path
+    # @Returns   dict of stage to dict of count, mean and percentiles
+    """
+    buckets = collections.defaultdict(list)
+    sums = {}
+    counts = {}
+    if not os.path.exists(metrics_path):
+        return {}
+    for line in open(metrics_path):
+        if not line.startswith('transfer_stage_seconds'):
+            continue
+        name_labels, value = line.rsplit(' ', 1)
+        name, _, labels = name_labels.partition('{')
+        labels = dict(x.split('=', 1) for x in labels.rstrip('}').split(','))
+        stage = labels['stage'].strip('"')
+        if name.endswith('_bucket'):
+            bound = float(labels['le'].strip('"').replace('+Inf', 'inf'))
+            buckets[stage].append((bound, float(value)))
+        elif name.endswith('_sum'):
+            sums[stage] = float(value)
+        elif name.endswith('_count'):
+            counts[stage] = int(value)
+
+    stages = {}
+    for stage, count in counts.items():
+        if count == 0:
+            continue
+        stage_info = {'count': count, 'mean': sums[stage] / count}
+        stage_buckets = sorted(buckets[stage])
+        for percentile in PERCENTILES:
+            rank = count * percentile / 100.0
+            lower_bound, lower_cnt = 0.0, 0.0
+            for bound, cumulative_cnt in stage_buckets:
+                if cumulative_cnt >= rank:
+                    if bound == float('inf'):
+                        # beyond the largest bound
+                        value = lower_bound
+                    else:
+                        value = lower_bound + (bound - lower_bound) * \
+                                (rank - lower_cnt) / max(cumulative_cnt - lower_cnt, 1)
+                    break
+                lower_bound, lower_cnt = bound, cumulative_cnt
+            stage_info['p{}'.format(percentile)] = value
+        stages[stage] = stage_info
+    return stages
+
+
+def countFailures(project_path):
+    """
+    # @Synopsis  number of files failed, by the failure log
+    # @Args project_path
+    # @Returns   failure_cnt
+    """
+    failure_log_path = os.path.join(project_path, 'log', 'failure.log')
+    if not os.path.exists(failure_log_path):
+        return 0
+    return sum(1 for line in open(failure_log_path))
+
+
+def runTool(project_path, cmd, env, metrics_path):
+    """
+    # @Synopsis  run a tool and measure it
+    # @Args project_path
+    # @Args cmd arguments of entry/transfer.py
+    # @Args env
+    # @Args metrics_path
+    # @Returns   dict of seconds, exit status, failure_cnt and stages
+    """
+    log_file = open(os.path.join(project_path, 'log', 'stdout.log'), 'a')
+    start_time = time.time()
+    status = subprocess.call([sys.executable, 'transfer.py'] + cmd,
+            cwd=os.path.join(project_path, 'entry'), env=env, stdout=log_file,
+            stderr=subprocess.STDOUT)
+    seconds = time.time() - start_time
+    log_file.close()
+    return {
+        'seconds': seconds,
+        'status': status,
+        'failure_cnt': countFailures(project_path),
+        'stages': parseMetrics(metrics_path),
+        }
+
+
+def runCase(tool, mode, distribution_name, thread_num, data_root_path, work_root_path,
+        args):
+    """
+    # @Synopsis  run a benchmark case in a fresh work directory and BOS stub.
+    # bos-client get cases upload the files by put first
+    # @Args tool hdfs2bos or bos-client
+    # @Args mode cache or stream for hdfs2bos, put or get for bos-client
+    # @Args distribution_name
+    # @Args thread_num
+    # @Args data_root_path directory of the generated files
+    # @Args work_root_path
+    # @Args args command line arguments
+    # @Returns   dict of the result
+    """
+    data_path = os.path.join(data_root_path, distribution_name)
+    file_cnt, total_size = generateFiles(data_path, DISTRIBUTIONS[distribution_name],
+            args.seed)
+    work_path = tempfile.mkdtemp(prefix='{}_{}_{}_{}_'.format(tool, mode,
+        distribution_name, thread_num), dir=work_root_path)
+    project_path = prepareProject(tool, work_path)
+    metrics_path = os.path.join(work_path, 'metrics.prom')
+    env = dict(os.environ)
+    env['FAKE_HDFS_ROOT'] = data_root_path
+    env['FAKE_HADOOP_DELAY'] = str(args.hadoop_delay)
+    stub_process, port = startStub(args)
+    webhdfs_process, webhdfs_port = None, None
+    try:
+        if tool == 'hdfs2bos' and args.hdfs_backend == 'webhdfs':
+            webhdfs_process, webhdfs_port = startWebHDFSStub(data_root_path, args)
+        writeConfig(project_path, port, webhdfs_port, thread_num, metrics_path, args)
+        bos_path = 'bench/{}'.format(distribution_name)
+        if tool == 'hdfs2bos':
+            cmd = ([] if mode == 'cache' else ['-s']) + [BUCKET_NAME, 'line',
+                    '/' + distribution_name, bos_path]
+        elif mode == 'put':
+            cmd = [BUCKET_NAME, 'put', data_path, bos_path]
+        else:
+            put_result = runTool(project_path, [BUCKET_NAME, 'put', data_path, bos_path],
+                    env, os.path.join(work_path, 'put_metrics.prom'))
+            if put_result['status'] != 0 or put_result['failure_cnt'] > 0:
+                raise RuntimeError('failed to put the files to get, see {}'.format(
+                    project_path))
+            cmd = [BUCKET_NAME, 'get', bos_path, os.path.join(work_path, 'get')]
+        result = runTool(project_path, cmd, env, metrics_path)
+    finally:
+        for process in [stub_process, webhdfs_process]:
+            if process is not None:
+                process.kill()
+                process.wait()
+
+    result.update({
+        'tool': tool,
+        'mode': mode,
+        'distribution': distribution_name,
+        'thread_num': thread_num,
+        'process_num': args.process_num,
+        'hdfs_backend': args.hdfs_backend if tool == 'hdfs2bos' else None,
+        'file_cnt': file_cnt,
+        'total_size': total_size,
+        'files_per_sec': file_cnt / result['seconds'],
+        'mb_per_sec': float(total_size) / 1024 / 1024 / result['seconds'],
+        })
+    if args.keep:
+        result['work_path'] = work_path
+    else:
+        shutil.rmtree(work_path, True)
+    return result
+
+
+def getVersion():
+    """
+    # @Synopsis  git commit of the tree benchmarked
+    # @Returns   commit id, None if not in git
+    """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=PROJECT_PATH,
+                stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError) as e:
+        return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=('benchmark hdfs2bos and bos-client '
+        'end to end against a local BOS stub and a fake hadoop client'))
+    parser.add_argument('--cases', default='hdfs2bos:cache,hdfs2bos:stream,bos-client:put,'
+        'bos-client:get', help='comma separated tool:mode, default %(default)s')
+    parser.add_argument('--distributions', default='small,medium,mixed', help=('comma '
+        'separated file size distributions of {}, default %(default)s').format(
+            ', '.join(DISTRIBUTIONS.keys())))
+    parser.add_argument('--threads', default='1,4,16', help=('comma separated thread '
+        'numbers, default %(default)s'))
+    parser.add_argument('--adaptive', action='store_true', help=('adjust the concurrency '
+        'at runtime, the thread numbers are the maximum'))
+    parser.add_argument('--process-num', type=int, default=0, help=('worker processes '
+        'of the transfers, 0 for a single process, default %(default)s'))
+    parser.add_argument('--latency', type=float, default=0.01, help=('seconds added to '
+        'each BOS request, default %(default)s'))
+    parser.add_argument('--bandwidth', type=int, default=0, help=('bytes per second of '
+        'the BOS stub, 0 for unlimited'))
+    parser.add_argument('--error-rate', type=float, default=0, help=('ratio of BOS '
+        'requests failed by 503'))
+    parser.add_argument('--hadoop-delay', type=float, default=0.5, help=('seconds slept '
+        'by each hadoop command in place of the JVM start-up, default %(default)s'))
+    parser.add_argument('--hdfs-backend', choices=['cli', 'webhdfs'], default='cli',
+            help=('hdfs backend of hdfs2bos, the fake hadoop client or the WebHDFS '
+                'stub, default %(default)s'))
+    parser.add_argument('--hdfs-latency', type=float, default=0, help=('seconds added '
+        'to each request to the WebHDFS stub'))
+    parser.add_argument('--repeat', type=int, default=1, help='runs of each case')
+    parser.add_argument('--seed', type=int, default=0, help='random seed of file sizes')
+    parser.add_argument('--work-dir', help=('directory of generated files and runs, '
+        'a temporary directory by default'))
+    parser.add_argument('--keep', action='store_true', help=('keep the work directory '
+        'of each run, including its logs'))
+    parser.add_argument('-o', '--output', help='json output file, stdout by default')
+    args = parser.parse_args()
+
+    work_root_path = args.work_dir or tempfile.mkdtemp(prefix='bench_')
+    data_root_path = os.path.join(work_root_path, 'hdfs')
+    if not os.path.exists(data_root_path):
+        os.makedirs(data_root_path)
+    results = []
+    for case in args.cases.split(','):
+        tool, mode = case.split(':')
+        for distribution_name in args.distributions.split(','):
+            for thread_num in map(int, args.threads.split(',')):
+                for i in range(args.repeat):
+                    sys.stderr.write('running {} {} {} thread_num = {}\n'.format(tool, mode,
+                        distribution_name, thread_num))
+                    result = runCase(tool, mode, distribution_name, thread_num,
+                            data_root_path, work_root_path, args)
+                    sys.stderr.write(('{:.1f}s, {:.1f} files/s, {:.2f} MB/s, '
+                        'failure_cnt = {}\n').format(result['seconds'],
+                            result['files_per_sec'], result['mb_per_sec'],
+                            result['failure_cnt']))
+                    results.append(result)
+
+    report = {
+        'version': getVersion(),
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'stub': {
+            'latency': args.latency,
+            'bandwidth': args.bandwidth,
+            'error_rate': args.error_rate,
+            'hadoop_delay': args.hadoop_delay,
+            'hdfs_latency': args.hdfs_latency,
+            },
+        'results': results,
+        }
+    output = open(args.output, 'w') if args.output else sys.stdout
+    json.dump(report, output, indent=2, sort_keys=True)
+    output.write('\n')
+    if not args.work_dir and not args.keep:
+        shutil.rmtree(work_root_path, True)
@@ -0,0 +1,186 @@
+"""
+# @file webhdfs_stub.py
+# @Synopsis  local stand-in of the WebHDFS api of a namenode and its
+# datanodes for benchmarks and tests, serving a local directory as hdfs.
+# Latency and truncated reads can be injected. Supported: LISTSTATUS and OPEN,
+# which is redirected to the datanode as the namenode does
+# @author Ming Gu(guming@itv.baidu.com))
+# @version 1.0
+# @date 2017-01-05
+"""
+import os
+import sys
+import time
+import json
+import random
+import urllib
+import urlparse
+import argparse
+import BaseHTTPServer
+import SocketServer
+
+# bytes read or written at a time
+CHUNK_SIZE = 64 * 1024
+WEBHDFS_PREFIX = '/webhdfs/v1'
+
+
+class WebHDFSStubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    # @Synopsis  http handler of the WebHDFS api, keep-alive. The server is
+    # both the namenode and the datanode, an OPEN without the datanode
+    # parameter is redirected to the datanode
+    """
+    protocol_version = 'HTTP/1.1'
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        """
+        # @Synopsis  requests are not logged
+        # @Returns   None
+        """
+        pass
+
+    def reply(self, status, body='', headers=None):
+        """
+        # @Synopsis  send a response
+        # @Args status
+        # @Args body
+        # @Args headers dict
+        # @Returns   None
+        """
+        self.send_response(status)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def replyError(self, status, exception, message):
+        """
+        # @Synopsis  send an error response in the WebHDFS format
+        # @Args status
+        # @Args exception java exception name
+        # @Args message
+        # @Returns   None
+        """
+        self.reply(status, json.dumps({'RemoteException': {'exception': exception,
+            'javaClassName': 'java.io.' + exception, 'message': message}}),
+            {'Content-Type': 'application/json'})
+
+    def do_GET(self):
+        """
+        # @Synopsis  LISTSTATUS or OPEN
+        # @Returns   None
+        """
+        if self.server.latency > 0:
+            time.sleep(self.server.latency)
+        url = urlparse.urlparse(self.path)
+        query = dict(urlparse.parse_qsl(url.query, keep_blank_values=True))
+        hdfs_path = urllib.unquote(url.path)
+        if not hdfs_path.startswith(WEBHDFS_PREFIX):
+            return self.replyError(404, 'FileNotFoundException', 'not a webhdfs path')
+        hdfs_path = hdfs_path[len(WEBHDFS_PREFIX):] or '/'
+        local_path = self.server.root_path + hdfs_path
+        if not os.path.exists(local_path):
+            return self.replyError(404, 'FileNotFoundException',
+                    'File {} does not exist.'.format(hdfs_path))
+        op = query.get('op', '').upper()
+        if op == 'LISTSTATUS':
+            return self.listStatus(local_path)
+        if op == 'OPEN':
+            return self.open(local_path, query)
+        self.replyError(400, 'IllegalArgumentException', 'unsupported op {}'.format(op))
+
+    def listStatus(self, local_path):
+        """
+        # @Synopsis  list a directory, or the status of a file with an empty
+        # path suffix
+        # @Args local_path
+        # @Returns   None
+        """
+        if os.path.isdir(local_path):
+            names = sorted(os.listdir(local_path))
+        else:
+            names = ['']
+        statuses = []
+        for name in names:
+            path = os.path.join(local_path, name) if name else local_path
+            is_dir = os.path.isdir(path)
+            statuses.append({
+                'pathSuffix': name,
+                'type': 'DIRECTORY' if is_dir else 'FILE',
+                'length': 0 if is_dir else os.path.getsize(path),
+                'modificationTime': int(os.path.getmtime(path) * 1000),
+                })
+        self.reply(200, json.dumps({'FileStatuses': {'FileStatus': statuses}}),
+                {'Content-Type': 'application/json'})
+
+    def open(self, local_path, query):
+        """
+        # @Synopsis  redirect to the datanode, or send the file from the
+        # datanode. A truncated response sends the full Content-Length but
+        # closes the connection half way, as a datanode dying does
+        # @Args local_path
+        # @Args query
+        # @Returns   None
+        """
+        if os.path.isdir(local_path):
+            return self.replyError(400, 'FileNotFoundException', 'Path is not a file')
+        if 'datanode' not in query:
+            location = 'http://{}:{}{}&datanode=true'.format(self.server.server_name_host,
+                    self.server.server_port, self.path)
+            return self.reply(307, '', {'Location': location})
+        size = os.path.getsize(local_path)
+        send_size = size
+        if self.server.truncate_rate > 0 and random.random() < self.server.truncate_rate:
+            send_size = size / 2
+            self.close_connection = 1
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(size))
+        self.end_headers()
+        local_file = open(local_path, 'rb')
+        try:
+            while send_size > 0:
+                chunk = local_file.read(min(CHUNK_SIZE, send_size))
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+                send_size -= len(chunk)
+        finally:
+            local_file.close()
+
+
+class WebHDFSStubServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    # @Synopsis  threaded WebHDFS stub server
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, root_path, latency=0, truncate_rate=0):
+        BaseHTTPServer.HTTPServer.__init__(self, address, WebHDFSStubHandler)
+        self.server_name_host = address[0]
+        self.root_path = root_path.rstrip('/')
+        self.latency = latency
+        self.truncate_rate = truncate_rate
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='local stand-in of WebHDFS for benchmarks')
+    parser.add_argument('--host', default='127.0.0.1', help='listen host')
+    parser.add_argument('--port', type=int, default=50070, help='listen port')
+    parser.add_argument('--root', default=os.environ.get('FAKE_HDFS_ROOT', '/tmp/fake_hdfs'),
+            help='local directory served as hdfs, FAKE_HDFS_ROOT by default')
+    parser.add_argument('--latency', type=float, default=0, help=('seconds added to each '
+        'request'))
+    parser.add_argument('--truncate-rate', type=float, default=0, help=('ratio of file '
+        'reads cut short by closing the connection half way'))
+    args = parser.parse_args()
+    server = WebHDFSStubServer((args.host, args.port), args.root, args.latency,
+            args.truncate_rate)
+    sys.stdout.write('serving WebHDFS stub of {} on {}:{}\n'.format(args.root, args.host,
+        args.port))
+    sys.stdout.flush()
+    server.serve_forever()
@@ -1,16 +1,25 @@
 """
 # @Synopsis  my bos client
 """
-import os
+import itertools
 import logging
 
-from baidubce.bce_client_configuration import BceClientConfiguration
-from baidubce.auth.bce_credentials import BceCredentials
-from baidubce.services.bos.bos_client import BosClient
-
 from conf.env_config import EnvConfig
+from dao.bos import getBosClient
 from bll.transferor import Uploader
 from bll.transferor import Downloader
+from bll.multipart_upload import MultipartUploader
+from bll.range_download import RangeDownloader
+from bll.parallel_list import ParallelLister
+from bll.pack import PackUploader
+from bll.pack import PackReader
+from bll.pack import getPackPrefix
+from bll.checksum import MD5_META_KEY
+from bll.checksum import DigestReader
+from bll.checksum import verifyMD5
+from bll.compress import COMPRESSION_META_KEY
+from bll.compress import RAW_SIZE_META_KEY
+from bll.compress import DecompressStream
 
 class MyBosClient(object):
     """
@@ -20,75 +29,162 @@ class MyBosClient(object):
     def __init__(self, bucket_name):
         self.bucket_name = bucket_name
         self.bos_client = self.initBosClient()
+        self.multipart_uploader = MultipartUploader(self.bos_client, self.bucket_name)
+        self.range_downloader = RangeDownloader(self.bos_client, self.bucket_name)
+        self.parallel_lister = ParallelLister(self.bos_client, self.bucket_name)
+        self.pack_uploader = PackUploader(self.multipart_uploader)
+        self.pack_reader = PackReader(self.bos_client, self.bucket_name)
 
     def initBosClient(self):
         """
-        # @Synopsis  init baidu bos client
+        # @Synopsis  init baidu bos client, the client and its connection pool
+        # are shared by all threads
         # @Returns   initiated bos client
         """
-        bos_host = EnvConfig.BOS_HOST
-        access_key_id = EnvConfig.ACCESS_KEY_ID
-        secret_access_key = EnvConfig.SECRET_ACCEESS_KEY
-        config = BceClientConfiguration(credentials=BceCredentials(access_key_id,
-            secret_access_key), endpoint = bos_host)
-        config.connection_timeout_in_mills = EnvConfig.BOS_TIMEOUT
-        config.recv_buf_size = EnvConfig.BOS_RECV_BUF_SIZE
-        config.send_buf_size = EnvConfig.BOS_SEND_BUF_SIZE
-        return BosClient(config)
+        return getBosClient()
 
-    def put(self, local_path, bos_path):
+    def put(self, local_path, bos_path, resume=False, pack=False, compress=None):
         """
         # @Synopsis  put local file to bos
         # @Args local_path
         # @Args bos_path
+        # @Args resume whether to resume the previous put
+        # @Args pack whether to pack small files
+        # @Args compress codec to compress files with, None for no compression
         # @Returns   None
         """
-        uploader = Uploader(self)
-        uploader.transfer(local_path, bos_path)
+        uploader = Uploader(self, pack, compress)
+        uploader.transfer(local_path, bos_path, resume)
 
-    def get(self, bos_path, local_path):
+    def get(self, bos_path, local_path, resume=False):
         """
         # @Synopsis  get bos file to local
         # @Args bos_path
         # @Args local_path
+        # @Args resume whether to resume the previous get
         # @Returns   None
         """
         downloader = Downloader(self)
-        downloader.transfer(bos_path, local_path)
+        downloader.transfer(bos_path, local_path, resume)
+
+    def syncPut(self, local_path, bos_path, pack=False):
+        """
+        # @Synopsis  put new or changed local files to bos
+        # @Args local_path
+        # @Args bos_path
+        # @Args pack whether to pack small files
+        # @Returns   None
+        """
+        uploader = Uploader(self, pack)
+        uploader.sync(local_path, bos_path)
+
+    def syncGet(self, bos_path, local_path):
+        """
+        # @Synopsis  get new or changed bos files to local
+        # @Args bos_path
+        # @Args local_path
+        # @Returns   None
+        """
+        downloader = Downloader(self)
+        downloader.sync(bos_path, local_path)
 
     def lsr(self, path):
         """
         # @Synopsis  list all object in bos with the given prefix
         # @Args path
-        # @Returns   list of object keys
-        """
-        MAX_KEY_CNT = 1000
-        file_list = []
-        marker = None
-        while True:
-            response = self.bos_client.list_objects(self.bucket_name,
-                    prefix=path, marker=marker)
-            keys = map(lambda x: x.key.encode('utf8'), response.contents)
-            file_list += keys
-            if len(keys) < MAX_KEY_CNT:
-                break
-            marker = keys[-1]
-        return file_list
+        # @Returns   generator of object keys
+        """
+        return (x['path'] for x in self.lsrWithMeta(path))
+
+    def lsrWithMeta(self, path):
+        """
+        # @Synopsis  list all object in bos with the given prefix, with metadata.
+        # Sub-prefixes are listed concurrently and the objects are streamed
+        # while listing, in no particular order
+        # @Args path
+        # @Returns   generator of object info dicts, including path, size, mtime
+        # in seconds since epoch and etag
+        """
+        return self.parallel_lister.lsr(path)
+
+    def lsrUnpackedWithMeta(self, path, with_packs=True):
+        """
+        # @Synopsis  list all object in bos with the given prefix, with metadata.
+        # The packs directly under the prefix are listed as their members
+        # @Args path
+        # @Args with_packs whether to list the pack members, the packs are left
+        # out anyway
+        # @Returns   generator of object info dicts
+        """
+        pack_prefix = getPackPrefix(path)
+        objects = (x for x in self.lsrWithMeta(path) if not x['path'].startswith(pack_prefix))
+        if not with_packs:
+            return objects
+        return itertools.chain(objects, self.pack_reader.lsr(path))
+
+    def getRawSize(self, bos_path):
+        """
+        # @Synopsis  size of the uncompressed data of a compressed object
+        # @Args bos_path
+        # @Returns   raw size, None if the object is not compressed
+        """
+        response = self.bos_client.get_object_meta_data(self.bucket_name, bos_path)
+        raw_size = getattr(response.metadata,
+                'bce_meta_' + RAW_SIZE_META_KEY.replace('-', '_'), None)
+        return None if raw_size is None else int(raw_size)
 
     def put_object_from_file(self, src_file, dst_file):
         """
-        # @Synopsis  single file put method
+        # @Synopsis  single file put method, large file is uploaded by parts
         # @Args src_file
         # @Args dst_file
-        # @Returns   None
+        # @Returns   md5 of the file, None if uploaded by parts
         """
-        self.bos_client.put_object_from_file(self.bucket_name, dst_file, src_file)
+        return self.multipart_uploader.uploadFile(src_file, dst_file)
 
     def get_object_to_file(self, src_file, dst_file):
         """
-        # @Synopsis  single file get method
+        # @Synopsis  single file get method, large object is downloaded by ranges,
+        # compressed object is decompressed while downloaded by a single GET
         # @Args src_file
         # @Args dst_file
-        # @Returns   None
+        # @Returns   md5 of the object, None if downloaded by ranges
+        """
+        response = self.bos_client.get_object_meta_data(self.bucket_name, src_file)
+        object_size = int(response.metadata.content_length)
+        codec = getattr(response.metadata, 'bce_meta_' + COMPRESSION_META_KEY, None)
+        if codec is None and object_size >= EnvConfig.RANGE_THRESHOLD:
+            self.range_downloader.download(src_file, dst_file, object_size)
+            return None
+        return self.downloadObject(src_file, dst_file, codec)
+
+    def downloadObject(self, src_file, dst_file, codec=None):
+        """
+        # @Synopsis  download an object by a single GET, the md5 is computed while
+        # the object is written to local file, and verified against the md5 in
+        # the user metadata if the object has one
+        # @Args src_file
+        # @Args dst_file
+        # @Args codec codec to decompress the object with, None if the object is
+        # not compressed
+        # @Returns   md5 of the object, of the compressed data if compressed
         """
-        self.bos_client.get_object_to_file(self.bucket_name, src_file, dst_file)
+        response = self.bos_client.get_object(self.bucket_name, src_file)
+        try:
+            reader = DigestReader(response.data)
+            stream = reader if codec is None else DecompressStream(reader, codec)
+            dst_obj = open(dst_file, 'wb')
+            try:
+                while True:
+                    buf = stream.read(EnvConfig.BOS_RECV_BUF_SIZE)
+                    if not buf:
+                        break
+                    dst_obj.write(buf)
+            finally:
+                dst_obj.close()
+        finally:
+            response.data.close()
+        expected_md5 = response.metadata.user_metadata.get(MD5_META_KEY)
+        if expected_md5 is not None:
+            verifyMD5(src_file, expected_md5, reader.hexdigest())
+        return reader.hexdigest()
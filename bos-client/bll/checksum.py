@@ -0,0 +1,138 @@
+"""
+# @file checksum.py
+# @Synopsis  md5 checksums computed while the data is read for transfer, so
+# that verifying a transfer takes no extra pass over the data
+# @author Ming Gu(guming@itv.baidu.com))
+# @version 1.0
+# @date 2016-12-28
+"""
+import base64
+import hashlib
+
+# user metadata key of the md5 of a whole object, set by the uploaders. BOS
+# does not return the md5 of an object uploaded by parts, its etag is derived
+# from the parts
+MD5_META_KEY = 'md5'
+
+
+class ChecksumError(Exception):
+    """
+    # @Synopsis  checksum error class
+    """
+    def __init__(self, message=''):
+        self.message = message
+
+
+class DigestReader(object):
+    """
+    # @Synopsis  file like reader computing the md5 of the data read through
+    # it. It can be passed to the BOS SDK as a request body, the SDK seeks the
+    # body back to its start offset before a retry, which restarts the md5
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        self.start_offset = stream.tell() if hasattr(stream, 'tell') else None
+        self.md5 = hashlib.md5()
+        self.size = 0
+
+    def read(self, size=-1):
+        """
+        # @Synopsis  read from the stream and update the md5
+        # @Args size
+        # @Returns   data read
+        """
+        data = self.stream.read(size)
+        self.md5.update(data)
+        self.size += len(data)
+        return data
+
+    def tell(self):
+        """
+        # @Synopsis  offset of the stream
+        # @Returns   offset
+        """
+        return self.stream.tell()
+
+    def seek(self, offset, whence=0):
+        """
+        # @Synopsis  seek the stream, only back to the start offset
+        # @Args offset
+        # @Args whence
+        # @Returns   None
+        """
+        if offset != self.start_offset or whence != 0:
+            raise ChecksumError('digest reader can only seek to its start offset {}'.format(
+                self.start_offset))
+        self.stream.seek(offset)
+        self.md5 = hashlib.md5()
+        self.size = 0
+
+    def hexdigest(self):
+        """
+        # @Synopsis  md5 of the data read so far
+        # @Returns   hex md5
+        """
+        return self.md5.hexdigest()
+
+    def close(self):
+        """
+        # @Synopsis  close the stream
+        # @Returns   None
+        """
+        self.stream.close()
+
+
+class SizeCheckReader(object):
+    """
+    # @Synopsis  file like reader of a stream of known size, such as a hdfs
+    # file being streamed. A stream ending short or running long raises once
+    # it is read to its end, so that the data is never taken as complete
+    """
+    def __init__(self, stream, expected_size, name):
+        self.stream = stream
+        self.expected_size = expected_size
+        self.name = name
+        self.size = 0
+
+    def read(self, size=-1):
+        """
+        # @Synopsis  read from the stream and check its size at the end
+        # @Args size
+        # @Returns   data read
+        """
+        data = self.stream.read(size)
+        self.size += len(data)
+        at_end = size < 0 or len(data) < size
+        if self.size > self.expected_size or (at_end and self.size != self.expected_size):
+            raise ChecksumError('size mismatch of {}, {} expected but {} read'.format(
+                self.name, self.expected_size, self.size))
+        return data
+
+    def close(self):
+        """
+        # @Synopsis  close the stream
+        # @Returns   None
+        """
+        self.stream.close()
+
+
+def getContentMD5(hex_md5):
+    """
+    # @Synopsis  value of the Content-MD5 header of an md5
+    # @Args hex_md5
+    # @Returns   base64 encoded md5
+    """
+    return base64.standard_b64encode(hex_md5.decode('hex'))
+
+
+def verifyMD5(name, expected_md5, actual_md5):
+    """
+    # @Synopsis  compare an md5 with the expected one, such as an etag
+    # @Args name name of the data used in the error message
+    # @Args expected_md5 hex md5
+    # @Args actual_md5 hex md5
+    # @Returns   None
+    """
+    if expected_md5.strip('"').lower() != actual_md5:
+        raise ChecksumError('md5 mismatch of {}, {} expected but {} transferred'.format(
+            name, expected_md5, actual_md5))
@@ -0,0 +1,276 @@
+"""
+# @file pack.py
+# @Synopsis  pack small files into large pack objects, each with a compact
+# index object, members of a pack are read back by byte ranges
+# @author Ming Gu(guming@itv.baidu.com))
+# @version 1.0
+# @date 2016-12-21
+"""
+import os
+import time
+import logging
+
+from conf.env_config import EnvConfig
+
+general_logger = logging.getLogger(EnvConfig.GENERAL_LOG_NAME)
+
+# packs of a destination path are kept in this directory under it, a pack is
+# a data object holding the concatenated members and an index object, which
+# is put after the data object and lists the members as lines of
+# offset\tsize\tmtime\trelative_path, relative to the destination path
+PACK_DIR_NAME = '.pack'
+DATA_SUFFIX = '.dat'
+INDEX_SUFFIX = '.idx'
+# member paths of a pack are passed to a single hadoop fs -cat in hdfs2bos
+MAX_PACK_FILE_CNT = 1000
+
+
+class PackError(Exception):
+    """
+    # @Synopsis  pack error class
+    """
+    def __init__(self, message=''):
+        self.message = message
+
+
+def getPackPrefix(root_path):
+    """
+    # @Synopsis  prefix of the packs of a destination path
+    # @Args root_path
+    # @Returns   pack prefix
+    """
+    return os.path.join(root_path, PACK_DIR_NAME) + '/'
+
+
+def getPackRootPath(pack_key):
+    """
+    # @Synopsis  destination path of a pack, which the member paths are
+    # relative to
+    # @Args pack_key
+    # @Returns   destination path
+    """
+    return os.path.dirname(os.path.dirname(pack_key))
+
+
+def groupPacks(transfers, dst_root_path, get_size, pack_size=EnvConfig.PACK_SIZE,
+        file_threshold=EnvConfig.PACK_FILE_THRESHOLD):
+    """
+    # @Synopsis  group files smaller than the threshold into packs of about
+    # pack size in listing order, larger files are left alone
+    # @Args transfers iterable of transfers of single files
+    # @Args dst_root_path destination path of the transfers
+    # @Args get_size function returning the size of the file of a transfer
+    # @Args pack_size
+    # @Args file_threshold
+    # @Returns   generator of tuples of pack key and list of transfers, the pack
+    # key is None for a large file which is transferred alone
+    """
+    pack_name_prefix = 'pack-{}-'.format(time.strftime('%Y%m%d%H%M%S'))
+    pack_cnt = 0
+    members = []
+    members_size = 0
+    for transfer in transfers:
+        size = get_size(transfer)
+        if size >= file_threshold:
+            yield None, [transfer]
+            continue
+        members.append(transfer)
+        members_size += size
+        if members_size >= pack_size or len(members) >= MAX_PACK_FILE_CNT:
+            yield os.path.join(getPackPrefix(dst_root_path),
+                    '{}{:06d}'.format(pack_name_prefix, pack_cnt)), members
+            pack_cnt += 1
+            members = []
+            members_size = 0
+    if len(members) > 0:
+        yield os.path.join(getPackPrefix(dst_root_path),
+                '{}{:06d}'.format(pack_name_prefix, pack_cnt)), members
+
+
+class ConcatStream(object):
+    """
+    # @Synopsis  file like stream of files concatenated, each file is opened
+    # when the previous one is read to the end
+    """
+    def __init__(self, opener, names):
+        self.opener = opener
+        self.names = list(names)
+        self.stream = None
+
+    def read(self, size):
+        """
+        # @Synopsis  read at most size bytes, less only at the end of the last
+        # file
+        # @Args size
+        # @Returns   data read, empty string at the end of the last file
+        """
+        chunks = []
+        remain_size = size
+        while remain_size > 0:
+            if self.stream is None:
+                if len(self.names) == 0:
+                    break
+                self.stream = self.opener(self.names.pop(0))
+            data = self.stream.read(remain_size)
+            if not data:
+                self.stream.close()
+                self.stream = None
+                continue
+            chunks.append(data)
+            remain_size -= len(data)
+        return ''.join(chunks)
+
+    def close(self):
+        """
+        # @Synopsis  close the file being read
+        # @Returns   None
+        """
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+
+
+class PackUploader(object):
+    """
+    # @Synopsis  pack uploader, upload the data object of a pack from a stream
+    # or a local file, then put its index object
+    """
+    def __init__(self, multipart_uploader):
+        self.multipart_uploader = multipart_uploader
+        self.bos_client = multipart_uploader.bos_client
+        self.bucket_name = multipart_uploader.bucket_name
+
+    def uploadStream(self, stream, pack_key, members):
+        """
+        # @Synopsis  upload a pack from the stream of its concatenated members
+        # @Args stream file like object
+        # @Args pack_key
+        # @Args members list of tuples of destination path and size
+        # @Returns   tuple of total size and md5 of the pack
+        """
+        pack_size, md5 = self.multipart_uploader.uploadStream(stream,
+                pack_key + DATA_SUFFIX, pack_key)
+        self.putIndex(pack_key, members, pack_size)
+        return pack_size, md5
+
+    def uploadFile(self, src_file, pack_key, members):
+        """
+        # @Synopsis  upload a pack from a local file of its concatenated members
+        # @Args src_file
+        # @Args pack_key
+        # @Args members list of tuples of destination path and size
+        # @Returns   tuple of total size and md5 of the pack, md5 is None if the
+        # pack is uploaded by parts
+        """
+        pack_size = os.path.getsize(src_file)
+        md5 = self.multipart_uploader.uploadFile(src_file, pack_key + DATA_SUFFIX)
+        self.putIndex(pack_key, members, pack_size)
+        return pack_size, md5
+
+    def putIndex(self, pack_key, members, pack_size):
+        """
+        # @Synopsis  put the index object of a pack once its data object is
+        # uploaded, the members are only visible after that
+        # @Args pack_key
+        # @Args members list of tuples of destination path and size
+        # @Args pack_size size of the uploaded data object
+        # @Returns   None
+        """
+        expected_size = sum(map(lambda x: x[1], members))
+        if pack_size != expected_size:
+            raise PackError('size mismatch of pack {}, {} expected but {} uploaded'.format(
+                pack_key, expected_size, pack_size))
+        root_path = getPackRootPath(pack_key)
+        mtime = int(time.time())
+        index_lines = []
+        offset = 0
+        for dst_path, size in members:
+            index_lines.append('\t'.join(map(str, [offset, size, mtime,
+                os.path.relpath(dst_path, root_path)])) + '\n')
+            offset += size
+        self.bos_client.put_object_from_string(self.bucket_name, pack_key + INDEX_SUFFIX,
+                ''.join(index_lines))
+        general_logger.debug('uploaded pack {}, file_cnt = {}, size = {}'.format(pack_key,
+            len(members), pack_size))
+
+
+class PackReader(object):
+    """
+    # @Synopsis  pack reader, list the members of the packs of a destination
+    # path and get a member by a byte range of its pack
+    """
+    def __init__(self, bos_client, bucket_name):
+        self.bos_client = bos_client
+        self.bucket_name = bucket_name
+
+    def lsr(self, root_path):
+        """
+        # @Synopsis  list the members of all packs of a destination path
+        # @Args root_path
+        # @Returns   generator of member info dicts, including path, size, mtime,
+        # etag(always None), pack_key and offset
+        """
+        marker = None
+        while True:
+            response = self.bos_client.list_objects(self.bucket_name,
+                    prefix=getPackPrefix(root_path), marker=marker)
+            index_keys = map(lambda x: x.key.encode('utf8'), response.contents)
+            for index_key in index_keys:
+                if index_key.endswith(INDEX_SUFFIX):
+                    for member in self.readIndex(index_key):
+                        yield member
+            if not response.is_truncated or len(index_keys) == 0:
+                break
+            marker = index_keys[-1]
+
+    def readIndex(self, index_key):
+        """
+        # @Synopsis  read the index object of a pack
+        # @Args index_key
+        # @Returns   list of member info dicts
+        """
+        pack_key = index_key[:-len(INDEX_SUFFIX)]
+        root_path = getPackRootPath(pack_key)
+        index_data = self.bos_client.get_object_as_string(self.bucket_name, index_key)
+        members = []
+        for line in index_data.split('\n'):
+            if line == '':
+                continue
+            offset, size, mtime, relative_path = line.split('\t', 3)
+            members.append(dict({
+                'path': os.path.join(root_path, relative_path),
+                'size': int(size),
+                'mtime': int(mtime),
+                'etag': None,
+                'pack_key': pack_key,
+                'offset': int(offset)
+                }))
+        return members
+
+    def get(self, member, dst_file):
+        """
+        # @Synopsis  get a member to local file by a byte range of its pack
+        # @Args member member info dict
+        # @Args dst_file
+        # @Returns   None
+        """
+        dst_obj = open(dst_file, 'wb')
+        try:
+            if member['size'] == 0:
+                return
+            response = self.bos_client.get_object(self.bucket_name,
+                    member['pack_key'] + DATA_SUFFIX,
+                    range=(member['offset'], member['offset'] + member['size'] - 1))
+            try:
+                remain_size = member['size']
+                while remain_size > 0:
+                    buf = response.data.read(min(remain_size, EnvConfig.BOS_RECV_BUF_SIZE))
+                    if not buf:
+                        raise PackError('connection closed with {} bytes left'.format(
+                            remain_size))
+                    dst_obj.write(buf)
+                    remain_size -= len(buf)
+            finally:
+                response.data.close()
+        finally:
+            dst_obj.close()
@@ -0,0 +1,182 @@
+"""
+# @file parallel_list.py
+# @Synopsis  list bos objects of a prefix by sub-prefix shards concurrently
+# @author Ming Gu(guming@itv.baidu.com))
+# @version 1.0
+# @date 2016-12-20
+"""
+import time
+# time.strptime imports _strptime on first call, which is not thread safe
+import _strptime
+import calendar
+import threading
+import Queue
+import logging
+
+from conf.env_config import EnvConfig
+
+MAX_KEY_CNT = 1000
+DELIMITER = '/'
+
+general_logger = logging.getLogger(EnvConfig.GENERAL_LOG_NAME)
+
+
+class ParallelListError(Exception):
+    """
+    # @Synopsis  parallel list error class
+    """
+    def __init__(self, message=''):
+        self.message = message
+
+
+def mapObjectInfo(bos_object):
+    """
+    # @Synopsis  map listed object to object info dict
+    # @Args bos_object
+    # @Returns   object info dict, including path, size, mtime in seconds since
+    # epoch and etag
+    """
+    return dict({
+        'path': bos_object.key.encode('utf8'),
+        'size': int(bos_object.size),
+        'mtime': calendar.timegm(time.strptime(bos_object.last_modified,
+            '%Y-%m-%dT%H:%M:%SZ')),
+        'etag': bos_object.etag
+        })
+
+
+class ParallelLister(object):
+    """
+    # @Synopsis  list all objects of a prefix by listing it with a delimiter,
+    # the common prefixes found are listed as shards by a pool of threads in the
+    # same way, so that the directory tree of the bucket is listed level by
+    # level concurrently. Objects are streamed to the caller page by page while
+    # the listing goes on
+    """
+    def __init__(self, bos_client, bucket_name, thread_num=EnvConfig.LIST_THREAD_NUM):
+        self.bos_client = bos_client
+        self.bucket_name = bucket_name
+        self.thread_num = thread_num
+
+    def lsr(self, prefix):
+        """
+        # @Synopsis  list all objects with the given prefix, in no particular
+        # order. Listing is stopped if the generator is closed before the end,
+        # the list threads are joined before the generator returns
+        # @Args prefix
+        # @Returns   generator of object info dicts
+        """
+        task = dict({
+            'prefix_queue': Queue.Queue(),
+            # pages of objects, None when a thread ends
+            'object_queue': Queue.Queue(self.thread_num * 2),
+            'pending_cnt': 1,
+            'shard_cnt': 0,
+            'stopped': False,
+            'errors': [],
+            'lock': threading.Lock()
+            })
+        task['prefix_queue'].put(prefix)
+        list_threads = []
+        for i in range(self.thread_num):
+            list_thread = ShardListThread(self, task)
+            list_thread.daemon = True
+            list_thread.start()
+            list_threads.append(list_thread)
+
+        ended_thread_cnt = 0
+        object_cnt = 0
+        try:
+            while ended_thread_cnt < self.thread_num:
+                objects = task['object_queue'].get()
+                if objects is None:
+                    ended_thread_cnt += 1
+                    continue
+                for bos_object in objects:
+                    object_cnt += 1
+                    yield bos_object
+        finally:
+            # let the threads finish the pending shards without listing them,
+            # they may be blocked on the full object queue
+            task['stopped'] = True
+            while ended_thread_cnt < self.thread_num:
+                if task['object_queue'].get() is None:
+                    ended_thread_cnt += 1
+            for list_thread in list_threads:
+                list_thread.join()
+        if len(task['errors']) > 0:
+            raise ParallelListError('failed to list {}: {}'.format(prefix,
+                task['errors'][0].message))
+        general_logger.debug('listed {}: {} objects in {} shards'.format(prefix, object_cnt,
+            task['shard_cnt']))
+
+    def listShard(self, task, prefix):
+        """
+        # @Synopsis  list objects of a shard page by page, the common prefixes
+        # of the shard are queued as new shards
+        # @Args task
+        # @Args prefix prefix of the shard
+        # @Returns   None
+        """
+        marker = None
+        while not task['stopped']:
+            response = self.bos_client.list_objects(self.bucket_name, max_keys=MAX_KEY_CNT,
+                    prefix=prefix, marker=marker, delimiter=DELIMITER)
+            common_prefixes = getattr(response, 'common_prefixes', None) or []
+            task['lock'].acquire()
+            task['pending_cnt'] += len(common_prefixes)
+            task['shard_cnt'] += len(common_prefixes)
+            task['lock'].release()
+            for common_prefix in common_prefixes:
+                task['prefix_queue'].put(common_prefix.prefix.encode('utf8'))
+            objects = map(mapObjectInfo, response.contents or [])
+            if len(objects) > 0:
+                task['object_queue'].put(objects)
+            if not response.is_truncated:
+                break
+            marker = getattr(response, 'next_marker', None)
+            if marker is None:
+                # the last key or common prefix of the page, whichever is larger
+                marker = max([x['path'] for x in objects] +
+                        [x.prefix.encode('utf8') for x in common_prefixes])
+
+
+class ShardListThread(threading.Thread):
+    """
+    # @Synopsis  shard list thread, take shards from the prefix queue and list
+    # them until no shard is pending
+    """
+    def __init__(self, lister, task):
+        threading.Thread.__init__(self)
+        self.lister = lister
+        self.task = task
+
+    def run(self):
+        """
+        # @Synopsis  run thread
+        # @Returns   None
+        """
+        task = self.task
+        while True:
+            prefix = task['prefix_queue'].get()
+            if prefix is None:
+                break
+            if not task['stopped']:
+                try:
+                    self.lister.listShard(task, prefix)
+                except Exception as e:
+                    general_logger.warning('failed to list shard {}, message: {}'.format(
+                        prefix, e.message))
+                    task['lock'].acquire()
+                    task['errors'].append(e)
+                    task['lock'].release()
+                    task['stopped'] = True
+            task['lock'].acquire()
+            task['pending_cnt'] -= 1
+            listing_finished = task['pending_cnt'] == 0
+            task['lock'].release()
+            if listing_finished:
+                # one None for each thread to stop it
+                for i in range(self.lister.thread_num):
+                    task['prefix_queue'].put(None)
+        task['object_queue'].put(None)
@@ -0,0 +1,224 @@
+"""
+# @file range_download.py
+# @Synopsis  download large object from BOS by byte ranges, ranges are
+# downloaded concurrently
+# @author Ming Gu(guming@itv.baidu.com))
+# @version 1.0
+# @date 2016-12-13
+"""
+import os
+import threading
+import Queue
+import logging
+
+from conf.env_config import EnvConfig
+from bll.retry import isRetryable
+from bll.retry import getRetryDelay
+from bll.retry import getRetryQueue
+from bll.metrics import recordRetry
+from bll.schedule import NotifyingQueue
+from bll.schedule import split_tasks
+
+general_logger = logging.getLogger(EnvConfig.GENERAL_LOG_NAME)
+
+
+class RangeDownloadError(Exception):
+    """
+    # @Synopsis  range download error class
+    """
+    def __init__(self, message=''):
+        self.message = message
+
+
+class RangeDownloader(object):
+    """
+    # @Synopsis  range downloader, preallocate the destination file, then fetch
+    # byte ranges of the object by a pool of range threads, each range is
+    # written directly to its offset of the destination file. Queued ranges are
+    # also taken by idle transfer workers through the split task registry, a
+    # failed range is retried alone instead of failing the whole object
+    """
+    def __init__(self, bos_client, bucket_name, range_size=EnvConfig.RANGE_SIZE,
+            thread_num=EnvConfig.RANGE_THREAD_NUM):
+        self.bos_client = bos_client
+        self.bucket_name = bucket_name
+        self.range_size = range_size
+        self.thread_num = thread_num
+
+    def download(self, src_key, dst_file, object_size):
+        """
+        # @Synopsis  download an object to local file by ranges
+        # @Args src_key source object key
+        # @Args dst_file local file path
+        # @Args object_size size of the object
+        # @Returns   None
+        """
+        fd = os.open(dst_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0644)
+        try:
+            os.ftruncate(fd, object_size)
+        finally:
+            os.close(fd)
+
+        task = dict({
+            'src_key': src_key,
+            'dst_file': dst_file,
+            'range_queue': NotifyingQueue(),
+            'errors': [],
+            # ranges put but not finished yet, including the ones to be retried
+            'pending_cnt': 0,
+            'condition': threading.Condition()
+            })
+        helper = lambda: self.helpRange(task)
+        offset = 0
+        while offset < object_size:
+            task['pending_cnt'] += 1
+            task['range_queue'].put({
+                'start': offset,
+                'end': min(offset + self.range_size, object_size) - 1,
+                'retry_cnt': 0
+                })
+            offset += self.range_size
+        range_cnt = task['pending_cnt']
+        general_logger.debug('start range download {} --> {}, range_cnt = {}'.format(
+            src_key, dst_file, range_cnt))
+
+        range_threads = []
+        for i in range(min(self.thread_num, range_cnt)):
+            range_thread = RangeDownloadThread(self, task)
+            range_thread.daemon = True
+            range_thread.start()
+            range_threads.append(range_thread)
+        split_tasks.register(helper)
+        # ranges being retried are put back to the range queue later
+        task['condition'].acquire()
+        while task['pending_cnt'] > 0:
+            task['condition'].wait()
+        task['condition'].release()
+        split_tasks.unregister(helper)
+        for range_thread in range_threads:
+            task['range_queue'].put(None)
+        for range_thread in range_threads:
+            range_thread.join()
+
+        if len(task['errors']) > 0:
+            raise RangeDownloadError('range download {} --> {} failed: {}'.format(
+                src_key, dst_file, task['errors'][0]))
+
+    def helpRange(self, task):
+        """
+        # @Synopsis  download a queued range of a task in the calling thread
+        # @Args task
+        # @Returns   True if a range was downloaded
+        """
+        try:
+            download_range = task['range_queue'].get_nowait()
+        except Queue.Empty:
+            return False
+        if download_range is None:
+            # the download is completing, the stop mark is left to its range
+            # threads
+            task['range_queue'].put(None)
+            return False
+        RangeDownloadThread(self, task).processRange(download_range)
+        return True
+
+
+class RangeDownloadThread(threading.Thread):
+    """
+    # @Synopsis  range download thread, take ranges from the range queue of a
+    # download and write them at their offsets, each through its own file
+    # descriptor, until a None is met. A range failed by a retryable error is
+    # put to the retry queue until it runs out of retries. Once any range
+    # failed, the remaining ranges are drained without being downloaded
+    """
+    def __init__(self, downloader, task):
+        threading.Thread.__init__(self)
+        self.downloader = downloader
+        self.task = task
+
+    def run(self):
+        """
+        # @Synopsis  run thread
+        # @Returns   None
+        """
+        while True:
+            download_range = self.task['range_queue'].get()
+            if download_range is None:
+                break
+            self.processRange(download_range)
+
+    def processRange(self, download_range):
+        """
+        # @Synopsis  download a range, or put it to the retry queue if it failed
+        # by a retryable error, or skip it if the download already failed
+        # @Args download_range dict of the first and last byte of the range and
+        # its retry count
+        # @Returns   None
+        """
+        task = self.task
+        start, end = download_range['start'], download_range['end']
+        if len(task['errors']) > 0:
+            self.finishRange()
+            return
+        try:
+            fd = os.open(task['dst_file'], os.O_WRONLY)
+            try:
+                self.downloadRange(fd, start, end)
+            finally:
+                os.close(fd)
+            self.finishRange()
+        except Exception as e:
+            if isRetryable(e, (RangeDownloadError,)) and \
+                    download_range['retry_cnt'] < EnvConfig.RETRY_CNT:
+                download_range['retry_cnt'] += 1
+                delay = getRetryDelay(download_range['retry_cnt'])
+                recordRetry('part', delay)
+                general_logger.debug(('failed to download range {}-{} of {}, retry {}/{} '
+                    'in {:.1f}s: {}').format(start, end, task['src_key'],
+                        download_range['retry_cnt'], EnvConfig.RETRY_CNT, delay,
+                        e.message))
+                getRetryQueue().put(task['range_queue'], download_range, delay)
+                return
+            general_logger.debug('failed to download range {}-{} of {}: {}'.format(
+                start, end, task['src_key'], e.message))
+            task['condition'].acquire()
+            task['errors'].append('range {}-{}: {}'.format(start, end, e.message))
+            task['condition'].release()
+            self.finishRange()
+
+    def finishRange(self):
+        """
+        # @Synopsis  account a range downloaded, failed or skipped
+        # @Returns   None
+        """
+        task = self.task
+        task['condition'].acquire()
+        task['pending_cnt'] -= 1
+        task['condition'].notify_all()
+        task['condition'].release()
+
+    def downloadRange(self, fd, start, end):
+        """
+        # @Synopsis  fetch a byte range and write it to the same offset of the
+        # destination file
+        # @Args fd destination file descriptor owned by this thread
+        # @Args start first byte of the range
+        # @Args end last byte of the range, inclusive
+        # @Returns   None
+        """
+        response = self.downloader.bos_client.get_object(self.downloader.bucket_name,
+                self.task['src_key'], range=(start, end))
+        try:
+            os.lseek(fd, start, os.SEEK_SET)
+            remain_size = end - start + 1
+            while remain_size > 0:
+                buf = response.data.read(min(remain_size, EnvConfig.BOS_RECV_BUF_SIZE))
+                if not buf:
+                    raise RangeDownloadError('connection closed with {} bytes left'.format(
+                        remain_size))
+                written_size = 0
+                while written_size < len(buf):
+                    written_size += os.write(fd, buf[written_size:])
+                remain_size -= len(buf)
+        finally:
+            response.data.close()
@@ -6,9 +6,32 @@
 # @date 2016-12-06
 """
 import os
+import hashlib
+import threading
+import time
+import itertools
 from datetime import datetime
 import logging
 from conf.env_config import EnvConfig
+from dao.journal import TransferJournal
+from dao.bos import getConnectionPool
+from bll.concurrency_controller import ConcurrencyController
+from bll.pack import ConcatStream
+from bll.pack import getPackPrefix
+from bll.pack import groupPacks
+from bll.retry import isRetryable
+from bll.retry import getRetryDelay
+from bll.retry import getRetryQueue
+from bll.compress import CompressStream
+from bll.compress import checkCodec
+from bll.metrics import recordStage
+from bll.metrics import recordRetry
+from bll.metrics import queue_depth
+from bll.metrics import startExporters
+from bll.metrics import stopExporters
+from bll.schedule import SizeQueue
+from bll.schedule import getOrHelp
+from bll.process_pool import ProcessPool
 
 general_logger = logging.getLogger(EnvConfig.GENERAL_LOG_NAME)
 success_logger = logging.getLogger(EnvConfig.SUCCESS_LOG_NAME)
@@ -16,17 +39,39 @@ failure_logger = logging.getLogger(EnvConfig.FAILURE_LOG_NAME)
 
 class Transferor(object):
     """
-    # @Synopsis  transfer manager
+    # @Synopsis  transfer manager, files are transferred concurrently by a
+    # pool of transfer threads. A transfer is [src_file, dst_file] for a single
+    # file, or [pack_key, src_file_0, dst_file_0, src_file_1, dst_file_1, ...]
+    # for small files packed into one pack. Queued files are transferred
+    # largest first with small files as filler. With process_num set, the files
+    # are transferred by a pool of worker processes, the transfer threads hand
+    # them to the workers and keep the retries, journal and progress
     """
-    def __init__(self):
-        pass
+    # stage name of the transfers in metrics
+    stage = 'transfer'
+
+    def __init__(self, bucket_name, thread_num=EnvConfig.TRANSFER_THREAD_NUM):
+        self.bucket_name = bucket_name
+        self.thread_num = thread_num
+        self.journal = None
+        self.controller = None
+        self.process_pool = None
+        self.thread_lock = threading.Lock()
+        # notified once a file is processed
+        self.processed_condition = threading.Condition(self.thread_lock)
+        self.transfer_queue = SizeQueue(lambda x: self.getTransferSize(x[1]),
+                EnvConfig.PLAN_QUEUE_SIZE)
+        self.transfer_file_cnt = 0
+        self.listing_finished = False
+        self.processed_cnt = 0
+        self.failure_cnt = 0
 
     def lsrSrcPath(self, path):
         """
         # @Synopsis  list all files recursively in src path, to be overriden by
         # child classes
         # @Args path
-        # @Returns   list of file paths
+        # @Returns   iterable of file paths
         """
         pass
 
@@ -35,7 +80,25 @@ class Transferor(object):
         # @Synopsis  list all files recursively in dst path, to be overriden by
         # child classes
         # @Args path
-        # @Returns   list of file paths
+        # @Returns   iterable of file paths
+        """
+        pass
+
+    def lsrSrcPathWithMeta(self, path):
+        """
+        # @Synopsis  list all files recursively in src path with their metadata,
+        # to be overriden by child classes
+        # @Args path
+        # @Returns   iterable of file info dicts, including path, size and mtime
+        """
+        pass
+
+    def lsrDstPathWithMeta(self, path):
+        """
+        # @Synopsis  list all files recursively in dst path with their metadata,
+        # to be overriden by child classes
+        # @Args path
+        # @Returns   iterable of file info dicts, including path, size and mtime
         """
         pass
 
@@ -44,108 +107,520 @@ class Transferor(object):
         # @Synopsis  transfer single file, to be overriden
         # @Args src_file
         # @Args dst_file
+        # @Returns   tuple of size and md5 of the file, md5 is None if not known
+        """
+        return 0, None
+
+    def transferPack(self, pack_key, members):
+        """
+        # @Synopsis  transfer small files as a pack, to be overriden by child
+        # classes supporting packing
+        # @Args pack_key
+        # @Args members list of [src_file, dst_file]
+        # @Returns   tuple of size and md5 of the pack, md5 is None if not known
+        """
+        return 0, None
+
+    def transferOne(self, transfer_info):
+        """
+        # @Synopsis  transfer a single file or a pack in the calling thread
+        # @Args transfer_info
+        # @Returns   tuple of size and md5, md5 is None if not known
+        """
+        if len(transfer_info) > 2:
+            return self.transferPack(transfer_info[0],
+                    zip(transfer_info[1::2], transfer_info[2::2]))
+        return self.transferFile(transfer_info[0], transfer_info[1])
+
+    def runTransfer(self, transfer_info):
+        """
+        # @Synopsis  transfer a single file or a pack by a worker process if
+        # there is a process pool, otherwise in the calling thread
+        # @Args transfer_info
+        # @Returns   tuple of size and md5, md5 is None if not known
+        """
+        if self.process_pool is not None:
+            return self.process_pool.call('transferOne', transfer_info)
+        return self.transferOne(transfer_info)
+
+    def getTransferSize(self, transfer_info):
+        """
+        # @Synopsis  size of a transfer for scheduling, to be overriden by child
+        # classes knowing the sizes, files of unknown size are taken as empty
+        # @Args transfer_info
+        # @Returns   size
+        """
+        return 0
+
+    def getSrcRawSize(self, src_object):
+        """
+        # @Synopsis  size of the data of a src file, to be overriden by child
+        # classes whose src files may be stored compressed
+        # @Args src_object file info dict
+        # @Returns   size
+        """
+        return src_object['size']
+
+    def groupTransferList(self, dst_root_path, transfer_list):
+        """
+        # @Synopsis  group the transfer list before it is planned, to be
+        # overriden by child classes supporting packing
+        # @Args dst_root_path
+        # @Args transfer_list iterable of [src_file, dst_file]
+        # @Returns   iterable of transfers
+        """
+        return transfer_list
+
+    def getJournalPath(self, src_root_path, dst_root_path):
+        """
+        # @Synopsis  path of the checkpoint journal of a transfer
+        # @Args src_root_path
+        # @Args dst_root_path
+        # @Returns   journal path
+        """
+        journal_key = '\t'.join([self.__class__.__name__, self.bucket_name,
+            src_root_path, dst_root_path])
+        journal_name = hashlib.md5(journal_key).hexdigest() + '.journal'
+        return os.path.join(EnvConfig.LOCAL_DATA_PATH, 'journal', journal_name)
+
+    def getTransferList(self, src_root_path, dst_root_path):
+        """
+        # @Synopsis  list src path and map src files to dst files
+        # @Args src_root_path
+        # @Args dst_root_path
+        # @Returns   generator of [src_file, dst_file] which lists src path
+        # lazily, None if there is nothing to transfer or the destination is
+        # not empty
+        """
+        dst_exist_files = iter(self.lsrDstPath(dst_root_path))
+        # only the first file is needed, the rest of the listing is stopped
+        dst_exist_file = next(dst_exist_files, None)
+        if hasattr(dst_exist_files, 'close'):
+            dst_exist_files.close()
+        if dst_exist_file is not None:
+            general_logger.warning('Failed to transfer: there are file(s) in destination {}'\
+                    .format(dst_root_path))
+            return None
+
+        src_files = iter(self.lsrSrcPath(src_root_path))
+        src_file = next(src_files, None)
+        if src_file is None:
+            general_logger.warning('No file to transfer in {}'.format(src_root_path))
+            return None
+
+        return ([x, mapDstPath(x, src_root_path, dst_root_path)]
+                for x in itertools.chain([src_file], src_files))
+
+    def getSyncList(self, src_root_path, dst_root_path):
+        """
+        # @Synopsis  list both src path and dst path with metadata, and diff
+        # them in one pass. A src file is to be transferred if it does not
+        # exist in dst, or its size differs, or it is modified later than the
+        # dst file, the size of a src file stored compressed being its raw size.
+        # The dst path is listed first, the src path is listed lazily while the
+        # diff is consumed
+        # @Args src_root_path
+        # @Args dst_root_path
+        # @Returns   generator of [src_file, dst_file] of new or changed files
+        """
+        dst_objects = self.lsrDstPathWithMeta(dst_root_path)
+        dst_object_dict = dict(((mapDstPath(x['path'], dst_root_path, ''), x)
+            for x in dst_objects))
+        sync_file_cnt = 0
+        src_file_cnt = 0
+        for src_object in self.lsrSrcPathWithMeta(src_root_path):
+            src_file_cnt += 1
+            dst_object = dst_object_dict.get(mapDstPath(src_object['path'], src_root_path, ''))
+            if dst_object is None or dst_object['mtime'] < src_object['mtime'] \
+                    or (dst_object['size'] != src_object['size']
+                        and dst_object['size'] != self.getSrcRawSize(src_object)):
+                sync_file_cnt += 1
+                yield [src_object['path'],
+                    mapDstPath(src_object['path'], src_root_path, dst_root_path)]
+        general_logger.info('diff {} --> {}: {}/{} files are new or changed'.format(
+            src_root_path, dst_root_path, sync_file_cnt, src_file_cnt))
+
+    def transfer(self, src_root_path, dst_root_path, resume=False):
+        """
+        # @Synopsis  transfer src path to dst path, see planTransfer. With
+        # process_num set, the worker processes are forked first, before any
+        # listing starts threads which may hold locks the workers would inherit
+        # @Args src_root_path
+        # @Args dst_root_path
+        # @Args resume whether to resume the previous run
+        # @Returns   1 if the destination is not empty or there is nothing to
+        # transfer, None otherwise
+        """
+        self.startProcessPool()
+        try:
+            self.prepareTransfer(src_root_path)
+            return self.planTransfer(src_root_path, dst_root_path, resume)
+        finally:
+            self.stopProcessPool()
+
+    def planTransfer(self, src_root_path, dst_root_path, resume=False):
+        """
+        # @Synopsis  transfer management logic. Every transferred file is
+        # recorded in a checkpoint journal, when resuming, the transfer list is
+        # loaded from the journal of the previous run instead of listing again,
+        # and the files already transferred are skipped. If the previous run
+        # stopped before its listing was complete, src path is listed again
+        # without the files already transferred
+        # @Args src_root_path
+        # @Args dst_root_path
+        # @Args resume whether to resume the previous run
+        # @Returns   1 if the destination is not empty or there is nothing to
+        # transfer, None otherwise
+        """
+        self.journal = TransferJournal(self.getJournalPath(src_root_path, dst_root_path),
+                EnvConfig.GENERAL_LOG_NAME)
+        transfer_list = None
+        done_files = set()
+        if resume:
+            transfer_list, done_files, plan_completed = self.journal.load()
+            if transfer_list is None:
+                general_logger.warning('No journal to resume {} --> {}, start over'.format(
+                    src_root_path, dst_root_path))
+            elif not plan_completed:
+                return self.resumeListing(src_root_path, dst_root_path, transfer_list,
+                        done_files)
+        if transfer_list is None:
+            transfer_list = self.getTransferList(src_root_path, dst_root_path)
+            if transfer_list is None:
+                return 1
+            self.journal.begin()
+            self.transferList(src_root_path, dst_root_path, transfer_list, True)
+        else:
+            self.journal.resume()
+            general_logger.info('resume {} --> {} from journal, skip {}/{} transferred files'\
+                    .format(src_root_path, dst_root_path, len(done_files), len(transfer_list)))
+            transfer_list = filter(lambda x: x[0] not in done_files, transfer_list)
+            self.transferList(src_root_path, dst_root_path, transfer_list)
+
+    def resumeListing(self, src_root_path, dst_root_path, partial_plan, done_files):
+        """
+        # @Synopsis  resume a transfer whose listing was interrupted. The
+        # destination is not empty by the files already transferred, so it is
+        # not checked. A new journal is started with the transferred files of
+        # the partial plan, then src path is listed again without them
+        # @Args src_root_path
+        # @Args dst_root_path
+        # @Args partial_plan plan recorded before the previous run stopped
+        # @Args done_files set of files already transferred in the plan
+        # @Returns   None
+        """
+        done_plan = filter(lambda x: x[0] in done_files, partial_plan)
+        # a pack is recorded by its key, its members are the src files
+        done_src_files = set(sum(map(lambda x: x[1::2] if len(x) > 2 else x[:1],
+            done_plan), []))
+        general_logger.warning(('Listing of {} --> {} in journal is not complete, list '
+            'again and skip {} transferred files').format(src_root_path, dst_root_path,
+                len(done_src_files)))
+        self.journal.begin()
+        for fields in done_plan:
+            self.journal.plan(fields)
+            self.journal.record(fields[0])
+        transfer_list = ([x, mapDstPath(x, src_root_path, dst_root_path)]
+                for x in self.lsrSrcPath(src_root_path) if x not in done_src_files)
+        self.transferList(src_root_path, dst_root_path, transfer_list, True)
+
+    def sync(self, src_root_path, dst_root_path):
+        """
+        # @Synopsis  incremental transfer, only new or changed files are
+        # transferred. The diff is recorded in the checkpoint journal as the
+        # transfer list, so an interrupted sync can be resumed by transfer. The
+        # worker processes are forked before the listing as by transfer
+        # @Args src_root_path
+        # @Args dst_root_path
+        # @Returns   None
+        """
+        self.startProcessPool()
+        try:
+            self.prepareTransfer(src_root_path)
+            self.journal = TransferJournal(self.getJournalPath(src_root_path,
+                dst_root_path), EnvConfig.GENERAL_LOG_NAME)
+            sync_list = self.getSyncList(src_root_path, dst_root_path)
+            self.journal.begin()
+            self.transferList(src_root_path, dst_root_path, sync_list, True)
+        finally:
+            self.stopProcessPool()
+
+    def prepareTransfer(self, src_root_path):
+        """
+        # @Synopsis  load what the listing of src path needs, after the worker
+        # processes are forked, to be overriden by child classes
+        # @Args src_root_path
         # @Returns   None
         """
         pass
 
-    def transfer(self, src_root_path, dst_root_path):
+    def startProcessPool(self):
+        """
+        # @Synopsis  fork the worker processes if process_num is set. Only the
+        # log writer thread runs by then, the workers replace the locks they
+        # inherit
+        # @Returns   None
         """
-        # @Synopsis  transfer management logic
+        if EnvConfig.PROCESS_NUM > 0:
+            self.process_pool = ProcessPool(EnvConfig.PROCESS_NUM, self.thread_num, self)
+            self.process_pool.start()
+
+    def stopProcessPool(self):
+        """
+        # @Synopsis  stop the worker processes if there are
+        # @Returns   None
+        """
+        if self.process_pool is not None:
+            self.process_pool.stop()
+            self.process_pool.logStats()
+            self.process_pool = None
+
+    def transferList(self, src_root_path, dst_root_path, transfer_list, new_plan=False):
+        """
+        # @Synopsis  transfer files by the pool of transfer threads, files are
+        # queued while the transfer list is being generated
         # @Args src_root_path
         # @Args dst_root_path
+        # @Args transfer_list iterable of transfers
+        # @Args new_plan whether to group the files and append them to the
+        # journal plan, False if the transfer list is loaded from the journal
         # @Returns   None
         """
-        src_files = self.lsrSrcPath(src_root_path)
-        if len(src_files) == 0:
-            general_logger.warning('No file to transfer in {}'.format(src_root_path))
-            return 1
+        self.transfer_file_cnt = 0
+        self.listing_finished = False
+        self.processed_cnt = 0
+        self.failure_cnt = 0
 
-        dst_exist_files = self.lsrDstPath(dst_root_path)
-        if len(dst_exist_files) > 0:
-            general_logger.warning('Failed to transfer: there are file(s) in destination {}'\
-                    .format(dst_root_path))
-            return 1
+        general_logger.info('start to transfer {0} --> {1}, thread_num = {2}'\
+                .format(src_root_path, dst_root_path, self.thread_num))
 
-        def path_mapper(path):
-            """
-            # @Synopsis  map src path to dst path
-            # @Args path
-            # @Returns   dst path
-            """
-            if path == src_root_path:
-                return dst_root_path
-            relative_path = os.path.relpath(path, src_root_path)
-            dst_path = os.path.join(dst_root_path, relative_path)
-            return dst_path
-
-        dst_files = map(path_mapper, src_files)
-        transfer_list = zip(src_files, dst_files)
-        transfer_file_cnt = len(transfer_list)
-        failure_cnt = 0
-
-        general_logger.info('start to transfer {0} --> {1}, file_cnt = {2}'\
-                .format(src_root_path, dst_root_path, transfer_file_cnt))
-
-        start_time = datetime.now()
-        for index, transfer_info in enumerate(transfer_list):
+        self.start_time = datetime.now()
+        self.controller = ConcurrencyController('transfer', self.thread_num)
+        queue_depth.set(self.transfer_queue.qsize, ('transfer',))
+        queue_depth.set(getRetryQueue().qsize, ('retry',))
+        startExporters()
+        transfer_threads = []
+        for i in range(self.thread_num):
+            transfer_thread = TransferThread(self)
+            transfer_thread.daemon = True
+            transfer_thread.start()
+            transfer_threads.append(transfer_thread)
+        if new_plan:
+            transfer_list = self.groupTransferList(dst_root_path, transfer_list)
+        list_start_time = time.time()
+        try:
+            for transfer_info in transfer_list:
+                if new_plan:
+                    self.journal.plan(transfer_info)
+                self.thread_lock.acquire()
+                index = self.transfer_file_cnt
+                self.transfer_file_cnt += 1
+                self.thread_lock.release()
+                # the last item is the retry count of the transfer
+                self.transfer_queue.put((index, transfer_info, 0))
+            if new_plan:
+                self.journal.endPlan()
+            recordStage('list', list_start_time, file_cnt=self.transfer_file_cnt)
+        except Exception as e:
+            recordStage('list', list_start_time, succeeded=False)
+            general_logger.error('failed to list {}, message: {}'.format(src_root_path,
+                e.message))
+        self.thread_lock.acquire()
+        self.listing_finished = True
+        self.thread_lock.release()
+        general_logger.info('listed {0}, file_cnt = {1}'.format(src_root_path,
+            self.transfer_file_cnt))
+        # files being retried are put back to the transfer queue later, so the
+        # threads are stopped only after all files are processed
+        self.processed_condition.acquire()
+        while self.processed_cnt < self.transfer_file_cnt:
+            self.processed_condition.wait()
+        self.processed_condition.release()
+        # one None for each transfer thread to stop it
+        for transfer_thread in transfer_threads:
+            self.transfer_queue.put(None)
+        for transfer_thread in transfer_threads:
+            transfer_thread.join()
+        self.journal.close()
+        if getConnectionPool() is not None:
+            getConnectionPool().logStats()
+        stopExporters()
+
+        general_logger.info(('finished transfering {} --> {}, failure_cnt = {}/{}, '
+            'see in failure log if failure_cnt > 0').format(src_root_path, dst_root_path,
+                self.failure_cnt, self.transfer_file_cnt))
+
+    def reportProgress(self, succeeded):
+        """
+        # @Synopsis  account a processed file and log the aggregated progress of
+        # all transfer threads, thread safe
+        # @Args succeeded whether the file was transferred successfully
+        # @Returns   None
+        """
+        self.processed_condition.acquire()
+        self.processed_cnt += 1
+        if not succeeded:
+            self.failure_cnt += 1
+        processed_cnt = self.processed_cnt
+        transfer_file_cnt = self.transfer_file_cnt
+        listing_finished = self.listing_finished
+        self.processed_condition.notify_all()
+        self.processed_condition.release()
+
+        cur_time = datetime.now()
+        time_elapsed = cur_time - self.start_time
+        hour_elapsed = float(time_elapsed.total_seconds()) / 3600
+        estimate_remain_hours = float(transfer_file_cnt -
+                processed_cnt) / processed_cnt * hour_elapsed
+
+        # the file count keeps growing until src path is listed, so is the
+        # estimate
+        general_logger.info(('processed file_cnt {}/{}={:.1f}%, elapsed {:.1f} hours, '
+            'estimate to finish in {:.1f} hours{}')\
+                .format(processed_cnt, transfer_file_cnt,
+                float(processed_cnt) / transfer_file_cnt * 100,
+                hour_elapsed, estimate_remain_hours,
+                '' if listing_finished else ' at least, still listing'))
+
+
+class TransferThread(threading.Thread):
+    """
+    # @Synopsis  transfer thread, take files from the transfer queue of the
+    # transferor and transfer them one by one until a None is taken, each
+    # transfer holds a slot of the concurrency controller. A file failed by a
+    # retryable error is put to the retry queue until it runs out of retries.
+    # While the queue is empty, the thread helps with the parts of large files
+    """
+    def __init__(self, transferor):
+        threading.Thread.__init__(self)
+        self.transferor = transferor
+
+    def run(self):
+        """
+        # @Synopsis  run thread
+        # @Returns   None
+        """
+        while True:
+            queue_top = getOrHelp(self.transferor.transfer_queue)
+            if queue_top is None:
+                break
+            index, transfer_info, retry_cnt = queue_top
+            transfer_file_cnt = self.transferor.transfer_file_cnt
+            if len(transfer_info) > 2:
+                src_file = transfer_info[0]
+                dst_file = transfer_info[0]
+                members = zip(transfer_info[1::2], transfer_info[2::2])
+            else:
+                src_file, dst_file = transfer_info
+                members = [transfer_info]
+            self.transferor.controller.acquire()
+            start_time = time.time()
             try:
-                self.transferFile(transfer_info[0], transfer_info[1])
-                general_logger.debug('succeeded to transfer {}/{}: {} --> {}'.format(
-                    index + 1, transfer_file_cnt, transfer_info[0], transfer_info[1]))
-                success_logger.debug('{0} --> {1}'.format(transfer_info[0], transfer_info[1]))
+                size, md5 = self.transferor.runTransfer(transfer_info)
+                self.transferor.controller.release(size, time.time() - start_time, True)
+                recordStage(self.transferor.stage, start_time, size)
+                general_logger.debug('succeeded to transfer {}/{}: {} --> {}, md5 = {}'.format(
+                    index + 1, transfer_file_cnt, src_file, dst_file, md5))
+                for member_src_file, member_dst_file in members:
+                    if len(transfer_info) > 2:
+                        success_logger.debug('{0} --> {1} in pack {2}, pack md5 = {3}'.format(
+                            member_src_file, member_dst_file, src_file, md5))
+                    else:
+                        success_logger.debug('{0} --> {1}, md5 = {2}'.format(member_src_file,
+                            member_dst_file, md5))
+                self.transferor.journal.record(src_file)
+                self.transferor.reportProgress(True)
             except Exception as e:
+                self.transferor.controller.release(0, time.time() - start_time, False)
+                recordStage(self.transferor.stage, start_time, succeeded=False)
+                if isRetryable(e) and retry_cnt < EnvConfig.RETRY_CNT:
+                    delay = getRetryDelay(retry_cnt + 1)
+                    recordRetry(self.transferor.stage, delay)
+                    general_logger.warning(('failed to transfer {}/{}: {} --> {}, '
+                        'retry {}/{} in {:.1f}s, message: {}').format(index + 1,
+                            transfer_file_cnt, src_file, dst_file, retry_cnt + 1,
+                            EnvConfig.RETRY_CNT, delay, e.message))
+                    getRetryQueue().put(self.transferor.transfer_queue,
+                            (index, transfer_info, retry_cnt + 1), delay)
+                    continue
                 general_logger.warning('failed to transfer {}/{}: {} --> {}, message: {}'.format(
-                    index + 1, transfer_file_cnt, transfer_info[0], transfer_info[1], e.message))
-                failure_logger.debug(('{} --> {}, message: {}').format(transfer_info[0],
-                    transfer_info[1], e.message))
-                failure_cnt += 1
-
-            cur_time = datetime.now()
-            time_elapsed = cur_time - start_time
-            hour_elapsed = float(time_elapsed.total_seconds()) / 3600
-            estimate_remain_hours = float(transfer_file_cnt -
-                    index - 1) / (index + 1) * hour_elapsed
-
-            general_logger.info(('processed file_cnt {}/{}={:.1f}%, elapsed {:.1f} hours, '
-                'estimate to finish in {:.1f} hours')\
-                    .format(index + 1, transfer_file_cnt,
-                    float(index + 1) / transfer_file_cnt * 100,
-                    hour_elapsed, estimate_remain_hours))
+                    index + 1, transfer_file_cnt, src_file, dst_file, e.message))
+                for member_src_file, member_dst_file in members:
+                    failure_logger.debug(('{} --> {}, message: {}').format(member_src_file,
+                        member_dst_file, e.message))
+                self.transferor.reportProgress(False)
 
-        general_logger.info(('finished transfering {} --> {}, failure_cnt = {}/{}, '
-            'see in failure log if failure_cnt > 0').format(src_root_path, dst_root_path,
-                failure_cnt, transfer_file_cnt))
+
+def mapDstPath(path, src_root_path, dst_root_path):
+    """
+    # @Synopsis  map src path to dst path
+    # @Args path
+    # @Args src_root_path
+    # @Args dst_root_path
+    # @Returns   dst path
+    """
+    if path == src_root_path:
+        return dst_root_path
+    relative_path = os.path.relpath(path, src_root_path)
+    dst_path = os.path.join(dst_root_path, relative_path)
+    return dst_path
 
 
 def lsrLocalFiles(path):
     """
     # @Synopsis  list recursive all file under a local path
     # @Args path
-    # @Returns   list of file paths
+    # @Returns   generator of file paths
     """
-    file_list = []
     if os.path.isfile(path):
-        file_list.append(path)
+        yield path
     else:
         for root, dirs, files in os.walk(path):
             for name in files:
-                file_path = os.path.join(root, name)
-                file_list.append(file_path)
-    return file_list
+                yield os.path.join(root, name)
+
+
+def lsrLocalFilesWithMeta(path):
+    """
+    # @Synopsis  list recursive all file under a local path with metadata
+    # @Args path
+    # @Returns   generator of file info dicts, including path, size and mtime
+    """
+    def meta_mapper(file_path):
+        """
+        # @Synopsis  map file path to file info dict
+        # @Args file_path
+        # @Returns   file info dict
+        """
+        stat = os.stat(file_path)
+        return dict({
+            'path': file_path,
+            'size': stat.st_size,
+            'mtime': int(stat.st_mtime)
+            })
+    return (meta_mapper(x) for x in lsrLocalFiles(path))
 
 
 class Uploader(Transferor):
     """
-    # @Synopsis  uploader
+    # @Synopsis  uploader, small files are packed if pack is set, other files
+    # are compressed while uploaded if compress is set
     """
-    def __init__(self, my_bos_client):
+    stage = 'upload'
+
+    def __init__(self, my_bos_client, pack=False, compress=None):
+        Transferor.__init__(self, my_bos_client.bucket_name)
         self.my_bos_client = my_bos_client
+        self.pack = pack
+        self.compress = compress
+        if compress is not None:
+            checkCodec(compress)
 
     def lsrSrcPath(self, path):
         """
         # @Synopsis  list recursively src path, override the father's method
         # @Args path
-        # @Returns   list of file paths
+        # @Returns   generator of file paths
         """
         return lsrLocalFiles(path)
 
@@ -153,53 +628,238 @@ class Uploader(Transferor):
         """
         # @Synopsis  list recursively dst path, override the father's method
         # @Args path
-        # @Returns   list of file paths
+        # @Returns   generator of file paths
         """
         return self.my_bos_client.lsr(path)
 
+    def lsrSrcPathWithMeta(self, path):
+        """
+        # @Synopsis  list recursively src path with metadata, override the
+        # father's method
+        # @Args path
+        # @Returns   generator of file info dicts
+        """
+        return lsrLocalFilesWithMeta(path)
+
+    def lsrDstPathWithMeta(self, path):
+        """
+        # @Synopsis  list recursively dst path with metadata, packed files are
+        # listed in place of the packs, override the father's method
+        # @Args path
+        # @Returns   generator of file info dicts
+        """
+        return self.my_bos_client.lsrUnpackedWithMeta(path)
+
     def transferFile(self, src_file, dst_file):
         """
         # @Synopsis  transfer a single file, override the father's method
         # @Args src_file
         # @Args dst_file
-        # @Returns   None
+        # @Returns   tuple of size and md5 of the file, the md5 is of the
+        # compressed data if compressed
+        """
+        if self.compress is None:
+            md5 = self.my_bos_client.put_object_from_file(src_file, dst_file)
+            return os.path.getsize(src_file), md5
+        stream = CompressStream(open(src_file, 'rb'), self.compress)
+        try:
+            size, md5 = self.my_bos_client.multipart_uploader.uploadStream(stream,
+                    dst_file, src_file, stream.getUserMetadata)
+        finally:
+            stream.close()
+        general_logger.debug('compressed {} by {}: {} --> {} bytes'.format(src_file,
+            self.compress, stream.raw_size, size))
+        return stream.raw_size, md5
+
+    def transferPack(self, pack_key, members):
+        """
+        # @Synopsis  upload small files as a pack, the files are streamed one
+        # after another as the data of the pack, override the father's method
+        # @Args pack_key
+        # @Args members list of [src_file, dst_file]
+        # @Returns   tuple of size and md5 of the pack
         """
-        self.my_bos_client.put_object_from_file(src_file, dst_file)
+        pack_members = map(lambda x: (x[1], os.path.getsize(x[0])), members)
+        stream = ConcatStream(lambda x: open(x, 'rb'), map(lambda x: x[0], members))
+        try:
+            return self.my_bos_client.pack_uploader.uploadStream(stream, pack_key,
+                    pack_members)
+        finally:
+            stream.close()
+
+    def getTransferSize(self, transfer_info):
+        """
+        # @Synopsis  size of the src file, or the total size of the files of a
+        # pack, a vanished file is taken as empty, override the father's method
+        # @Args transfer_info
+        # @Returns   size
+        """
+        src_files = transfer_info[1::2] if len(transfer_info) > 2 else transfer_info[:1]
+        size = 0
+        for src_file in src_files:
+            try:
+                size += os.path.getsize(src_file)
+            except OSError as e:
+                pass
+        return size
+
+    def groupTransferList(self, dst_root_path, transfer_list):
+        """
+        # @Synopsis  group small files into packs if pack is set, override the
+        # father's method
+        # @Args dst_root_path
+        # @Args transfer_list iterable of [src_file, dst_file]
+        # @Returns   generator of transfers
+        """
+        if not self.pack:
+            return transfer_list
+        def get_size(transfer_info):
+            """
+            # @Synopsis  size of the src file, a vanished file is taken as empty
+            # and fails when it is transferred
+            # @Args transfer_info
+            # @Returns   file size
+            """
+            try:
+                return os.path.getsize(transfer_info[0])
+            except OSError as e:
+                return 0
+        return (transfers[0] if pack_key is None else [pack_key] + sum(transfers, [])
+                for pack_key, transfers in groupPacks(transfer_list, dst_root_path, get_size))
 
 
 class Downloader(Transferor):
     """
     # @Synopsis  downloader
     """
+    stage = 'download'
+
     def __init__(self, my_bos_client):
+        Transferor.__init__(self, my_bos_client.bucket_name)
         self.my_bos_client = my_bos_client
+        self.pack_members = dict()
+        # sizes of the listed objects downloaded by ranges, the smaller ones
+        # are not kept and scheduled as filler
+        self.large_sizes = dict()
+
+    def prepareTransfer(self, src_root_path):
+        """
+        # @Synopsis  load the members of the packs of src path, which are
+        # transferred as if they were single objects, override the father's
+        # method
+        # @Args src_root_path
+        # @Returns   None
+        """
+        self.pack_members = dict(map(lambda x: (x['path'], x),
+            self.my_bos_client.pack_reader.lsr(src_root_path)))
+        if len(self.pack_members) > 0:
+            general_logger.info('loaded {} packed files of {}'.format(len(self.pack_members),
+                src_root_path))
 
     def lsrSrcPath(self, path):
         """
         # @Synopsis  list recursively src path, override the father's method
         # @Args path
-        # @Returns   list of file paths
+        # @Returns   generator of file paths
         """
-        return self.my_bos_client.lsr(path)
+        return (x['path'] for x in self.lsrSrcPathWithMeta(path))
 
     def lsrDstPath(self, path):
         """
         # @Synopsis  list recursively dst path, override the father's method
         # @Args path
-        # @Returns   list of file paths
+        # @Returns   generator of file paths
         """
         return lsrLocalFiles(path)
 
+    def lsrSrcPathWithMeta(self, path):
+        """
+        # @Synopsis  list recursively src path with metadata, the sizes of large
+        # objects are kept for scheduling, override the father's method
+        # @Args path
+        # @Returns   generator of file info dicts
+        """
+        for src_object in itertools.chain(
+                self.my_bos_client.lsrUnpackedWithMeta(path, False),
+                self.pack_members.itervalues()):
+            if src_object['size'] >= EnvConfig.RANGE_THRESHOLD:
+                self.large_sizes[src_object['path']] = src_object['size']
+            yield src_object
+
+    def lsrDstPathWithMeta(self, path):
+        """
+        # @Synopsis  list recursively dst path with metadata, override the
+        # father's method
+        # @Args path
+        # @Returns   generator of file info dicts
+        """
+        return lsrLocalFilesWithMeta(path)
+
+    def getTransferSize(self, transfer_info):
+        """
+        # @Synopsis  size of the src object if it is downloaded by ranges, 0 for
+        # a smaller one, override the father's method
+        # @Args transfer_info
+        # @Returns   size
+        """
+        return self.large_sizes.get(transfer_info[0], 0)
+
+    def getSrcRawSize(self, src_object):
+        """
+        # @Synopsis  size of the data of a src object, the raw size kept in the
+        # user metadata if the object is compressed, override the father's
+        # method. Only objects whose size differs from the dst file are asked
+        # @Args src_object file info dict
+        # @Returns   size
+        """
+        if src_object['path'] in self.pack_members:
+            return src_object['size']
+        raw_size = self.my_bos_client.getRawSize(src_object['path'])
+        return src_object['size'] if raw_size is None else raw_size
+
     def transferFile(self, src_file, dst_file):
         """
         # @Synopsis  transfer a single file, override the father's method
         # @Args src_file
         # @Args dst_file
-        # @Returns   None
+        # @Returns   tuple of size and md5 of the file
         """
+        member = self.pack_members.get(src_file)
+        if member is not None:
+            return self.transferMember(member, dst_file)
         father_path = os.path.split(dst_file)[0]
         try:
             os.makedirs(father_path)
         except OSError as e:
             pass
-        self.my_bos_client.get_object_to_file(src_file, dst_file)
+        md5 = self.my_bos_client.get_object_to_file(src_file, dst_file)
+        return os.path.getsize(dst_file), md5
+
+    def transferMember(self, member, dst_file):
+        """
+        # @Synopsis  transfer a packed file
+        # @Args member file info dict of the packed file
+        # @Args dst_file
+        # @Returns   tuple of size of the file and None for the md5
+        """
+        father_path = os.path.split(dst_file)[0]
+        try:
+            os.makedirs(father_path)
+        except OSError as e:
+            pass
+        self.my_bos_client.pack_reader.get(member, dst_file)
+        return os.path.getsize(dst_file), None
+
+    def runTransfer(self, transfer_info):
+        """
+        # @Synopsis  transfer a file by a worker process if there is a process
+        # pool, otherwise in the calling thread. The packs are loaded after the
+        # workers are forked, a packed file is handed to a worker with its
+        # member info, override the father's method
+        # @Args transfer_info
+        # @Returns   tuple of size and md5, md5 is None if not known
+        """
+        member = self.pack_members.get(transfer_info[0])
+        if self.process_pool is not None and member is not None:
+            return self.process_pool.call('transferMember', member, transfer_info[1])
+        return Transferor.runTransfer(self, transfer_info)
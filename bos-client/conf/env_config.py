@@ -10,6 +10,27 @@ import os
 import ConfigParser
 
 
+def getOption(config, section, option, default):
+    """
+    # @Synopsis  read an option which may be missing, such as in an all.cfg
+    # written for an earlier version, a missing option or section falls back to
+    # the default of all.cfg.template
+    # @Args config ConfigParser
+    # @Args section
+    # @Args option
+    # @Args default default value, its type decides how the option is parsed
+    # @Returns   value of the option
+    """
+    try:
+        if isinstance(default, bool):
+            return config.getboolean(section, option)
+        elif isinstance(default, (int, long)):
+            return config.getint(section, option)
+        return config.get(section, option)
+    except (ConfigParser.NoSectionError, ConfigParser.NoOptionError):
+        return default
+
+
 class EnvConfig(object):
     """
     # @Synopsis  config environment
@@ -32,6 +53,36 @@ class EnvConfig(object):
     BOS_TIMEOUT = config.getint('BOS', 'connection_timeout_in_mills')
     BOS_SEND_BUF_SIZE = config.getint('BOS', 'send_buf_size')
     BOS_RECV_BUF_SIZE = config.getint('BOS', 'recv_buf_size')
+    BOS_CONNECTION_POOL_SIZE = getOption(config, 'BOS', 'connection_pool_size', 32)
+
+    TRANSFER_THREAD_NUM = getOption(config, 'TRANSFER', 'thread_num', 8)
+    ADAPTIVE_CONCURRENCY = getOption(config, 'TRANSFER', 'adaptive_concurrency', False)
+    MIN_THREAD_NUM = getOption(config, 'TRANSFER', 'min_thread_num', 1)
+    ADAPTIVE_INTERVAL = getOption(config, 'TRANSFER', 'adaptive_interval', 10)
+    PROCESS_NUM = getOption(config, 'TRANSFER', 'process_num', 0)
+    RETRY_CNT = getOption(config, 'TRANSFER', 'retry_cnt', 3)
+    RETRY_BASE_DELAY = getOption(config, 'TRANSFER', 'retry_base_delay', 1)
+    RETRY_MAX_DELAY = getOption(config, 'TRANSFER', 'retry_max_delay', 60)
+    COMPRESS_LEVEL = getOption(config, 'TRANSFER', 'compress_level', 6)
+    LIST_THREAD_NUM = getOption(config, 'TRANSFER', 'list_thread_num', 8)
+    PLAN_QUEUE_SIZE = getOption(config, 'TRANSFER', 'plan_queue_size', 10000)
+    MULTIPART_THRESHOLD = getOption(config, 'TRANSFER', 'multipart_threshold', 67108864)
+    PART_SIZE = getOption(config, 'TRANSFER', 'part_size', 16777216)
+    PART_THREAD_NUM = getOption(config, 'TRANSFER', 'part_thread_num', 4)
+    ZERO_COPY = getOption(config, 'TRANSFER', 'zero_copy', False)
+    RANGE_THRESHOLD = getOption(config, 'TRANSFER', 'range_threshold', 67108864)
+    RANGE_SIZE = getOption(config, 'TRANSFER', 'range_size', 16777216)
+    RANGE_THREAD_NUM = getOption(config, 'TRANSFER', 'range_thread_num', 4)
+    PACK_FILE_THRESHOLD = getOption(config, 'TRANSFER', 'pack_file_threshold', 1048576)
+    PACK_SIZE = getOption(config, 'TRANSFER', 'pack_size', 67108864)
+
+    UPLOAD_RATE = getOption(config, 'RATE_LIMIT', 'upload_rate', 0)
+    DOWNLOAD_RATE = getOption(config, 'RATE_LIMIT', 'download_rate', 0)
+
+    METRICS_TEXTFILE = getOption(config, 'METRICS', 'textfile', '')
+    METRICS_INTERVAL = getOption(config, 'METRICS', 'textfile_interval', 10)
+    METRICS_HTTP_HOST = getOption(config, 'METRICS', 'http_host', '127.0.0.1')
+    METRICS_HTTP_PORT = getOption(config, 'METRICS', 'http_port', 0)
 
     GENERAL_LOG_NAME = 'general'
     SUCCESS_LOG_NAME = 'success'
@@ -41,6 +92,7 @@ class EnvConfig(object):
 
     LOG_ROTATE_DAY = config.getint('LOG', 'rotate_day')
     ALARM_RECEIVERS = config.get('LOG', 'alarm_receivers').split(',')
+    MAIL_INTERVAL = getOption(config, 'LOG', 'mail_interval', 600)
 
     GENERAL_LOG_FILE_PATH = os.path.join(PROJECT_PATH, 'log', 'general.log')
     SUCCESS_LOG_FILE_PATH = os.path.join(PROJECT_PATH, 'log', 'success.log')
@@ -0,0 +1,293 @@
+"""
+# @file bos.py
+# @Synopsis  BOS client shared by all threads, requests are sent over a pool of
+# keep-alive connections
+# @author Ming Gu(guming@itv.baidu.com))
+# @version 1.0
+# @date 2016-12-22
+"""
+import time
+import socket
+import thread
+import threading
+import logging
+
+from baidubce.http import bce_http_client
+from baidubce.http import http_methods
+from baidubce.bce_client_configuration import BceClientConfiguration
+from baidubce.auth.bce_credentials import BceCredentials
+from baidubce.services.bos.bos_client import BosClient
+
+from conf.env_config import EnvConfig
+from dao import rate_limiter
+
+# idle connections older than this are not reused, the server may have closed
+# them already
+IDLE_TIMEOUT = 30
+
+general_logger = logging.getLogger(EnvConfig.GENERAL_LOG_NAME)
+
+
+class BosConnectionPool(object):
+    """
+    # @Synopsis  pool of keep-alive connections, thread safe. The BOS SDK opens
+    # a new connection for each request, the pool is hooked into the SDK so that
+    # a connection is put back once its response is read to the end, and is
+    # reused by the next request to the same host
+    """
+    def __init__(self, max_idle_cnt):
+        self.max_idle_cnt = max_idle_cnt
+        self.idle_connections = dict()
+        self.lock = threading.Lock()
+        self.hit_cnt = 0
+        self.miss_cnt = 0
+        self.discard_cnt = 0
+        self.new_connection = bce_http_client._get_connection
+        self.send_http_request = bce_http_client._send_http_request
+
+    def install(self):
+        """
+        # @Synopsis  hook the pool into the BOS SDK
+        # @Returns   None
+        """
+        bce_http_client._get_connection = self.acquire
+        bce_http_client._send_http_request = self.send
+
+    def acquire(self, protocol, host, port, connection_timeout_in_millis):
+        """
+        # @Synopsis  take an idle connection to the host, or open a new one,
+        # replaces _get_connection of the SDK
+        # @Args protocol
+        # @Args host
+        # @Args port
+        # @Args connection_timeout_in_millis
+        # @Returns   connection
+        """
+        key = (protocol.name, host, port)
+        conn = None
+        self.lock.acquire()
+        try:
+            idle_connections = self.idle_connections.get(key, [])
+            while len(idle_connections) > 0:
+                idle_conn, idle_time = idle_connections.pop()
+                if time.time() - idle_time < IDLE_TIMEOUT and idle_conn.sock is not None:
+                    conn = idle_conn
+                    break
+                self.discard_cnt += 1
+                idle_conn.pool_close()
+            if conn is None:
+                self.miss_cnt += 1
+            else:
+                self.hit_cnt += 1
+        finally:
+            self.lock.release()
+
+        if conn is None:
+            conn = self.new_connection(protocol, host, port, connection_timeout_in_millis)
+            conn.pool_key = key
+            conn.pool_close = conn.close
+            conn.close = lambda: self.close(conn)
+            conn_connect = conn.connect
+            def connect():
+                """
+                # @Synopsis  connect with Nagle's algorithm disabled, the SDK
+                # sends the headers and the body of a request by separate
+                # writes, the body would otherwise wait for the ack of the
+                # headers, replaces connect of the connection
+                # @Returns   None
+                """
+                conn_connect()
+                conn.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            conn.connect = connect
+        conn.pool_owner = thread.get_ident()
+        return conn
+
+    def send(self, conn, http_method, uri, headers, body, send_buf_size):
+        """
+        # @Synopsis  send a request, the connection is put back once the
+        # response is read to the end, replaces _send_http_request of the SDK.
+        # The request body and the response are limited by the rate limiter
+        # @Args conn
+        # @Args http_method
+        # @Args uri
+        # @Args headers
+        # @Args body
+        # @Args send_buf_size
+        # @Returns   response
+        """
+        response = self.send_http_request(conn, http_method, uri, headers,
+                rate_limiter.throttleUpload(body), send_buf_size)
+        rate_limiter.throttleDownload(response)
+        response_close = response.close
+        closed = []
+        def close():
+            """
+            # @Synopsis  close the response and put back the connection if the
+            # response is read to the end, otherwise close the connection. Only
+            # the first call counts, the connection may be taken by another
+            # thread by a later one. Replaces close of the response
+            # @Returns   None
+            """
+            if len(closed) > 0:
+                return
+            closed.append(True)
+            reusable = response.fp is not None and response.length == 0 \
+                    and not response.will_close
+            response_close()
+            self.release(conn, reusable)
+        response.close = close
+        if response.length == 0:
+            # empty body, such as the response of HEAD
+            response.close()
+        return response
+
+    def release(self, conn, reusable=True):
+        """
+        # @Synopsis  release a connection once its response is closed, in any
+        # thread. It is put back if reusable, otherwise or if the pool is full
+        # it is closed
+        # @Args conn
+        # @Args reusable whether the response is read to the end
+        # @Returns   None
+        """
+        self.lock.acquire()
+        try:
+            conn.pool_owner = None
+            if reusable:
+                idle_connections = self.idle_connections.setdefault(conn.pool_key, [])
+                if len(idle_connections) < self.max_idle_cnt:
+                    idle_connections.append((conn, time.time()))
+                    return
+                self.discard_cnt += 1
+        finally:
+            self.lock.release()
+        conn.pool_close()
+
+    def close(self, conn):
+        """
+        # @Synopsis  close a connection on behalf of the SDK, which closes the
+        # connection of a failed request. An idle connection is taken out of
+        # the pool first. It is ignored only if another thread currently holds
+        # the connection, which was put back and taken again
+        # @Args conn
+        # @Returns   None
+        """
+        self.lock.acquire()
+        try:
+            if conn.pool_owner is not None and conn.pool_owner != thread.get_ident():
+                return
+            conn.pool_owner = None
+            idle_connections = self.idle_connections.get(conn.pool_key, [])
+            for i in range(len(idle_connections)):
+                if idle_connections[i][0] is conn:
+                    del idle_connections[i]
+                    self.discard_cnt += 1
+                    break
+        finally:
+            self.lock.release()
+        conn.pool_close()
+
+    def getStats(self):
+        """
+        # @Synopsis  statistics of the pool
+        # @Returns   dict of hit_cnt, miss_cnt, discard_cnt and idle_cnt
+        """
+        self.lock.acquire()
+        try:
+            return dict({
+                'hit_cnt': self.hit_cnt,
+                'miss_cnt': self.miss_cnt,
+                'discard_cnt': self.discard_cnt,
+                'idle_cnt': sum(map(len, self.idle_connections.values()))
+                })
+        finally:
+            self.lock.release()
+
+    def reinit(self):
+        """
+        # @Synopsis  drop the idle connections in a forked process, they are
+        # shared with the parent process and must not be used by both
+        # @Returns   None
+        """
+        self.lock = threading.Lock()
+        self.idle_connections = dict()
+
+    def logStats(self):
+        """
+        # @Synopsis  log statistics of the pool
+        # @Returns   None
+        """
+        stats = self.getStats()
+        request_cnt = stats['hit_cnt'] + stats['miss_cnt']
+        general_logger.info(('bos connection pool: hit {}/{}={:.1f}%, discarded {}, '
+            'idle {}').format(stats['hit_cnt'], request_cnt,
+                float(stats['hit_cnt']) / max(request_cnt, 1) * 100,
+                stats['discard_cnt'], stats['idle_cnt']))
+
+
+shared_lock = threading.Lock()
+shared_pool = None
+shared_bos_client = None
+
+
+def getBosClient():
+    """
+    # @Synopsis  BOS client shared by all threads, initiated on first call
+    # together with the connection pool
+    # @Returns   BosClient
+    """
+    global shared_pool
+    global shared_bos_client
+    shared_lock.acquire()
+    try:
+        if shared_bos_client is None:
+            shared_pool = BosConnectionPool(EnvConfig.BOS_CONNECTION_POOL_SIZE)
+            shared_pool.install()
+            config = BceClientConfiguration(credentials=BceCredentials(
+                EnvConfig.ACCESS_KEY_ID, EnvConfig.SECRET_ACCEESS_KEY),
+                endpoint=EnvConfig.BOS_HOST)
+            config.connection_timeout_in_mills = EnvConfig.BOS_TIMEOUT
+            config.recv_buf_size = EnvConfig.BOS_RECV_BUF_SIZE
+            config.send_buf_size = EnvConfig.BOS_SEND_BUF_SIZE
+            shared_bos_client = BosClient(config)
+        return shared_bos_client
+    finally:
+        shared_lock.release()
+
+
+def getConnectionPool():
+    """
+    # @Synopsis  connection pool of the shared BOS client
+    # @Returns   BosConnectionPool, None if the client is not initiated yet
+    """
+    return shared_pool
+
+
+def reinitBosClient():
+    """
+    # @Synopsis  replace the locks of the shared bos client and drop the idle
+    # connections of its pool in a forked process
+    # @Returns   None
+    """
+    global shared_lock
+    shared_lock = threading.Lock()
+    if shared_pool is not None:
+        shared_pool.reinit()
+
+
+def putObjectWithoutMD5(bos_client, bucket_name, key, data, content_length):
+    """
+    # @Synopsis  upload an object by a single PUT without Content-MD5, for a
+    # body whose md5 is computed while it is sent and compared with the etag
+    # afterwards. put_object of the SDK sends 'None' as Content-MD5 if no md5
+    # is given
+    # @Args bos_client
+    # @Args bucket_name
+    # @Args key
+    # @Args data file like body
+    # @Args content_length
+    # @Returns   put object response
+    """
+    headers = BosClient._prepare_object_headers(content_length=content_length)
+    return bos_client._send_request(http_methods.PUT, bucket_name, key, body=data,
+            headers=headers)
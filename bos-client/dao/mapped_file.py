@@ -0,0 +1,84 @@
+"""
+# @file mapped_file.py
+# @Synopsis  zero copy request body of a region of a local file, the region is
+# memory mapped and sent by buffer slices of the mapping
+# @author Ming Gu(guming@itv.baidu.com))
+# @version 1.0
+# @date 2017-01-03
+"""
+import os
+import mmap
+
+
+class MappedFileReader(object):
+    """
+    # @Synopsis  file like reader of a region of a local file. The region is
+    # memory mapped, read() returns buffer slices of the mapping which the
+    # socket sends and hashlib digests without the data being copied into
+    # python strings. Python 2 has no os.sendfile and no memoryview of mmap,
+    # buffer slices are its zero copy path. The file must not be truncated
+    # while it is mapped, reading a mapped page beyond the end of the file
+    # raises SIGBUS
+    """
+    def __init__(self, file_path, offset=0, size=None):
+        self.mapping = None
+        self.start = 0
+        fd = os.open(file_path, os.O_RDONLY)
+        try:
+            if size is None:
+                size = os.fstat(fd).st_size - offset
+            if size > 0:
+                # the mapping starts at a multiple of the allocation granularity
+                map_offset = offset - offset % mmap.ALLOCATIONGRANULARITY
+                self.mapping = mmap.mmap(fd, offset + size - map_offset,
+                        access=mmap.ACCESS_READ, offset=map_offset)
+                self.start = offset - map_offset
+        finally:
+            os.close(fd)
+        self.size = size
+        self.position = 0
+
+    def read(self, size=-1):
+        """
+        # @Synopsis  read from the region
+        # @Args size
+        # @Returns   buffer slice of the mapping, empty string at the end
+        """
+        remain_size = self.size - self.position
+        if size < 0 or size > remain_size:
+            size = remain_size
+        if size == 0:
+            return ''
+        data = buffer(self.mapping, self.start + self.position, size)
+        self.position += size
+        return data
+
+    def tell(self):
+        """
+        # @Synopsis  offset in the region
+        # @Returns   offset
+        """
+        return self.position
+
+    def seek(self, offset, whence=0):
+        """
+        # @Synopsis  seek in the region, the SDK seeks the body back to its
+        # start offset before a retry
+        # @Args offset
+        # @Args whence
+        # @Returns   None
+        """
+        if whence == 1:
+            offset += self.position
+        elif whence == 2:
+            offset += self.size
+        self.position = min(max(offset, 0), self.size)
+
+    def close(self):
+        """
+        # @Synopsis  unmap the region, slices still referenced raise once read
+        # @Returns   None
+        """
+        if self.mapping is not None:
+            self.mapping.close()
+            self.mapping = None
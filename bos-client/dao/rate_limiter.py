@@ -0,0 +1,217 @@
+"""
+# @file rate_limiter.py
+# @Synopsis  token bucket bandwidth limiter of BOS traffic, shared by all
+# threads, the rates are reloaded from the config file while running
+# @author Ming Gu(guming@itv.baidu.com))
+# @version 1.0
+# @date 2016-12-26
+"""
+import os
+import time
+import cStringIO
+import threading
+import ConfigParser
+import logging
+
+from conf.env_config import EnvConfig
+
+# seconds between checks of the config file for new rates
+RELOAD_INTERVAL = 5
+# seconds of traffic that can be sent at once after the bucket is idle
+BURST_SECONDS = 1.0
+
+general_logger = logging.getLogger(EnvConfig.GENERAL_LOG_NAME)
+
+
+class TokenBucket(object):
+    """
+    # @Synopsis  token bucket, thread safe. Tokens are bytes refilled at the
+    # rate and capped at one burst, a consumer taking more bytes than there are
+    # tokens drives the bucket into debt and sleeps until the debt is paid, so
+    # later consumers wait behind it. A rate of 0 means unlimited
+    """
+    def __init__(self, name, rate):
+        self.name = name
+        self.rate = rate
+        self.tokens = rate * BURST_SECONDS
+        self.last_time = time.time()
+        self.lock = threading.Lock()
+
+    def setRate(self, rate):
+        """
+        # @Synopsis  change the rate
+        # @Args rate bytes per second, 0 for unlimited
+        # @Returns   None
+        """
+        self.lock.acquire()
+        try:
+            if rate != self.rate:
+                general_logger.info('{} rate limit {} -> {} bytes/s'.format(self.name,
+                    self.rate, rate))
+            self.rate = rate
+            self.tokens = min(self.tokens, rate * BURST_SECONDS)
+            self.last_time = time.time()
+        finally:
+            self.lock.release()
+
+    def consume(self, size):
+        """
+        # @Synopsis  take tokens for bytes transferred, block until the rate
+        # allows them
+        # @Args size
+        # @Returns   None
+        """
+        if self.rate <= 0 or size <= 0:
+            return
+        self.lock.acquire()
+        try:
+            rate = self.rate
+            if rate <= 0:
+                return
+            cur_time = time.time()
+            self.tokens = min(self.tokens + (cur_time - self.last_time) * rate,
+                    rate * BURST_SECONDS)
+            self.last_time = cur_time
+            self.tokens -= size
+            wait_seconds = -self.tokens / rate
+        finally:
+            self.lock.release()
+        if wait_seconds > 0:
+            time.sleep(wait_seconds)
+
+
+class ThrottledReader(object):
+    """
+    # @Synopsis  file like reader whose reads are limited by a token bucket
+    """
+    def __init__(self, stream, bucket):
+        self.stream = stream
+        self.bucket = bucket
+
+    def read(self, size=-1):
+        """
+        # @Synopsis  read from the stream, block until the rate allows the data
+        # @Args size
+        # @Returns   data read
+        """
+        data = self.stream.read(size)
+        self.bucket.consume(len(data))
+        return data
+
+
+class RateLimitReloader(object):
+    """
+    # @Synopsis  rate limit reloader, reload the rates from the RATE_LIMIT
+    # section of the config file once it is modified. The file is checked by
+    # the requests at most once every RELOAD_INTERVAL seconds, thread safe
+    """
+    def __init__(self, conf_file_path):
+        self.conf_file_path = conf_file_path
+        self.last_mtime = self.getMtime()
+        self.last_check_time = time.time()
+        self.lock = threading.Lock()
+
+    def getMtime(self):
+        """
+        # @Synopsis  modification time of the config file
+        # @Returns   mtime, None if the file can not be accessed
+        """
+        try:
+            return os.path.getmtime(self.conf_file_path)
+        except OSError as e:
+            return None
+
+    def check(self):
+        """
+        # @Synopsis  reload the rates if the config file is modified since last
+        # check
+        # @Returns   None
+        """
+        if time.time() - self.last_check_time < RELOAD_INTERVAL:
+            return
+        if not self.lock.acquire(False):
+            # being checked by another thread
+            return
+        try:
+            self.last_check_time = time.time()
+            mtime = self.getMtime()
+            if mtime is None or mtime == self.last_mtime:
+                return
+            self.last_mtime = mtime
+            config = ConfigParser.RawConfigParser()
+            config.read(self.conf_file_path)
+            upload_bucket.setRate(getShare(config.getint('RATE_LIMIT', 'upload_rate')))
+            download_bucket.setRate(getShare(config.getint('RATE_LIMIT', 'download_rate')))
+        except Exception as e:
+            general_logger.warning('failed to reload rate limit from {}: {}'.format(
+                self.conf_file_path, e.message))
+        finally:
+            self.lock.release()
+
+
+upload_bucket = TokenBucket('upload', EnvConfig.UPLOAD_RATE)
+download_bucket = TokenBucket('download', EnvConfig.DOWNLOAD_RATE)
+reloader = RateLimitReloader(EnvConfig.CONF_FILE_PATH)
+# number of processes sharing the rates
+share_cnt = 1
+
+
+def getShare(rate):
+    """
+    # @Synopsis  share of a rate of each process sharing it
+    # @Args rate bytes per second, 0 for unlimited
+    # @Returns   bytes per second, 0 for unlimited
+    """
+    if rate <= 0:
+        return rate
+    return max(rate / share_cnt, 1)
+
+
+def shareRates(process_cnt):
+    """
+    # @Synopsis  limit a forked worker process to its share of the rates, the
+    # rates reloaded later are shared too
+    # @Args process_cnt number of processes sharing the rates
+    # @Returns   None
+    """
+    global share_cnt
+    share_cnt = process_cnt
+    reloader.lock = threading.Lock()
+    for bucket in [upload_bucket, download_bucket]:
+        bucket.lock = threading.Lock()
+        bucket.setRate(getShare(bucket.rate))
+
+
+def throttleUpload(body):
+    """
+    # @Synopsis  limit the upload of a request body
+    # @Args body string or file like object
+    # @Returns   throttled body, unchanged if empty or unlimited
+    """
+    reloader.check()
+    if not body or upload_bucket.rate <= 0:
+        return body
+    if isinstance(body, str):
+        # sent in chunks instead of at once
+        body = cStringIO.StringIO(body)
+    return ThrottledReader(body, upload_bucket)
+
+
+def throttleDownload(response):
+    """
+    # @Synopsis  limit the download of a response body
+    # @Args response http response
+    # @Returns   None
+    """
+    response_read = response.read
+    def read(amt=None):
+        """
+        # @Synopsis  read the response, block until the rate allows the data,
+        # replaces read of the response
+        # @Args amt
+        # @Returns   data read
+        """
+        data = response_read(amt)
+        download_bucket.consume(len(data))
+        return data
+    response.read = read
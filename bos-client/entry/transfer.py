@@ -23,6 +23,14 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description=
             'BOS Client, transfer data between local disk and BOS')
     parser.add_argument('bucket_name', help='destination BOS bucket name')
+    parser.add_argument('-r', '--resume', action='store_true', help=('resume the previous '
+        'transfer of the same src and dst, skipping the files already transferred'))
+    parser.add_argument('-p', '--pack', action='store_true', help=('pack small files into '
+        'large pack objects when putting, the packed files are unpacked when getting the '
+        'same path'))
+    parser.add_argument('-z', '--compress', choices=['gzip', 'zstd'], help=('compress files '
+        'by the codec when putting, the objects keep the keys of the files and are '
+        'decompressed when getting. Packed files are not compressed'))
 
     subparsers = parser.add_subparsers(title='mode selection', description=('upload local file to '
             'BOS or download BOS file to local disc'), help='choose mode',
@@ -40,6 +48,13 @@ if __name__ == '__main__':
         'destination path itself, not its parent path(approximately like '
         '"mv bos_path/* local_path/, except that the local_path would be created if not exist).'))
 
+    sync_parser = subparsers.add_parser('sync', help=('put/get only new or changed files, '
+        'a file is changed if its size differs or it is modified later than the destination'))
+    sync_parser.add_argument('direction', choices=['put', 'get'], help=('put local path to '
+        'BOS or get BOS prefix to local'))
+    sync_parser.add_argument('src', help='source local path for put, or BOS prefix for get')
+    sync_parser.add_argument('dst', help='destination BOS path for put, or local path for get')
+
     args = parser.parse_args()
     bucket_name = args.bucket_name
     bos_client = MyBosClient(bucket_name)
@@ -47,12 +62,18 @@ if __name__ == '__main__':
         local_path = args.src
         bos_path = args.dst
         logger.debug('start uploading')
-        bos_client.put(local_path, bos_path)
+        bos_client.put(local_path, bos_path, args.resume, args.pack, args.compress)
     elif args.command == 'get':
         local_path = args.dst
         bos_path = args.src
         logger.debug('start downloading')
-        bos_client.get(bos_path, local_path)
+        bos_client.get(bos_path, local_path, args.resume)
+    elif args.command == 'sync':
+        logger.debug('start syncing')
+        if args.direction == 'put':
+            bos_client.syncPut(args.src, args.dst, args.pack)
+        else:
+            bos_client.syncGet(args.src, args.dst)
 
     end_time = datetime.now()
     time_span = end_time - start_time
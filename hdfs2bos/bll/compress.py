@@ -0,0 +1,199 @@
+"""
+# @file compress.py
+# @Synopsis  streaming compression of uploads and decompression of downloads,
+# data is processed chunk by chunk so that memory stays flat
+# @author Ming Gu(guming@itv.baidu.com))
+# @version 1.0
+# @date 2016-12-29
+"""
+import zlib
+
+from conf.env_config import EnvConfig
+from bll.checksum import ChecksumError
+
+try:
+    import zstandard
+except ImportError as e:
+    # zstd is optional, only gzip is available without it
+    zstandard = None
+
+# user metadata key of the codec of a compressed object, the object keeps the
+# key of the uncompressed file
+COMPRESSION_META_KEY = 'compression'
+# user metadata key of the size of the uncompressed file, a compressed object
+# is listed with its compressed size
+RAW_SIZE_META_KEY = 'raw-size'
+CODECS = ['gzip', 'zstd']
+# bytes of the source read at a time
+CHUNK_SIZE = 1024 * 1024
+# gzip header and trailer instead of the zlib ones
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+# data fed to a copy of a zlib decompressor to tell whether its stream ended
+END_PROBE = '\0'
+
+
+class CompressError(Exception):
+    """
+    # @Synopsis  compress error class
+    """
+    def __init__(self, message=''):
+        self.message = message
+
+
+def checkCodec(codec):
+    """
+    # @Synopsis  make sure a codec is supported and available
+    # @Args codec
+    # @Returns   None
+    """
+    if codec not in CODECS:
+        raise CompressError('unknown codec {}, supported codecs: {}'.format(codec,
+            ', '.join(CODECS)))
+    if codec == 'zstd' and zstandard is None:
+        raise CompressError('zstd requires the zstandard package')
+
+
+def getCompressor(codec, level):
+    """
+    # @Synopsis  new compressor of a codec
+    # @Args codec
+    # @Args level compression level
+    # @Returns   compressor with compress() and flush()
+    """
+    checkCodec(codec)
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=level).compressobj()
+    return zlib.compressobj(level, zlib.DEFLATED, GZIP_WBITS)
+
+
+def getDecompressor(codec):
+    """
+    # @Synopsis  new decompressor of a codec
+    # @Args codec
+    # @Returns   decompressor with decompress()
+    """
+    checkCodec(codec)
+    if codec == 'zstd':
+        return zstandard.ZstdDecompressor().decompressobj()
+    return zlib.decompressobj(GZIP_WBITS)
+
+
+def isStreamEnd(decompressor):
+    """
+    # @Synopsis  whether a decompressor met the end of its compressed stream, a
+    # stream cut short is decompressed without error as far as it goes
+    # @Args decompressor
+    # @Returns   True if the end of the stream is met
+    """
+    if hasattr(decompressor, 'eof'):
+        return decompressor.eof
+    # zlib of python 2 has no eof, data fed after the end of the stream is left
+    # in unused_data instead of being decompressed
+    probe = decompressor.copy()
+    try:
+        probe.decompress(END_PROBE)
+    except zlib.error as e:
+        return False
+    return probe.unused_data.endswith(END_PROBE)
+
+
+class CompressStream(object):
+    """
+    # @Synopsis  file like stream of the compressed data of a source stream,
+    # the source is read chunk by chunk as the compressed data is consumed
+    """
+    def __init__(self, stream, codec, level=EnvConfig.COMPRESS_LEVEL):
+        self.stream = stream
+        self.codec = codec
+        self.compressor = getCompressor(codec, level)
+        self.buf = ''
+        self.eof = False
+        # bytes read from the source
+        self.raw_size = 0
+
+    def read(self, size):
+        """
+        # @Synopsis  read at most size bytes of compressed data, less only at the
+        # end
+        # @Args size
+        # @Returns   compressed data, empty string at the end
+        """
+        chunks = [self.buf]
+        buf_size = len(self.buf)
+        while buf_size < size and not self.eof:
+            data = self.stream.read(CHUNK_SIZE)
+            if not data:
+                chunk = self.compressor.flush()
+                self.eof = True
+            else:
+                self.raw_size += len(data)
+                chunk = self.compressor.compress(data)
+            chunks.append(chunk)
+            buf_size += len(chunk)
+        data = ''.join(chunks)
+        self.buf = data[size:]
+        return data[:size]
+
+    def getUserMetadata(self):
+        """
+        # @Synopsis  user metadata of the compressed object, known once the
+        # source is read to the end
+        # @Returns   dict of the codec and the raw size
+        """
+        return {COMPRESSION_META_KEY: self.codec, RAW_SIZE_META_KEY: str(self.raw_size)}
+
+    def close(self):
+        """
+        # @Synopsis  close the source stream
+        # @Returns   None
+        """
+        self.stream.close()
+
+
+class DecompressStream(object):
+    """
+    # @Synopsis  file like stream of the decompressed data of a compressed
+    # stream, the compressed stream is read chunk by chunk. A compressed stream
+    # cut short raises once it is read to the end
+    """
+    def __init__(self, stream, codec, chunk_size=EnvConfig.BOS_RECV_BUF_SIZE):
+        self.stream = stream
+        self.codec = codec
+        self.decompressor = getDecompressor(codec)
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.eof = False
+
+    def read(self, size):
+        """
+        # @Synopsis  read at most size bytes of decompressed data, less only at
+        # the end
+        # @Args size
+        # @Returns   decompressed data, empty string at the end
+        """
+        chunks = [self.buf]
+        buf_size = len(self.buf)
+        while buf_size < size and not self.eof:
+            data = self.stream.read(self.chunk_size)
+            if not data:
+                self.eof = True
+                if not isStreamEnd(self.decompressor):
+                    raise ChecksumError('truncated {} stream'.format(self.codec))
+                if hasattr(self.decompressor, 'flush'):
+                    chunk = self.decompressor.flush()
+                else:
+                    chunk = ''
+            else:
+                chunk = self.decompressor.decompress(data)
+            chunks.append(chunk)
+            buf_size += len(chunk)
+        data = ''.join(chunks)
+        self.buf = data[size:]
+        return data[:size]
+
+    def close(self):
+        """
+        # @Synopsis  close the compressed stream
+        # @Returns   None
+        """
+        self.stream.close()
@@ -0,0 +1,156 @@
+"""
+# @file concurrency_controller.py
+# @Synopsis  adaptive concurrency of transfers, the number of active transfer
+# slots is adjusted at runtime by additive increase and multiplicative decrease
+# @author Ming Gu(guming@itv.baidu.com))
+# @version 1.0
+# @date 2016-12-23
+"""
+import time
+import threading
+import logging
+
+from conf.env_config import EnvConfig
+
+# the slots are halved once more than this ratio of transfers failed in a window
+ERROR_RATE_THRESHOLD = 0.05
+# or once the latency exceeds this times the best latency, without throughput
+# growing by more than THROUGHPUT_GAIN_THRESHOLD
+LATENCY_FACTOR = 2.0
+THROUGHPUT_GAIN_THRESHOLD = 0.05
+DECREASE_FACTOR = 0.5
+# latency is measured in seconds per LATENCY_UNIT_SIZE bytes, so that windows
+# of small and large files compare, a file smaller than the unit counts as one
+# 1M
+LATENCY_UNIT_SIZE = 1024 * 1024
+# the best latency rises by this ratio each window unless a window beats it, so
+# that a lasting change of the network or the servers becomes the new baseline
+BEST_LATENCY_DRIFT = 0.1
+
+general_logger = logging.getLogger(EnvConfig.GENERAL_LOG_NAME)
+
+
+class ConcurrencyController(object):
+    """
+    # @Synopsis  AIMD concurrency controller, thread safe. Transfer threads
+    # take a slot before each transfer and give it back with the size, latency
+    # and result of the transfer. The transfers finished in each window of
+    # interval seconds are evaluated: the slot limit is halved on a high error
+    # rate or on latency inflation without throughput gain, the latency being
+    # the seconds per LATENCY_UNIT_SIZE bytes of the succeeded transfers compared
+    # with a slowly rising best latency, otherwise it grows
+    # by one if all slots were in use during the window. The limit stays in
+    # [min_slot_cnt, max_slot_cnt], max_slot_cnt being the number of threads
+    """
+    def __init__(self, name, max_slot_cnt, min_slot_cnt=EnvConfig.MIN_THREAD_NUM,
+            interval=EnvConfig.ADAPTIVE_INTERVAL, enabled=EnvConfig.ADAPTIVE_CONCURRENCY):
+        self.name = name
+        self.max_slot_cnt = max(max_slot_cnt, 1)
+        self.min_slot_cnt = max(min(min_slot_cnt, self.max_slot_cnt), 1)
+        self.interval = interval
+        self.enabled = enabled
+        if enabled:
+            self.slot_limit = max((self.max_slot_cnt + 1) / 2, self.min_slot_cnt)
+        else:
+            self.slot_limit = self.max_slot_cnt
+        self.active_cnt = 0
+        self.condition = threading.Condition()
+        self.best_latency = None
+        self.last_throughput = None
+        self.resetWindow()
+
+    def resetWindow(self):
+        """
+        # @Synopsis  start a new evaluation window
+        # @Returns   None
+        """
+        self.window_start_time = time.time()
+        self.window_size = 0
+        self.window_cnt = 0
+        self.window_failure_cnt = 0
+        self.window_latency = 0.0
+        self.window_units = 0.0
+        self.window_saturated = self.active_cnt >= self.slot_limit
+
+    def acquire(self):
+        """
+        # @Synopsis  take a transfer slot, block while all slots are in use
+        # @Returns   None
+        """
+        self.condition.acquire()
+        try:
+            while self.active_cnt >= self.slot_limit:
+                self.condition.wait()
+            self.active_cnt += 1
+            if self.active_cnt >= self.slot_limit:
+                self.window_saturated = True
+        finally:
+            self.condition.release()
+
+    def release(self, size, latency, succeeded):
+        """
+        # @Synopsis  give back a transfer slot and account the transfer
+        # @Args size bytes transferred
+        # @Args latency seconds the transfer took
+        # @Args succeeded
+        # @Returns   None
+        """
+        self.condition.acquire()
+        try:
+            self.active_cnt -= 1
+            self.window_cnt += 1
+            if succeeded:
+                self.window_size += size
+                self.window_latency += latency
+                self.window_units += max(float(size) / LATENCY_UNIT_SIZE, 1.0)
+            else:
+                self.window_failure_cnt += 1
+            if self.enabled and time.time() - self.window_start_time >= self.interval:
+                self.adjust()
+            self.condition.notify_all()
+        finally:
+            self.condition.release()
+
+    def adjust(self):
+        """
+        # @Synopsis  evaluate the window and adjust the slot limit, called with
+        # the condition held
+        # @Returns   None
+        """
+        window_time = time.time() - self.window_start_time
+        throughput = self.window_size / window_time
+        error_rate = float(self.window_failure_cnt) / self.window_cnt
+        if self.window_units > 0:
+            latency = self.window_latency / self.window_units
+        else:
+            # all failed, the error rate decides
+            latency = self.best_latency or 0.0
+        if self.best_latency is None:
+            self.best_latency = latency
+        else:
+            self.best_latency = min(latency, self.best_latency * (1 + BEST_LATENCY_DRIFT))
+        throughput_gained = self.last_throughput is None or \
+                throughput > self.last_throughput * (1 + THROUGHPUT_GAIN_THRESHOLD)
+
+        slot_limit = self.slot_limit
+        if error_rate > ERROR_RATE_THRESHOLD:
+            reason = 'error rate above {:.1f}%'.format(ERROR_RATE_THRESHOLD * 100)
+            slot_limit = int(slot_limit * DECREASE_FACTOR)
+        elif latency > self.best_latency * LATENCY_FACTOR and not throughput_gained:
+            reason = 'latency inflated without throughput gain'
+            slot_limit = int(slot_limit * DECREASE_FACTOR)
+        elif self.window_saturated:
+            reason = 'all slots in use'
+            slot_limit += 1
+        else:
+            reason = 'slots not saturated'
+        slot_limit = min(max(slot_limit, self.min_slot_cnt), self.max_slot_cnt)
+
+        general_logger.info(('{} concurrency {} -> {}, {}: throughput {:.2f}M/s, '
+            'latency {:.3f}s/M(best {:.3f}s/M), error rate {:.1f}%, file_cnt {}').format(
+                self.name, self.slot_limit, slot_limit, reason,
+                throughput / 1024 / 1024, latency, self.best_latency, error_rate * 100,
+                self.window_cnt))
+        self.slot_limit = slot_limit
+        self.last_throughput = throughput
+        self.resetWindow()
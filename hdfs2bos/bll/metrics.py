@@ -0,0 +1,481 @@
+"""
+# @file metrics.py
+# @Synopsis  in-process metrics of transfers, counters, latency histograms and
+# gauges of each stage, exported in the prometheus text format to a textfile
+# and to a local http endpoint
+# @author Ming Gu(guming@itv.baidu.com))
+# @version 1.0
+# @date 2016-12-30
+"""
+import os
+import time
+import threading
+import BaseHTTPServer
+import logging
+
+from conf.env_config import EnvConfig
+
+# upper bounds in seconds of the buckets of latency histograms
+LATENCY_BUCKETS = [0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 600, 1800]
+
+general_logger = logging.getLogger(EnvConfig.GENERAL_LOG_NAME)
+
+
+def formatLabels(label_names, label_values):
+    """
+    # @Synopsis  format the labels of a series
+    # @Args label_names
+    # @Args label_values
+    # @Returns   string like {stage="upload"}, empty if there is no label
+    """
+    if len(label_names) == 0:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, escapeLabel(value))
+            for name, value in zip(label_names, label_values)) + '}'
+
+
+def escapeLabel(value):
+    """
+    # @Synopsis  escape a label value
+    # @Args value
+    # @Returns   escaped string
+    """
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def formatValue(value):
+    """
+    # @Synopsis  format a sample value
+    # @Args value
+    # @Returns   string
+    """
+    if isinstance(value, (int, long)):
+        return str(value)
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class Counter(object):
+    """
+    # @Synopsis  counter, thread safe, one series for each combination of label
+    # values
+    """
+    metric_type = 'counter'
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, labels=()):
+        """
+        # @Synopsis  increase a series
+        # @Args amount
+        # @Args labels tuple of label values
+        # @Returns   None
+        """
+        self.lock.acquire()
+        try:
+            self.values[labels] = self.values.get(labels, 0) + amount
+        finally:
+            self.lock.release()
+
+    def getValues(self):
+        """
+        # @Synopsis  current values of all series
+        # @Returns   dict of label values to value
+        """
+        self.lock.acquire()
+        try:
+            return dict(self.values)
+        finally:
+            self.lock.release()
+
+    def collect(self):
+        """
+        # @Synopsis  samples of all series
+        # @Returns   list of sample lines
+        """
+        return ['{}{} {}'.format(self.name, formatLabels(self.label_names, labels),
+            formatValue(value)) for labels, value in sorted(self.getValues().items())]
+
+
+class Gauge(Counter):
+    """
+    # @Synopsis  gauge, a series is either set or computed by a function when
+    # collected, such as the size of a queue
+    """
+    metric_type = 'gauge'
+
+    def set(self, value, labels=()):
+        """
+        # @Synopsis  set a series
+        # @Args value number, or function returning the number
+        # @Args labels tuple of label values
+        # @Returns   None
+        """
+        self.lock.acquire()
+        try:
+            self.values[labels] = value
+        finally:
+            self.lock.release()
+
+    def getValues(self):
+        """
+        # @Synopsis  current values of all series, functions are called
+        # @Returns   dict of label values to value
+        """
+        values = Counter.getValues(self)
+        for labels, value in values.items():
+            if callable(value):
+                values[labels] = value()
+        return values
+
+
+class Histogram(Counter):
+    """
+    # @Synopsis  histogram, thread safe, observations are counted into
+    # cumulative buckets by upper bounds
+    """
+    metric_type = 'histogram'
+
+    def __init__(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        Counter.__init__(self, name, help_text, label_names)
+        self.buckets = list(buckets) + [float('inf')]
+
+    def observe(self, value, labels=()):
+        """
+        # @Synopsis  observe a value
+        # @Args value
+        # @Args labels tuple of label values
+        # @Returns   None
+        """
+        self.lock.acquire()
+        try:
+            series = self.values.get(labels)
+            if series is None:
+                # counts of the buckets, sum and count
+                series = [[0] * len(self.buckets), 0.0, 0]
+                self.values[labels] = series
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+        finally:
+            self.lock.release()
+
+    def collect(self):
+        """
+        # @Synopsis  samples of all series, buckets are cumulative
+        # @Returns   list of sample lines
+        """
+        self.lock.acquire()
+        try:
+            values = sorted((labels, (list(series[0]), series[1], series[2]))
+                    for labels, series in self.values.items())
+        finally:
+            self.lock.release()
+        lines = []
+        label_names = self.label_names + ('le',)
+        for labels, (bucket_cnts, total, cnt) in values:
+            cumulative_cnt = 0
+            for bound, bucket_cnt in zip(self.buckets, bucket_cnts):
+                cumulative_cnt += bucket_cnt
+                lines.append('{}_bucket{} {}'.format(self.name,
+                    formatLabels(label_names, labels + (formatValue(bound),)),
+                    cumulative_cnt))
+            lines.append('{}_sum{} {}'.format(self.name,
+                formatLabels(self.label_names, labels), formatValue(total)))
+            lines.append('{}_count{} {}'.format(self.name,
+                formatLabels(self.label_names, labels), cnt))
+        return lines
+
+
+class Registry(object):
+    """
+    # @Synopsis  registry of metrics, exported in the order registered
+    """
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        """
+        # @Synopsis  register a metric
+        # @Args metric
+        # @Returns   the metric
+        """
+        self.metrics.append(metric)
+        return metric
+
+    def export(self):
+        """
+        # @Synopsis  export all metrics
+        # @Returns   string in the prometheus text format
+        """
+        lines = []
+        for metric in self.metrics:
+            lines.append('# HELP {} {}'.format(metric.name, metric.help_text))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.metric_type))
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+# stages are list, cache_wait, download, upload, stream and part for hdfs2bos,
+# list, upload, download and part for bos-client, results are succeeded and
+# failed, a failed try being retried counts as failed too
+stage_seconds = registry.register(Histogram('transfer_stage_seconds',
+    'seconds taken by a file or a part in each stage', ('stage',)))
+stage_files = registry.register(Counter('transfer_stage_files_total',
+    'files or parts processed by each stage', ('stage', 'result')))
+# throughput is left to the scraper, such as rate() of prometheus, exporting
+# only monotonic counters keeps the textfile and the http endpoint independent
+stage_bytes = registry.register(Counter('transfer_stage_bytes_total',
+    'bytes processed successfully by each stage', ('stage',)))
+retries = registry.register(Counter('transfer_retries_total',
+    'retries scheduled of each stage', ('stage',)))
+retry_delay_seconds = registry.register(Histogram('transfer_retry_delay_seconds',
+    'backoff delay before retries of each stage', ('stage',)))
+queue_depth = registry.register(Gauge('transfer_queue_depth',
+    'items waiting in each queue', ('queue',)))
+# relay of the updates in a forked worker process, whose registry is not
+# exported, None in the coordinator
+metric_relay = None
+
+
+def relayMetrics(relay):
+    """
+    # @Synopsis  relay the updates of recordStage and recordRetry to the
+    # coordinator in a forked worker process, the relay puts the name and the
+    # args of the update, which the coordinator accounts by accountUpdate
+    # @Args relay object with a put method taking the name and the args
+    # @Returns   None
+    """
+    global metric_relay
+    metric_relay = relay
+
+
+def accountUpdate(name, args):
+    """
+    # @Synopsis  account an update relayed by a worker process
+    # @Args name accountStage or recordRetry
+    # @Args args
+    # @Returns   None
+    """
+    if name == 'accountStage':
+        accountStage(*args)
+    elif name == 'recordRetry':
+        recordRetry(*args)
+
+
+def recordStage(stage, start_time, size=0, succeeded=True, file_cnt=1):
+    """
+    # @Synopsis  account a file or a part processed by a stage
+    # @Args stage
+    # @Args start_time time the stage started
+    # @Args size bytes processed, not counted if failed
+    # @Args succeeded
+    # @Args file_cnt number of files processed, such as the files listed
+    # @Returns   None
+    """
+    args = (stage, time.time() - start_time, size, succeeded, file_cnt)
+    if metric_relay is not None:
+        metric_relay.put('accountStage', args)
+    else:
+        accountStage(*args)
+
+
+def accountStage(stage, seconds, size, succeeded, file_cnt):
+    """
+    # @Synopsis  account a file or a part processed by a stage in the registry
+    # @Args stage
+    # @Args seconds time taken by the stage
+    # @Args size
+    # @Args succeeded
+    # @Args file_cnt
+    # @Returns   None
+    """
+    stage_seconds.observe(seconds, (stage,))
+    stage_files.inc(file_cnt, (stage, 'succeeded' if succeeded else 'failed'))
+    if succeeded and size > 0:
+        stage_bytes.inc(size, (stage,))
+
+
+def recordRetry(stage, delay):
+    """
+    # @Synopsis  account a retry scheduled
+    # @Args stage
+    # @Args delay seconds before the retry
+    # @Returns   None
+    """
+    if metric_relay is not None:
+        metric_relay.put('recordRetry', (stage, delay))
+        return
+    retries.inc(1, (stage,))
+    retry_delay_seconds.observe(delay, (stage,))
+
+
+class TextfileWriter(threading.Thread):
+    """
+    # @Synopsis  textfile writer, write the metrics to a file periodically,
+    # through a temporary file renamed in place, so that the file is never
+    # read half written, e.g. by the textfile collector of node_exporter
+    """
+    def __init__(self, path, interval):
+        threading.Thread.__init__(self)
+        self.path = path
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def write(self):
+        """
+        # @Synopsis  write the metrics once
+        # @Returns   None
+        """
+        tmp_path = '{}.{}.tmp'.format(self.path, os.getpid())
+        try:
+            tmp_file = open(tmp_path, 'w')
+            try:
+                tmp_file.write(registry.export())
+            finally:
+                tmp_file.close()
+            os.rename(tmp_path, self.path)
+        except EnvironmentError as e:
+            general_logger.warning('failed to write metrics to {}: {}'.format(self.path, e))
+
+    def run(self):
+        """
+        # @Synopsis  run thread
+        # @Returns   None
+        """
+        while not self.stopped.wait(self.interval):
+            self.write()
+
+    def stop(self):
+        """
+        # @Synopsis  stop the thread and write the final metrics
+        # @Returns   None
+        """
+        self.stopped.set()
+        self.join()
+        self.write()
+
+
+class MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    # @Synopsis  http handler serving the metrics on /metrics
+    """
+    def do_GET(self):
+        """
+        # @Synopsis  serve a GET request
+        # @Returns   None
+        """
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = registry.export()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        """
+        # @Synopsis  log requests to the general log instead of stderr
+        # @Returns   None
+        """
+        general_logger.debug('metrics request from {}: {}'.format(self.client_address[0],
+            format % args))
+
+
+class MetricsServer(threading.Thread):
+    """
+    # @Synopsis  http server of the metrics, serving in a thread until stopped
+    """
+    def __init__(self, host, port):
+        threading.Thread.__init__(self)
+        self.server = BaseHTTPServer.HTTPServer((host, port), MetricsHandler)
+
+    def run(self):
+        """
+        # @Synopsis  run thread
+        # @Returns   None
+        """
+        self.server.serve_forever()
+
+    def stop(self):
+        """
+        # @Synopsis  stop serving and close the socket
+        # @Returns   None
+        """
+        self.server.shutdown()
+        self.join()
+        self.server.server_close()
+
+
+shared_lock = threading.Lock()
+exporters = []
+
+
+def startExporters():
+    """
+    # @Synopsis  start the configured exporters, the textfile writer if a
+    # textfile is set and the http server if a port is set. Does nothing if
+    # they are running
+    # @Returns   None
+    """
+    shared_lock.acquire()
+    try:
+        if len(exporters) > 0:
+            return
+        if EnvConfig.METRICS_TEXTFILE:
+            exporters.append(TextfileWriter(EnvConfig.METRICS_TEXTFILE,
+                EnvConfig.METRICS_INTERVAL))
+        if EnvConfig.METRICS_HTTP_PORT > 0:
+            try:
+                exporters.append(MetricsServer(EnvConfig.METRICS_HTTP_HOST,
+                    EnvConfig.METRICS_HTTP_PORT))
+                general_logger.info('serving metrics on http://{}:{}/metrics'.format(
+                    EnvConfig.METRICS_HTTP_HOST, EnvConfig.METRICS_HTTP_PORT))
+            except EnvironmentError as e:
+                general_logger.warning('failed to serve metrics on {}:{}: {}'.format(
+                    EnvConfig.METRICS_HTTP_HOST, EnvConfig.METRICS_HTTP_PORT, e))
+        for exporter in exporters:
+            exporter.daemon = True
+            exporter.start()
+    finally:
+        shared_lock.release()
+
+
+def reinitMetrics():
+    """
+    # @Synopsis  replace the locks of the metrics in a forked process, they may
+    # have been held by a thread of the parent process, such as an exporter,
+    # which is not inherited
+    # @Returns   None
+    """
+    global shared_lock
+    shared_lock = threading.Lock()
+    del exporters[:]
+    for metric in registry.metrics:
+        metric.lock = threading.Lock()
+
+
+def stopExporters():
+    """
+    # @Synopsis  stop the running exporters, the textfile is written a last time
+    # @Returns   None
+    """
+    shared_lock.acquire()
+    try:
+        for exporter in exporters:
+            exporter.stop()
+        del exporters[:]
+    finally:
+        shared_lock.release()
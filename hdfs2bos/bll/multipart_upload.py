@@ -0,0 +1,453 @@
+"""
+# @file multipart_upload.py
+# @Synopsis  upload large file to BOS by parts, parts are uploaded concurrently
+# @author Ming Gu(guming@itv.baidu.com))
+# @version 1.0
+# @date 2016-12-12
+"""
+import os
+import io
+import time
+import hashlib
+import threading
+import Queue
+import logging
+
+from conf.env_config import EnvConfig
+from bll.retry import isRetryable
+from bll.retry import getRetryDelay
+from bll.retry import getRetryQueue
+from bll.checksum import MD5_META_KEY
+from bll.checksum import DigestReader
+from bll.checksum import getContentMD5
+from bll.checksum import verifyMD5
+from bll.metrics import recordStage
+from bll.metrics import recordRetry
+from bll.schedule import NotifyingQueue
+from bll.schedule import split_tasks
+from dao.mapped_file import MappedFileReader
+from dao.bos import putObjectWithoutMD5
+
+general_logger = logging.getLogger(EnvConfig.GENERAL_LOG_NAME)
+
+# BOS limits the number of parts of a single multipart upload
+MAX_PART_CNT = 10000
+
+
+class MultipartUploadError(Exception):
+    """
+    # @Synopsis  multipart upload error class
+    """
+    def __init__(self, message=''):
+        self.message = message
+
+
+def mergeMD5Meta(user_metadata, md5):
+    """
+    # @Synopsis  add the md5 of an object to its user metadata
+    # @Args user_metadata dict of user metadata, None if there is none
+    # @Args md5 hex md5 of the object
+    # @Returns   new dict of user metadata
+    """
+    user_metadata = dict(user_metadata or {})
+    user_metadata[MD5_META_KEY] = md5
+    return user_metadata
+
+
+class MultipartUploader(object):
+    """
+    # @Synopsis  multipart uploader, initiate a multipart upload, upload parts
+    # read from file offsets or from a stream by a pool of part threads, then
+    # complete it. A part failed by a retryable error is retried alone through
+    # the retry queue. The md5 of every part is verified by BOS, computed while
+    # the part is read. Queued parts are also taken by idle transfer workers
+    # through the split task registry
+    """
+    def __init__(self, bos_client, bucket_name, part_size=EnvConfig.PART_SIZE,
+            thread_num=EnvConfig.PART_THREAD_NUM):
+        self.bos_client = bos_client
+        self.bucket_name = bucket_name
+        self.part_size = part_size
+        self.thread_num = thread_num
+
+    def getPartSize(self, file_size):
+        """
+        # @Synopsis  part size of the given file, enlarged if the file would be
+        # split into more parts than BOS allows
+        # @Args file_size
+        # @Returns   part size
+        """
+        min_part_size = (file_size + MAX_PART_CNT - 1) / MAX_PART_CNT
+        return max(self.part_size, min_part_size)
+
+    def uploadFile(self, src_file, dst_key):
+        """
+        # @Synopsis  upload a local file to BOS, by parts if it is not smaller
+        # than the multipart threshold, otherwise by a single PUT. For a single
+        # PUT in zero copy mode, the file is sent from its mapping. Otherwise it
+        # is read only once into memory, its md5 is computed meanwhile and sent
+        # as Content-MD5, instead of the SDK reading the file once more for the
+        # md5
+        # @Args src_file local file path
+        # @Args dst_key destination object key
+        # @Returns   md5 of the file, None if uploaded by parts
+        """
+        if os.path.getsize(src_file) >= EnvConfig.MULTIPART_THRESHOLD:
+            self.upload(src_file, dst_key)
+            return None
+        if EnvConfig.ZERO_COPY:
+            return self.putMappedFile(src_file, dst_key)
+        src_obj = open(src_file, 'rb')
+        try:
+            reader = DigestReader(src_obj)
+            data = reader.read()
+        finally:
+            src_obj.close()
+        self.putString(data, dst_key, reader.hexdigest())
+        return reader.hexdigest()
+
+    def putString(self, data, dst_key, md5, user_metadata=None):
+        """
+        # @Synopsis  upload data by a single PUT, verified by Content-MD5, the md5
+        # is kept in the user metadata for verifying downloads
+        # @Args data
+        # @Args dst_key destination object key
+        # @Args md5 hex md5 of the data
+        # @Args user_metadata dict of other user metadata of the object
+        # @Returns   None
+        """
+        self.bos_client.put_object_from_string(self.bucket_name, dst_key, data,
+                content_md5=getContentMD5(md5),
+                user_metadata=mergeMD5Meta(user_metadata, md5))
+
+    def putMappedFile(self, src_file, dst_key):
+        """
+        # @Synopsis  upload a local file by a single PUT from its mapping. The
+        # md5 is computed while the file is sent and compared with the etag,
+        # it is not known before the request for Content-MD5 and the user
+        # metadata, a digest of the mapping beforehand would be a second pass
+        # @Args src_file local file path
+        # @Args dst_key destination object key
+        # @Returns   md5 of the file
+        """
+        src_obj = MappedFileReader(src_file)
+        try:
+            reader = DigestReader(src_obj)
+            response = putObjectWithoutMD5(self.bos_client, self.bucket_name, dst_key,
+                    reader, src_obj.size)
+        finally:
+            src_obj.close()
+        verifyMD5(src_file, response.metadata.etag, reader.hexdigest())
+        return reader.hexdigest()
+
+    def upload(self, src_file, dst_key):
+        """
+        # @Synopsis  upload a local file to BOS by parts, the multipart upload is
+        # aborted if any of the parts failed. Parts are read from their offsets
+        # concurrently, so the md5 of the whole file is not known
+        # @Args src_file local file path
+        # @Args dst_key destination object key
+        # @Returns   None
+        """
+        file_size = os.path.getsize(src_file)
+        part_size = self.getPartSize(file_size)
+        task = self.initiate(src_file, dst_key)
+        part_threads = self.startPartThreads(task)
+        split_tasks.register(task['helper'])
+
+        offset = 0
+        part_number = 1
+        while offset < file_size:
+            self.putPart(task, dict({
+                'part_number': part_number,
+                'offset': offset,
+                'part_size': min(part_size, file_size - offset),
+                'retry_cnt': 0
+                }))
+            offset += part_size
+            part_number += 1
+        general_logger.debug('start multipart upload {} --> {}, part_cnt = {}'.format(
+            src_file, dst_key, part_number - 1))
+        self.complete(task, part_threads)
+
+    def uploadStream(self, stream, dst_key, stream_name=None, user_metadata=None):
+        """
+        # @Synopsis  upload a stream of unknown size to BOS. The stream is read
+        # in chunks of part size and each chunk is uploaded as a part, at most
+        # twice the part thread number plus one chunks are held in memory. A stream
+        # shorter than one part is uploaded by a single PUT. The md5 of the
+        # stream is computed while it is read, and kept in the user metadata.
+        # The stream is read to its end before the object is committed, an
+        # error raised by read(), such as that of a truncated stream, aborts
+        # the upload
+        # @Args stream file like object, only read() is used
+        # @Args dst_key destination object key
+        # @Args stream_name name of the stream used in logs
+        # @Args user_metadata dict of other user metadata of the object, or a
+        # function returning it for metadata known once the stream is read
+        # @Returns   tuple of total size and md5 of the stream
+        """
+        stream_name = stream_name or dst_key
+        stream = DigestReader(stream)
+        data = stream.read(self.part_size)
+        if len(data) < self.part_size:
+            if callable(user_metadata):
+                user_metadata = user_metadata()
+            self.putString(data, dst_key, stream.hexdigest(), user_metadata)
+            return len(data), stream.hexdigest()
+
+        task = self.initiate(stream_name, dst_key)
+        part_threads = self.startPartThreads(task)
+        split_tasks.register(task['helper'])
+        general_logger.debug('start multipart stream upload {} --> {}'.format(
+            stream_name, dst_key))
+        total_size = 0
+        part_number = 1
+        try:
+            while len(data) > 0 and len(task['errors']) == 0:
+                if part_number > MAX_PART_CNT:
+                    task['errors'].append('stream exceeds {} parts'.format(MAX_PART_CNT))
+                    break
+                self.putPart(task, dict({
+                    'part_number': part_number,
+                    'data': data,
+                    'retry_cnt': 0
+                    }))
+                total_size += len(data)
+                part_number += 1
+                data = stream.read(self.part_size)
+        except Exception as e:
+            # a stream failed part way, such as a truncated one, must not be
+            # completed, the parts queued are drained and the upload aborted
+            task['errors'].append(e.message)
+            self.stopPartThreads(task, part_threads)
+            self.abort(task)
+            raise
+        if callable(user_metadata):
+            user_metadata = user_metadata()
+        self.complete(task, part_threads, mergeMD5Meta(user_metadata, stream.hexdigest()))
+        return total_size, stream.hexdigest()
+
+    def initiate(self, src_name, dst_key):
+        """
+        # @Synopsis  initiate a multipart upload
+        # @Args src_name source file name
+        # @Args dst_key destination object key
+        # @Returns   multipart upload task
+        """
+        response = self.bos_client.initiate_multipart_upload(self.bucket_name, dst_key)
+        task = dict({
+            'src_name': src_name,
+            'dst_key': dst_key,
+            'upload_id': response.upload_id,
+            'part_queue': NotifyingQueue(self.thread_num),
+            'part_list': [],
+            'errors': [],
+            # parts put but not finished yet, including the ones to be retried
+            'pending_cnt': 0,
+            'condition': threading.Condition()
+            })
+        task['helper'] = lambda: self.helpPart(task)
+        return task
+
+    def putPart(self, task, part):
+        """
+        # @Synopsis  put a part to be uploaded by the part threads
+        # @Args task
+        # @Args part
+        # @Returns   None
+        """
+        task['condition'].acquire()
+        task['pending_cnt'] += 1
+        task['condition'].release()
+        task['part_queue'].put(part)
+
+    def startPartThreads(self, task):
+        """
+        # @Synopsis  start part threads of a multipart upload task
+        # @Args task
+        # @Returns   list of started part threads
+        """
+        part_threads = []
+        for i in range(self.thread_num):
+            part_thread = PartUploadThread(self, task)
+            part_thread.daemon = True
+            part_thread.start()
+            part_threads.append(part_thread)
+        return part_threads
+
+    def helpPart(self, task):
+        """
+        # @Synopsis  upload a queued part of a task in the calling thread
+        # @Args task
+        # @Returns   True if a part was uploaded
+        """
+        try:
+            part = task['part_queue'].get_nowait()
+        except Queue.Empty:
+            return False
+        if part is None:
+            # the task is completing, the stop mark is left to its part threads
+            task['part_queue'].put(None)
+            return False
+        PartUploadThread(self, task).processPart(part)
+        return True
+
+    def stopPartThreads(self, task, part_threads):
+        """
+        # @Synopsis  wait for all parts put to be finished, then stop the part
+        # threads of a task and stop helping with its parts
+        # @Args task
+        # @Args part_threads
+        # @Returns   None
+        """
+        # parts being retried are put back to the part queue later
+        task['condition'].acquire()
+        while task['pending_cnt'] > 0:
+            task['condition'].wait()
+        task['condition'].release()
+        split_tasks.unregister(task['helper'])
+        for part_thread in part_threads:
+            task['part_queue'].put(None)
+        for part_thread in part_threads:
+            part_thread.join()
+
+    def abort(self, task):
+        """
+        # @Synopsis  abort a multipart upload, a failure is only logged
+        # @Args task
+        # @Returns   None
+        """
+        try:
+            self.bos_client.abort_multipart_upload(self.bucket_name, task['dst_key'],
+                    task['upload_id'])
+        except Exception as e:
+            general_logger.warning('failed to abort multipart upload {}: {}'.format(
+                task['dst_key'], e.message))
+
+    def complete(self, task, part_threads, user_metadata=None):
+        """
+        # @Synopsis  wait for all parts uploaded, then complete the multipart
+        # upload, or abort it if any of the parts failed
+        # @Args task
+        # @Args part_threads
+        # @Args user_metadata dict of user metadata of the object
+        # @Returns   None
+        """
+        self.stopPartThreads(task, part_threads)
+        if len(task['errors']) > 0:
+            self.abort(task)
+            raise MultipartUploadError('multipart upload {} --> {} failed: {}'.format(
+                task['src_name'], task['dst_key'], task['errors'][0]))
+
+        part_list = sorted(task['part_list'], key=lambda x: x['partNumber'])
+        self.bos_client.complete_multipart_upload(self.bucket_name, task['dst_key'],
+                task['upload_id'], part_list, user_metadata=user_metadata)
+
+
+class PartUploadThread(threading.Thread):
+    """
+    # @Synopsis  part upload thread, take parts from the part queue of a
+    # multipart upload and upload them until a None is met. A part failed by a
+    # retryable error is put to the retry queue until it runs out of retries.
+    # Once any part failed, the remaining parts are drained without being
+    # uploaded
+    """
+    def __init__(self, uploader, task):
+        threading.Thread.__init__(self)
+        self.uploader = uploader
+        self.task = task
+
+    def run(self):
+        """
+        # @Synopsis  run thread
+        # @Returns   None
+        """
+        while True:
+            part = self.task['part_queue'].get()
+            if part is None:
+                break
+            self.processPart(part)
+
+    def processPart(self, part):
+        """
+        # @Synopsis  upload a part, or put it to the retry queue if it failed by
+        # a retryable error, or skip it if the task already failed
+        # @Args part
+        # @Returns   None
+        """
+        task = self.task
+        if len(task['errors']) > 0:
+            self.finishPart()
+            return
+        start_time = time.time()
+        try:
+            response = self.uploadPart(part)
+            recordStage('part', start_time, len(part['data']) if 'data' in part \
+                    else part['part_size'])
+            task['condition'].acquire()
+            task['part_list'].append({
+                'partNumber': part['part_number'],
+                'eTag': response.metadata.etag
+                })
+            task['condition'].release()
+            self.finishPart()
+        except Exception as e:
+            recordStage('part', start_time, succeeded=False)
+            if isRetryable(e) and part['retry_cnt'] < EnvConfig.RETRY_CNT:
+                part['retry_cnt'] += 1
+                delay = getRetryDelay(part['retry_cnt'])
+                recordRetry('part', delay)
+                general_logger.debug(('failed to upload part {} of {}, retry {}/{} in '
+                    '{:.1f}s: {}').format(part['part_number'], task['src_name'],
+                        part['retry_cnt'], EnvConfig.RETRY_CNT, delay, e.message))
+                getRetryQueue().put(task['part_queue'], part, delay)
+                return
+            general_logger.debug('failed to upload part {} of {}: {}'.format(
+                part['part_number'], task['src_name'], e.message))
+            task['condition'].acquire()
+            task['errors'].append('part {}: {}'.format(part['part_number'], e.message))
+            task['condition'].release()
+            self.finishPart()
+
+    def finishPart(self):
+        """
+        # @Synopsis  account a part uploaded, failed or skipped
+        # @Returns   None
+        """
+        task = self.task
+        task['condition'].acquire()
+        task['pending_cnt'] -= 1
+        task['condition'].notify_all()
+        task['condition'].release()
+
+    def uploadPart(self, part):
+        """
+        # @Synopsis  upload a single part, from memory if the part carries its
+        # data, with its md5 as Content-MD5. Otherwise from its region of the
+        # source file, mapped in zero copy mode, the md5 is computed while the
+        # part is sent and compared with the etag of the part
+        # @Args part
+        # @Returns   upload part response
+        """
+        task = self.task
+        if 'data' in part:
+            return self.uploader.bos_client.upload_part(self.uploader.bucket_name,
+                    task['dst_key'], task['upload_id'], part['part_number'],
+                    len(part['data']), io.BytesIO(part['data']),
+                    part_md5=getContentMD5(hashlib.md5(part['data']).hexdigest()))
+        if EnvConfig.ZERO_COPY:
+            src_obj = MappedFileReader(task['src_name'], part['offset'], part['part_size'])
+        else:
+            src_obj = open(task['src_name'], 'rb')
+            src_obj.seek(part['offset'])
+        try:
+            reader = DigestReader(src_obj)
+            response = self.uploader.bos_client.upload_part(self.uploader.bucket_name,
+                    task['dst_key'], task['upload_id'], part['part_number'],
+                    part['part_size'], reader)
+        finally:
+            src_obj.close()
+        verifyMD5('part {} of {}'.format(part['part_number'], task['src_name']),
+                response.metadata.etag, reader.hexdigest())
+        return response
@@ -0,0 +1,433 @@
+"""
+# @file process_pool.py
+# @Synopsis  pool of worker processes for the CPU bound per byte work of the
+# transfers, such as checksums, compression and request signing, which the GIL
+# limits to about one core in a single process
+# @author Ming Gu(guming@itv.baidu.com))
+# @version 1.0
+# @date 2017-01-04
+"""
+import time
+import signal
+import threading
+import Queue
+import logging
+import multiprocessing
+
+from conf.env_config import EnvConfig
+from conf.init_logger import QueueHandler
+from bll.retry import isRetryable
+from bll.retry import reinitRetryQueue
+from bll.schedule import NotifyingQueue
+from bll.schedule import getOrHelp
+from bll.schedule import split_tasks
+from bll.metrics import Gauge
+from bll.metrics import registry
+from bll.metrics import reinitMetrics
+from bll.metrics import relayMetrics
+from bll.metrics import accountUpdate
+from dao import rate_limiter
+from dao.bos import reinitBosClient
+
+# seconds between checks of the worker processes being alive
+CHECK_INTERVAL = 1
+# counters of each worker kept in shared memory, in this order
+COUNTER_NAMES = ['finished', 'failed']
+# task id in the slot of an idle worker thread
+IDLE_SLOT = -1
+
+general_logger = logging.getLogger(EnvConfig.GENERAL_LOG_NAME)
+
+worker_tasks = registry.register(Gauge('transfer_worker_tasks',
+    'tasks running, finished and failed in each worker process', ('worker', 'state')))
+
+
+class WorkerError(Exception):
+    """
+    # @Synopsis  error of a task in a worker process, relayed to the
+    # coordinator with the message of the original error and whether it is
+    # retryable
+    """
+    def __init__(self, message='', retryable=False):
+        self.message = message
+        self.retryable = retryable
+
+
+class LogRelay(object):
+    """
+    # @Synopsis  stand-in of the log writer in a worker process, records are
+    # relayed to the coordinator and written by its log writer
+    """
+    def __init__(self, result_queue, logger_name):
+        self.result_queue = result_queue
+        self.logger_name = logger_name
+
+    def put(self, handlers, record):
+        """
+        # @Synopsis  relay a record, its message is formatted already
+        # @Args handlers target handlers, those of the coordinator are used
+        # @Args record
+        # @Returns   None
+        """
+        self.result_queue.put(('log', self.logger_name, record))
+
+
+class MetricRelay(object):
+    """
+    # @Synopsis  relay of the metric updates of a worker process, they are
+    # accounted in the registry of the coordinator, which is the one exported
+    """
+    def __init__(self, result_queue):
+        self.result_queue = result_queue
+
+    def put(self, name, args):
+        """
+        # @Synopsis  relay an update
+        # @Args name
+        # @Args args
+        # @Returns   None
+        """
+        self.result_queue.put(('metric', name, args))
+
+
+class ProcessPool(object):
+    """
+    # @Synopsis  pool of worker processes. The coordinator, the process which
+    # starts the pool, keeps the listing, scheduling, retries, journal and
+    # progress, its threads hand tasks to the workers by call, which blocks
+    # until the result is back. A task is a method of the target called by name,
+    # the workers are forked with a copy of the target. Each worker has its own
+    # task queue, a task goes to the live worker with the fewest tasks, and
+    # runs enough threads for the thread_num tasks of the coordinator, which
+    # help with the parts of large files while idle. Results, log records and
+    # metric updates come back by a result queue, the task run by each worker thread and the
+    # tasks finished and failed by each worker are kept in shared memory
+    # counters
+    """
+    def __init__(self, process_num, thread_num, target, init_worker=None,
+            retryable_classes=()):
+        self.process_num = process_num
+        self.worker_thread_num = (thread_num + process_num - 1) / process_num
+        self.target = target
+        self.init_worker = init_worker
+        self.retryable_classes = retryable_classes
+        self.task_queues = [multiprocessing.Queue() for i in range(process_num)]
+        self.result_queue = multiprocessing.Queue()
+        self.counters = multiprocessing.Array('l', process_num * len(COUNTER_NAMES))
+        self.slots = multiprocessing.Array('l',
+                [IDLE_SLOT] * (process_num * self.worker_thread_num), lock=False)
+        self.lock = threading.Lock()
+        self.pending_results = dict()
+        # tasks given to each worker and not finished yet
+        self.worker_task_cnts = [0] * process_num
+        self.task_cnt = 0
+        self.workers = []
+        self.dead_workers = set()
+        self.stopping = False
+        self.collector = None
+
+    def start(self):
+        """
+        # @Synopsis  fork the workers and start collecting their results. The
+        # pool must be started before the transfer threads, a forked process
+        # runs only the thread which forked it
+        # @Returns   None
+        """
+        for worker_index in range(self.process_num):
+            worker = multiprocessing.Process(target=self.runWorker, args=(worker_index,))
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+            worker_tasks.set(lambda i=worker_index: self.getRunningCnt(i),
+                    (str(worker_index), 'running'))
+            for counter_index, counter_name in enumerate(COUNTER_NAMES):
+                worker_tasks.set(lambda i=worker_index * len(COUNTER_NAMES) + counter_index:
+                        self.counters[i], (str(worker_index), counter_name))
+        self.collector = ResultCollector(self)
+        self.collector.daemon = True
+        self.collector.start()
+        general_logger.info('started {} worker processes of {} threads'.format(
+            self.process_num, self.worker_thread_num))
+
+    def call(self, name, *args):
+        """
+        # @Synopsis  run a method of the target by a worker, block until it is
+        # done
+        # @Args name method name
+        # @Args args picklable arguments
+        # @Returns   result of the method
+        """
+        result = {'event': threading.Event()}
+        self.lock.acquire()
+        try:
+            live_workers = filter(lambda i: i not in self.dead_workers,
+                    range(self.process_num))
+            if len(live_workers) == 0:
+                raise WorkerError('no worker process left')
+            worker_index = min(live_workers, key=lambda i: self.worker_task_cnts[i])
+            task_id = self.task_cnt
+            self.task_cnt += 1
+            result['worker'] = worker_index
+            self.worker_task_cnts[worker_index] += 1
+            self.pending_results[task_id] = result
+        finally:
+            self.lock.release()
+        self.task_queues[worker_index].put((task_id, name, args))
+        result['event'].wait()
+        if 'error' in result:
+            message, retryable = result['error']
+            raise WorkerError(message, retryable)
+        return result['value']
+
+    def finishTask(self, task_id, value=None, error=None):
+        """
+        # @Synopsis  hand the result of a task to the waiting caller, a task
+        # finished already is ignored
+        # @Args task_id
+        # @Args value result of the method
+        # @Args error tuple of message and retryable if the method raised
+        # @Returns   None
+        """
+        self.lock.acquire()
+        result = self.pending_results.pop(task_id, None)
+        if result is not None:
+            self.worker_task_cnts[result['worker']] -= 1
+        self.lock.release()
+        if result is None:
+            return
+        if error is None:
+            result['value'] = value
+        else:
+            result['error'] = error
+        result['event'].set()
+
+    def checkWorkers(self):
+        """
+        # @Synopsis  fail the tasks given to the workers which died, such as
+        # killed by a signal, running or still queued, all pending tasks are
+        # failed once no worker is left
+        # @Returns   None
+        """
+        if self.stopping:
+            return
+        for worker_index, worker in enumerate(self.workers):
+            if worker_index in self.dead_workers or worker.is_alive():
+                continue
+            general_logger.error('worker process {} exited with code {}'.format(
+                worker_index, worker.exitcode))
+            # no task is given to the worker once it is marked dead
+            self.lock.acquire()
+            self.dead_workers.add(worker_index)
+            task_ids = filter(lambda i: self.pending_results[i]['worker'] == worker_index,
+                    self.pending_results.keys())
+            self.lock.release()
+            for task_id in task_ids:
+                self.finishTask(task_id, error=('worker process exited with code {}'.format(
+                    worker.exitcode), True))
+            slot_start = worker_index * self.worker_thread_num
+            for slot in range(slot_start, slot_start + self.worker_thread_num):
+                self.slots[slot] = IDLE_SLOT
+        if len(self.dead_workers) == self.process_num:
+            self.lock.acquire()
+            task_ids = self.pending_results.keys()
+            self.lock.release()
+            for task_id in task_ids:
+                self.finishTask(task_id, error=('no worker process left', False))
+
+    def getRunningCnt(self, worker_index):
+        """
+        # @Synopsis  number of tasks being run by a worker
+        # @Args worker_index
+        # @Returns   number
+        """
+        slot_start = worker_index * self.worker_thread_num
+        return len(filter(lambda x: x != IDLE_SLOT,
+            self.slots[slot_start:slot_start + self.worker_thread_num]))
+
+    def countTask(self, worker_index, counter_name):
+        """
+        # @Synopsis  increase a counter of a worker, called in the worker
+        # @Args worker_index
+        # @Args counter_name
+        # @Returns   None
+        """
+        counter_index = worker_index * len(COUNTER_NAMES) + COUNTER_NAMES.index(counter_name)
+        self.counters.get_lock().acquire()
+        try:
+            self.counters[counter_index] += 1
+        finally:
+            self.counters.get_lock().release()
+
+    def stop(self):
+        """
+        # @Synopsis  stop the workers after the queued tasks and wait for them,
+        # then stop collecting results
+        # @Returns   None
+        """
+        self.stopping = True
+        for task_queue in self.task_queues:
+            for i in range(self.worker_thread_num):
+                task_queue.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.result_queue.put(None)
+        self.collector.join()
+
+    def logStats(self):
+        """
+        # @Synopsis  log the tasks finished and failed by each worker
+        # @Returns   None
+        """
+        counters = self.counters[:]
+        general_logger.info('process pool: ' + ', '.join(map(lambda i:
+            'worker {} finished {} failed {}'.format(i, counters[i * len(COUNTER_NAMES)],
+                counters[i * len(COUNTER_NAMES) + 1]), range(self.process_num))))
+
+    def runWorker(self, worker_index):
+        """
+        # @Synopsis  run a worker process. The state inherited from the
+        # coordinator which must not be shared, the log writer, the BOS
+        # connections, the retry queue and the split tasks, is replaced, so are
+        # the module locks which a thread of the coordinator, such as the log
+        # writer or an exporter, may have held at the fork. The metric updates
+        # are relayed to the coordinator like the log records, and the worker is
+        # limited to its share of the rates. SIGINT is left to the coordinator,
+        # which terminates the workers at exit
+        # @Args worker_index
+        # @Returns   None
+        """
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        self.relayLogs()
+        reinitBosClient()
+        reinitRetryQueue()
+        reinitMetrics()
+        relayMetrics(MetricRelay(self.result_queue))
+        split_tasks.reinit()
+        rate_limiter.shareRates(self.process_num)
+        if self.init_worker is not None:
+            self.init_worker()
+        task_queue = NotifyingQueue()
+        task_relay = TaskRelay(self.task_queues[worker_index], task_queue,
+                self.worker_thread_num)
+        task_relay.daemon = True
+        task_relay.start()
+        worker_threads = []
+        for i in range(self.worker_thread_num):
+            worker_thread = WorkerThread(self, task_queue, worker_index,
+                    worker_index * self.worker_thread_num + i)
+            worker_thread.daemon = True
+            worker_thread.start()
+            worker_threads.append(worker_thread)
+        for worker_thread in worker_threads:
+            worker_thread.join()
+
+    def relayLogs(self):
+        """
+        # @Synopsis  relay the records of the queue handlers of all loggers to
+        # the coordinator, the log writer thread is not inherited by the fork.
+        # The locks of the logging module and of all handlers are replaced
+        # @Returns   None
+        """
+        logging._lock = threading.RLock()
+        loggers = [logging.root] + logging.Logger.manager.loggerDict.values()
+        for logger in loggers:
+            for handler in getattr(logger, 'handlers', []):
+                handler.createLock()
+                if isinstance(handler, QueueHandler):
+                    handler.log_writer = LogRelay(self.result_queue, logger.name)
+
+
+class TaskRelay(threading.Thread):
+    """
+    # @Synopsis  thread of a worker process, move the tasks of the worker from
+    # its process shared queue to the queue of its threads, whose puts wake the
+    # idle threads, until a None is moved for each thread
+    """
+    def __init__(self, source_queue, target_queue, thread_num):
+        threading.Thread.__init__(self)
+        self.source_queue = source_queue
+        self.target_queue = target_queue
+        self.thread_num = thread_num
+
+    def run(self):
+        """
+        # @Synopsis  run thread
+        # @Returns   None
+        """
+        stop_cnt = 0
+        while stop_cnt < self.thread_num:
+            task = self.source_queue.get()
+            if task is None:
+                stop_cnt += 1
+            self.target_queue.put(task)
+
+
+class WorkerThread(threading.Thread):
+    """
+    # @Synopsis  thread of a worker process, take tasks from the task queue and
+    # run them one by one until a None is taken. The task being run is kept in
+    # the slot of the thread for the running gauge. While the queue is empty,
+    # the thread helps with the parts of large files
+    """
+    def __init__(self, pool, task_queue, worker_index, slot):
+        threading.Thread.__init__(self)
+        self.pool = pool
+        self.task_queue = task_queue
+        self.worker_index = worker_index
+        self.slot = slot
+
+    def run(self):
+        """
+        # @Synopsis  run thread
+        # @Returns   None
+        """
+        pool = self.pool
+        while True:
+            task = getOrHelp(self.task_queue)
+            if task is None:
+                break
+            task_id, name, args = task
+            pool.slots[self.slot] = task_id
+            try:
+                result = ('result', task_id, getattr(pool.target, name)(*args), None)
+                pool.countTask(self.worker_index, 'finished')
+            except Exception as e:
+                result = ('result', task_id, None,
+                        (e.message, isRetryable(e, pool.retryable_classes)))
+                pool.countTask(self.worker_index, 'failed')
+            pool.result_queue.put(result)
+            pool.slots[self.slot] = IDLE_SLOT
+
+
+class ResultCollector(threading.Thread):
+    """
+    # @Synopsis  result collector thread of the coordinator, hand the results
+    # of the workers to the callers, write their log records and account their
+    # metric updates, until a None is taken. The workers are checked every CHECK_INTERVAL seconds
+    """
+    def __init__(self, pool):
+        threading.Thread.__init__(self)
+        self.pool = pool
+
+    def run(self):
+        """
+        # @Synopsis  run thread
+        # @Returns   None
+        """
+        last_check_time = time.time()
+        while True:
+            try:
+                message = self.pool.result_queue.get(True, CHECK_INTERVAL)
+            except Queue.Empty:
+                message = ()
+            if message is None:
+                break
+            if len(message) > 0 and message[0] == 'log':
+                logging.getLogger(message[1]).handle(message[2])
+            elif len(message) > 0 and message[0] == 'metric':
+                accountUpdate(message[1], message[2])
+            elif len(message) > 0:
+                self.pool.finishTask(message[1], message[2], message[3])
+            if time.time() - last_check_time >= CHECK_INTERVAL:
+                last_check_time = time.time()
+                self.pool.checkWorkers()
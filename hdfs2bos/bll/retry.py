@@ -0,0 +1,174 @@
+"""
+# @file retry.py
+# @Synopsis  retry of failed transfers and parts, errors are classified as
+# retryable or fatal, retryable ones are retried after an exponential backoff
+# with jitter through a delayed retry queue
+# @author Ming Gu(guming@itv.baidu.com))
+# @version 1.0
+# @date 2016-12-27
+"""
+import time
+import errno
+import random
+import heapq
+import httplib
+import threading
+import Queue
+import logging
+
+from baidubce.exception import BceServerError
+from baidubce.exception import BceHttpClientError
+
+from conf.env_config import EnvConfig
+from bll.checksum import ChecksumError
+
+# http status codes of BOS errors which may go away by retrying, the other
+# server errors, such as 403 and 404, are fatal
+RETRYABLE_STATUS_CODES = set([408, 429, 500, 502, 503, 504])
+# errno of local file errors which will not go away by retrying
+FATAL_ERRNOS = set([errno.ENOENT, errno.EACCES, errno.EISDIR, errno.ENOTDIR,
+    errno.EROFS])
+# seconds an item is held once more if its queue is full when it is due
+FULL_QUEUE_DELAY = 0.1
+
+general_logger = logging.getLogger(EnvConfig.GENERAL_LOG_NAME)
+
+
+def isRetryable(e, retryable_classes=()):
+    """
+    # @Synopsis  whether an error may go away by retrying. Network errors,
+    # timeouts, throttling or 5xx responses of BOS and checksum mismatches are
+    # retryable, errors of missing or inaccessible files, other BOS errors and
+    # unknown errors are fatal
+    # @Args e exception
+    # @Args retryable_classes exception classes taken as retryable besides
+    # @Returns   True if retryable
+    """
+    if getattr(e, 'retryable', None) is not None:
+        # relayed from a worker process, which classified the original error
+        return e.retryable
+    if isinstance(e, BceHttpClientError):
+        # raised by the SDK after its own retries, with the error of the last try
+        return isRetryable(e.last_error, retryable_classes)
+    if isinstance(e, BceServerError):
+        return e.status_code in RETRYABLE_STATUS_CODES
+    if isinstance(e, EnvironmentError):
+        # socket errors included
+        return e.errno not in FATAL_ERRNOS
+    return isinstance(e, (httplib.HTTPException, ChecksumError) + tuple(retryable_classes))
+
+
+def getRetryDelay(retry_cnt, base_delay=EnvConfig.RETRY_BASE_DELAY,
+        max_delay=EnvConfig.RETRY_MAX_DELAY):
+    """
+    # @Synopsis  delay before a retry, exponential backoff with full jitter, so
+    # that transfers failed together are not retried together
+    # @Args retry_cnt number of the retry, starting from 1
+    # @Args base_delay seconds
+    # @Args max_delay seconds
+    # @Returns   seconds
+    """
+    return random.uniform(0, min(max_delay, base_delay * 2 ** (retry_cnt - 1)))
+
+
+class RetryQueue(threading.Thread):
+    """
+    # @Synopsis  delayed retry queue, a failed item is held until its delay
+    # expires, then put back to the queue it was taken from, so that the
+    # threads taking from that queue go on with other items meanwhile. The
+    # retry thread never blocks on a bounded queue, whose consumers may be
+    # waiting for the retry thread themselves, an item due while its queue is
+    # full is held FULL_QUEUE_DELAY seconds more
+    """
+    def __init__(self):
+        threading.Thread.__init__(self)
+        self.delayed_items = []
+        self.condition = threading.Condition()
+        self.put_cnt = 0
+
+    def put(self, target_queue, item, delay):
+        """
+        # @Synopsis  put an item to be retried
+        # @Args target_queue queue to put the item back to
+        # @Args item
+        # @Args delay seconds to hold the item
+        # @Returns   None
+        """
+        self.condition.acquire()
+        try:
+            # put_cnt keeps items of the same due time in order and avoids
+            # comparing the items
+            heapq.heappush(self.delayed_items, (time.time() + delay, self.put_cnt,
+                target_queue, item))
+            self.put_cnt += 1
+            self.condition.notify()
+        finally:
+            self.condition.release()
+
+    def qsize(self):
+        """
+        # @Synopsis  number of items held
+        # @Returns   number
+        """
+        self.condition.acquire()
+        try:
+            return len(self.delayed_items)
+        finally:
+            self.condition.release()
+
+    def run(self):
+        """
+        # @Synopsis  run thread
+        # @Returns   None
+        """
+        while True:
+            self.condition.acquire()
+            try:
+                while True:
+                    if len(self.delayed_items) == 0:
+                        self.condition.wait()
+                        continue
+                    wait_seconds = self.delayed_items[0][0] - time.time()
+                    if wait_seconds <= 0:
+                        break
+                    self.condition.wait(wait_seconds)
+                due_time, put_cnt, target_queue, item = heapq.heappop(self.delayed_items)
+            finally:
+                self.condition.release()
+            try:
+                target_queue.put_nowait(item)
+            except Queue.Full:
+                self.put(target_queue, item, FULL_QUEUE_DELAY)
+
+
+shared_lock = threading.Lock()
+shared_retry_queue = None
+
+
+def getRetryQueue():
+    """
+    # @Synopsis  retry queue shared by all threads, started on first call
+    # @Returns   RetryQueue
+    """
+    global shared_retry_queue
+    shared_lock.acquire()
+    try:
+        if shared_retry_queue is None:
+            shared_retry_queue = RetryQueue()
+            shared_retry_queue.daemon = True
+            shared_retry_queue.start()
+        return shared_retry_queue
+    finally:
+        shared_lock.release()
+
+
+def reinitRetryQueue():
+    """
+    # @Synopsis  forget the retry queue in a forked process, whose thread is
+    # not inherited, a new one is started on the next call of getRetryQueue
+    # @Returns   None
+    """
+    global shared_lock
+    global shared_retry_queue
+    shared_lock = threading.Lock()
+    shared_retry_queue = None
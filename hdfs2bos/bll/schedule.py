@@ -0,0 +1,193 @@
+"""
+# @file schedule.py
+# @Synopsis  size aware scheduling of transfers, files are taken largest first
+# with small files as filler, and the parts of large files are shared by idle
+# workers
+# @author Ming Gu(guming@itv.baidu.com))
+# @version 1.0
+# @date 2017-01-02
+"""
+import bisect
+import threading
+import Queue
+
+
+class NotifyingQueue(Queue.Queue):
+    """
+    # @Synopsis  queue which wakes the idle workers of getOrHelp on each put,
+    # the queues of transfers, parts and ranges are all of this class
+    """
+    def put(self, item, block=True, timeout=None):
+        """
+        # @Synopsis  put an item and wake the idle workers
+        # @Args item
+        # @Args block
+        # @Args timeout
+        # @Returns   None
+        """
+        Queue.Queue.put(self, item, block, timeout)
+        split_tasks.notify()
+
+
+class SizeQueue(NotifyingQueue):
+    """
+    # @Synopsis  queue of transfers ordered by size. Gets alternate between
+    # the largest transfer, so that large files start early instead of landing
+    # last, and the smallest one as filler. Transfers of the same size are
+    # taken from the large end in queue order. None, which stops a worker, is
+    # got only once no transfer is left
+    """
+    def __init__(self, get_size, maxsize=0):
+        self.get_size = get_size
+        NotifyingQueue.__init__(self, maxsize)
+
+    def put(self, item, block=True, timeout=None):
+        """
+        # @Synopsis  put an item, its size is taken before the queue is locked
+        # @Args item
+        # @Args block
+        # @Args timeout
+        # @Returns   None
+        """
+        size = None if item is None else self.get_size(item)
+        NotifyingQueue.put(self, (size, item), block, timeout)
+
+    def _init(self, maxsize):
+        self.keys = []
+        self.items = []
+        self.stop_cnt = 0
+        self.put_cnt = 0
+        self.filler_turn = False
+
+    def _qsize(self, len=len):
+        return len(self.items) + self.stop_cnt
+
+    def _put(self, sized_item):
+        size, item = sized_item
+        if item is None:
+            self.stop_cnt += 1
+            return
+        key = (size, -self.put_cnt)
+        self.put_cnt += 1
+        index = bisect.bisect(self.keys, key)
+        self.keys.insert(index, key)
+        self.items.insert(index, item)
+
+    def _get(self):
+        if len(self.items) == 0:
+            self.stop_cnt -= 1
+            return None
+        index = 0 if self.filler_turn else -1
+        self.filler_turn = not self.filler_turn
+        self.keys.pop(index)
+        return self.items.pop(index)
+
+
+class SplitTasks(object):
+    """
+    # @Synopsis  registry of files being transferred by parts or ranges. Each
+    # file registers a helper function, which transfers one of its remaining
+    # parts in the calling thread and returns whether there was one, so that
+    # idle workers can share the parts of a large file instead of waiting for
+    # it. The generation counts the registrations and the puts to the
+    # notifying queues, idle workers wait for it to change
+    """
+    def __init__(self):
+        self.helpers = []
+        self.generation = 0
+        self.lock = threading.Condition()
+
+    def register(self, helper):
+        """
+        # @Synopsis  register the helper of a file and wake the idle workers
+        # @Args helper
+        # @Returns   None
+        """
+        self.lock.acquire()
+        try:
+            self.helpers.append(helper)
+            self.generation += 1
+            self.lock.notify_all()
+        finally:
+            self.lock.release()
+
+    def unregister(self, helper):
+        """
+        # @Synopsis  unregister the helper of a file once all its parts are taken
+        # @Args helper
+        # @Returns   None
+        """
+        self.lock.acquire()
+        try:
+            self.helpers.remove(helper)
+        finally:
+            self.lock.release()
+
+    def help(self):
+        """
+        # @Synopsis  transfer a part of the earliest registered file which has
+        # parts left
+        # @Returns   True if a part was transferred
+        """
+        self.lock.acquire()
+        helpers = list(self.helpers)
+        self.lock.release()
+        for helper in helpers:
+            if helper():
+                return True
+        return False
+
+    def notify(self):
+        """
+        # @Synopsis  wake the idle workers, there may be new work for them
+        # @Returns   None
+        """
+        self.lock.acquire()
+        try:
+            self.generation += 1
+            self.lock.notify_all()
+        finally:
+            self.lock.release()
+
+    def reinit(self):
+        """
+        # @Synopsis  forget the helpers in a forked process, whose threads are
+        # not inherited, and replace the lock
+        # @Returns   None
+        """
+        self.helpers = []
+        self.lock = threading.Condition()
+
+    def wait(self, generation):
+        """
+        # @Synopsis  block until the generation changes
+        # @Args generation generation read before the last look for work
+        # @Returns   None
+        """
+        self.lock.acquire()
+        try:
+            while self.generation == generation:
+                self.lock.wait()
+        finally:
+            self.lock.release()
+
+split_tasks = SplitTasks()
+
+
+def getOrHelp(queue):
+    """
+    # @Synopsis  take an item from a notifying queue, the parts of split files
+    # are transferred while the queue is empty. Without either the worker
+    # blocks until a put or a registration, the generation is read before
+    # looking so that none is missed
+    # @Args queue
+    # @Returns   queue item
+    """
+    while True:
+        generation = split_tasks.generation
+        try:
+            return queue.get_nowait()
+        except Queue.Empty:
+            pass
+        if not split_tasks.help():
+            split_tasks.wait(generation)
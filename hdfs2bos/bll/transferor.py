@@ -6,130 +6,744 @@
 # @date 2016-11-23
 """
 import os
+import time
 import shutil
+import hashlib
 import logging
 import threading
 import Queue
-import time
+import collections
 from datetime import datetime
 
 from conf.env_config import EnvConfig
 from dao.hdfs import HDFSClient
 from dao.hdfs import HDFSError
-from baidubce.bce_client_configuration import BceClientConfiguration
-from baidubce.auth.bce_credentials import BceCredentials
-from baidubce.services.bos.bos_client import BosClient
+from dao.webhdfs import WebHDFSClient
+from dao.journal import TransferJournal
+from bll.multipart_upload import MultipartUploader
+from bll.pack import PackUploader
+from bll.pack import ConcatStream
+from bll.pack import groupPacks
+from bll.concurrency_controller import ConcurrencyController
+from bll.retry import isRetryable
+from bll.retry import getRetryDelay
+from bll.retry import getRetryQueue
+from bll.compress import CompressStream
+from bll.compress import checkCodec
+from bll.checksum import SizeCheckReader
+from bll.metrics import Gauge
+from bll.metrics import registry
+from bll.metrics import recordStage
+from bll.metrics import recordRetry
+from bll.metrics import queue_depth
+from bll.metrics import startExporters
+from bll.metrics import stopExporters
+from bll.schedule import SizeQueue
+from bll.schedule import getOrHelp
+from bll.process_pool import ProcessPool
+from dao.bos import getBosClient
+from dao.bos import getConnectionPool
 
 general_logger = logging.getLogger(EnvConfig.GENERAL_LOG_NAME)
 success_logger = logging.getLogger(EnvConfig.SUCCESS_LOG_NAME)
 failure_logger = logging.getLogger(EnvConfig.FAILURE_LOG_NAME)
 
+# transfer of a single file, from source hdfs file to destination bos path via
+# local cache path. For small files packed into one pack, hdfs_path and
+# bos_path are the pack key, and members are tuples of hdfs_path, bos_path and
+# size of the files, empty for a single file. pair_index is the index of the
+# src dst pair the file is listed from
+TransferInfo = collections.namedtuple('TransferInfo',
+        ['hdfs_path', 'local_path', 'bos_path', 'size', 'members', 'pair_index'])
+
+cache_bytes = registry.register(Gauge('transfer_cache_bytes',
+    'bytes reserved in local cache'))
+
+def initHDFSClient():
+    """
+    # @Synopsis  initiate hdfs client of the configured backend
+    # @Returns   HDFSClient or WebHDFSClient
+    """
+    if EnvConfig.HDFS_BACKEND == 'webhdfs':
+        return WebHDFSClient(EnvConfig.WEBHDFS_HOST, EnvConfig.WEBHDFS_PORT,
+                EnvConfig.WEBHDFS_USER, EnvConfig.HDFS_LOG_NAME)
+    return HDFSClient(EnvConfig.HADOOP_CLIENT_PATH, EnvConfig.HDFS_LOG_NAME)
+
+
+class PairProgress(object):
+    """
+    # @Synopsis  progress of a src dst pair among the pairs of a transfer,
+    # accessed under the lock of the transferor
+    """
+    def __init__(self, hdfs_path, bos_path):
+        self.hdfs_path = hdfs_path
+        self.bos_path = bos_path
+        self.file_cnt = 0
+        self.total_size = 0
+        self.processed_cnt = 0
+        self.failure_cnt = 0
+        self.listing_finished = False
+        self.listing_failed = False
+
+    def isFinished(self):
+        """
+        # @Synopsis  whether the pair is listed and all its files are processed
+        # @Returns   bool
+        """
+        return self.listing_finished and self.processed_cnt == self.file_cnt
+
+
 class Transferor(object):
     """
     # @Synopsis  transfer controller
     """
-    def __init__(self, bucket_name):
+    def __init__(self, bucket_name, stream_mode=False, resume=False, pack_mode=False,
+            compress=None):
         self.bucket_name = bucket_name
-        self.transfer_info_list = []
+        self.stream_mode = stream_mode
+        self.resume = resume
+        self.pack_mode = pack_mode
+        self.compress = compress
+        if compress is not None:
+            checkCodec(compress)
+        self.journal = None
+        self.controller = None
+        self.process_pool = None
+        self.hdfs_client = initHDFSClient()
+        self.initBosClient()
+        self.pairs = []
         self.transfer_file_cnt = 0
+        self.listing_finished = False
         self.thread_lock = threading.Lock()
-        self.cacheQueue = Queue.Queue()
+        # notified once a file is processed
+        self.processed_condition = threading.Condition(self.thread_lock)
+        self.listQueue = Queue.Queue()
+        # hdfs paths of the files in the journal plan of a listing resumed
+        self.planned_files = set()
+        self.cacheQueue = SizeQueue(lambda x: x[1].size)
+        self.transferQueue = SizeQueue(lambda x: x[1].size, EnvConfig.PLAN_QUEUE_SIZE)
+        self.cache_budget = CacheBudget(EnvConfig.CACHE_SIZE_LIMIT)
         self.total_size = 0
+        self.processed_cnt = 0
         self.processed_size = 0
         self.failure_cnt = 0
-        self.download_completed = False
 
     def tranfer(self, hdfs_path, bos_path):
         """
-        # @Synopsis  start a recursive HDFS to BOS transfer, including one download
-        # thread and one upload thread. The data is first download to local cache
-        # directory then uploaded
+        # @Synopsis  start a recursive HDFS to BOS transfer of a single src dst
+        # pair, see transferAll
         #
         # @Args hdfs_path source hdfs path
         # @Args bos_path destination bos path
         #
         # @Returns   None
         """
-        self.transfer_info_list = self.getTransferList(hdfs_path, bos_path)
-        self.transfer_file_cnt = len(self.transfer_info_list)
-        self.total_size = sum(map(lambda x: x['size'], self.transfer_info_list))
-        general_logger.info('start to transfer {0} --> {1}, file_cnt = {2}, total_size = {3:.3f}G'\
-                .format(hdfs_path, bos_path, self.transfer_file_cnt,
-                    float(self.total_size) / 1024 / 1024 / 1024))
-        self.start_time = datetime.now()
-        download_thread = DownloadThread(self)
-        download_thread.daemon = True
-        upload_thread = UploadThread(self)
-        upload_thread.daemon = True
-        download_thread.start()
-        upload_thread.start()
-        while threading.active_count() > 1:
-            time.sleep(1)
-
-        general_logger.info(('finished transfering {} --> {}, failure_cnt = {}/{}, '
-            'see in failure log').format(hdfs_path, bos_path, self.failure_cnt,
-                self.transfer_file_cnt))
-
-    def getTransferList(self, hdfs_path, bos_path):
-        """
-        # @Synopsis  generate all transfer info list, and initialize local
-        # cache directory structure to match the hdfs structure
+        self.transferAll([(hdfs_path, bos_path)])
+
+    def transferAll(self, src_dst_list):
+        """
+        # @Synopsis  start a recursive HDFS to BOS transfer of src dst pairs as
+        # a single plan, including list threads, download threads and upload
+        # threads shared by all pairs. The data is first download to local cache
+        # directory then uploaded, downloading is blocked while the cached
+        # bytes would exceed the cache size limit. In stream mode, the data is
+        # instead streamed from hdfs to BOS by stream threads without local cache.
+        # The pairs are listed concurrently and files are queued for transfer
+        # while hdfs is still being listed, the listing is blocked while the
+        # queue is full. Queued files are taken largest first with small files
+        # as filler, and idle upload or stream threads help with the parts of
+        # large files. In pack mode, small files of each pair are packed and
+        # each pack is transferred as a single file. If compress is set, files
+        # other than packs are compressed while uploaded.
+        # A file failed by a retryable error is retried after a backoff delay.
+        # Every transferred file is recorded in a checkpoint journal, when
+        # resuming, the transfer list is loaded from the journal of the previous
+        # run instead of listing hdfs again, and the files already transferred
+        # are skipped. If the previous run stopped before its listing was
+        # complete, the files of the partial plan are queued and the pairs are
+        # listed again for the files not planned yet, the local cache is kept.
+        # The progress and failures are accounted for each pair.
+        # With process_num set, the files are uploaded or streamed by a pool of
+        # worker processes, the upload or stream threads hand them to the
+        # workers and keep the retries, journal and progress
         #
-        # @Args hdfs_path
-        # @Args bos_path
+        # @Args src_dst_list list of tuples of source hdfs path and destination
+        # bos path
         #
-        # @Returns   transfer info list, each element contains the
-        # infomation of the transfer of a single file, including source
-        # hdfs file, local cache path, destination bos path and file size
-        """
-        hdfs_client = HDFSClient(EnvConfig.HADOOP_CLIENT_PATH, EnvConfig.HDFS_LOG_NAME)
-        hdfs_objects = hdfs_client.lsr(hdfs_path)
-        hdfs_files = filter(lambda x: x['type'] == 'f', hdfs_objects)
-        hdfs_file_paths = map(lambda x: x['path'], hdfs_files)
+        # @Returns   None
+        """
+        if EnvConfig.PROCESS_NUM > 0:
+            # forked before the journal is loaded and before any thread of the
+            # transfer, such as the list threads, is started
+            self.process_pool = ProcessPool(EnvConfig.PROCESS_NUM,
+                    EnvConfig.STREAM_THREAD_NUM if self.stream_mode
+                    else EnvConfig.UPLOAD_THREAD_NUM, self, self.initWorker)
+            self.process_pool.start()
+        self.pairs = map(lambda x: PairProgress(x[0], x[1]), src_dst_list)
+        pairs_name = self.getPairsName()
+        self.journal = TransferJournal(self.getJournalPath(src_dst_list),
+                EnvConfig.GENERAL_LOG_NAME)
+        transfer_plan = None
+        done_files = set()
+        plan_completed = False
+        if self.resume:
+            transfer_plan, done_files, plan_completed = self.journal.load()
+            if transfer_plan is None:
+                general_logger.warning('No journal to resume {}, start over'.format(
+                    pairs_name))
+        if transfer_plan is None:
+            self.initCache()
+            self.journal.begin()
+        elif plan_completed:
+            self.journal.resume()
+            general_logger.info('resume {} from journal, skip {}/{} transferred files'\
+                    .format(pairs_name, len(done_files), len(transfer_plan)))
+        else:
+            self.journal.resume()
+            general_logger.warning(('Listing of {} in journal is not complete, list again '
+                'for the files not planned, skip {}/{} transferred files').format(
+                    pairs_name, len(done_files), len(transfer_plan)))
+        general_logger.info('start to transfer {0}'.format(pairs_name))
+        self.start_time = datetime.now()
+        queue_depth.set(self.transferQueue.qsize, ('transfer',))
+        queue_depth.set(self.cacheQueue.qsize, ('cache',))
+        queue_depth.set(getRetryQueue().qsize, ('retry',))
+        cache_bytes.set(lambda: self.cache_budget.cached_size)
+        startExporters()
+        if self.stream_mode:
+            self.controller = ConcurrencyController('stream', EnvConfig.STREAM_THREAD_NUM)
+            stream_threads = self.startThreads(StreamThread, EnvConfig.STREAM_THREAD_NUM)
+            self.feedTransfers(transfer_plan, done_files, plan_completed)
+            self.waitProcessed()
+            # all files are processed, one None for each stream thread to stop it
+            for stream_thread in stream_threads:
+                self.transferQueue.put(None)
+            self.joinThreads(stream_threads)
+        else:
+            self.controller = ConcurrencyController('upload', EnvConfig.UPLOAD_THREAD_NUM)
+            download_threads = self.startThreads(DownloadThread,
+                    EnvConfig.DOWNLOAD_THREAD_NUM)
+            upload_threads = self.startThreads(UploadThread, EnvConfig.UPLOAD_THREAD_NUM)
+            self.feedTransfers(transfer_plan, done_files, plan_completed)
+            self.waitProcessed()
+            # all files are processed, one None for each thread to stop it
+            for download_thread in download_threads:
+                self.transferQueue.put(None)
+            self.joinThreads(download_threads)
+            for upload_thread in upload_threads:
+                self.cacheQueue.put(None)
+            self.joinThreads(upload_threads)
+        if self.process_pool is not None:
+            self.process_pool.stop()
+            self.process_pool.logStats()
+            self.process_pool = None
+        self.journal.close()
+        if getConnectionPool() is not None:
+            getConnectionPool().logStats()
+        stopExporters()
+
+        if len(self.pairs) > 1:
+            failed_pairs = filter(lambda x: x.listing_failed or x.failure_cnt > 0, self.pairs)
+            general_logger.info(('finished transfering {}, failed_pair_cnt = {}/{}, '
+                'failure_cnt = {}/{}, see in failure log').format(pairs_name,
+                    len(failed_pairs), len(self.pairs), self.failure_cnt,
+                    self.transfer_file_cnt))
+
+    def feedTransfers(self, transfer_plan, done_files, plan_completed):
+        """
+        # @Synopsis  queue files for the transfer threads. The files of the plan
+        # loaded from the journal are queued unless transferred already. If
+        # there is no plan or it is not complete, the pairs are listed by list
+        # threads and the files not planned are queued as they are listed and
+        # appended to the journal plan, the plan is ended only if all pairs are
+        # listed
+        # @Args transfer_plan plan loaded from the journal, None if hdfs is to be
+        # listed
+        # @Args done_files set of files already transferred in the plan
+        # @Args plan_completed whether the plan loaded is complete
+        # @Returns   None
+        """
+        if transfer_plan is not None:
+            list_start_time = time.time()
+            for fields in transfer_plan:
+                transfer = self.loadTransferInfo(fields)
+                if not plan_completed:
+                    self.planned_files.update(map(lambda x: x[0], transfer.members)
+                            if len(transfer.members) > 0 else [transfer.hdfs_path])
+                if fields[0] not in done_files:
+                    self.queueTransfer(transfer)
+            recordStage('list', list_start_time, self.total_size,
+                    file_cnt=self.transfer_file_cnt)
+        if transfer_plan is None or not plan_completed:
+            list_threads = self.startThreads(ListThread,
+                    min(EnvConfig.LIST_THREAD_NUM, len(self.pairs)))
+            for pair_index in range(len(self.pairs)):
+                self.listQueue.put(pair_index)
+            # one None for each list thread to stop it
+            for list_thread in list_threads:
+                self.listQueue.put(None)
+            self.joinThreads(list_threads)
+            if not any(map(lambda x: x.listing_failed, self.pairs)):
+                self.journal.endPlan()
+        else:
+            for pair_index in range(len(self.pairs)):
+                self.finishListing(pair_index)
+        self.thread_lock.acquire()
+        self.listing_finished = True
+        self.thread_lock.release()
+
+    def listPair(self, pair_index):
+        """
+        # @Synopsis  list a pair and queue its files as they are listed, the
+        # files are appended to the journal plan. Files planned already by the
+        # journal of a listing resumed are skipped
+        # @Args pair_index
+        # @Returns   None
+        """
+        pair = self.pairs[pair_index]
+        list_start_time = time.time()
+        list_file_cnt = 0
+        list_size = 0
+        listed = False
+        try:
+            transfer_infos = self.getTransferList(pair.hdfs_path, pair.bos_path, pair_index)
+            if len(self.planned_files) > 0:
+                transfer_infos = (x for x in transfer_infos
+                        if x.hdfs_path not in self.planned_files)
+            if self.pack_mode:
+                transfer_infos = self.groupTransferList(pair.bos_path, transfer_infos,
+                        pair_index)
+            for transfer in transfer_infos:
+                self.journal.plan(list(transfer[:4]) + [transfer.pair_index] +
+                        sum(map(list, transfer.members), []))
+                self.queueTransfer(transfer)
+                list_file_cnt += 1
+                list_size += transfer.size
+            recordStage('list', list_start_time, list_size, file_cnt=list_file_cnt)
+            listed = True
+        except Exception as e:
+            # besides HDFSError, such as OSError of a bad hadoop client path or
+            # ValueError of a malformed webhdfs response
+            recordStage('list', list_start_time, succeeded=False)
+            general_logger.error('failed to list {}, message: {}'.format(pair.hdfs_path,
+                e.message))
+            failure_logger.debug('{} --> {} on stage List, message: {}'.format(
+                pair.hdfs_path, pair.bos_path, e.message))
+        finally:
+            # the plan is not ended unless every pair is listed to the end
+            if not listed:
+                self.thread_lock.acquire()
+                pair.listing_failed = True
+                self.thread_lock.release()
+            self.finishListing(pair_index)
+
+    def queueTransfer(self, transfer):
+        """
+        # @Synopsis  account a file to its pair and queue it for the transfer
+        # threads, thread safe
+        # @Args transfer
+        # @Returns   None
+        """
+        pair = self.pairs[transfer.pair_index]
+        self.thread_lock.acquire()
+        index = self.transfer_file_cnt
+        self.transfer_file_cnt += 1
+        self.total_size += transfer.size
+        pair.file_cnt += 1
+        pair.total_size += transfer.size
+        self.thread_lock.release()
+        # the last item is the retry count of the transfer
+        self.transferQueue.put((index, transfer, 0))
+
+    def finishListing(self, pair_index):
+        """
+        # @Synopsis  mark a pair as listed, thread safe
+        # @Args pair_index
+        # @Returns   None
+        """
+        pair = self.pairs[pair_index]
+        self.thread_lock.acquire()
+        pair.listing_finished = True
+        finished = pair.isFinished()
+        self.thread_lock.release()
+        if not pair.listing_failed:
+            general_logger.info('listed {0}, file_cnt = {1}, total_size = {2:.3f}G'.format(
+                pair.hdfs_path, pair.file_cnt, float(pair.total_size) / 1024 / 1024 / 1024))
+        if finished:
+            self.logPairFinished(pair)
+
+    def logPairFinished(self, pair):
+        """
+        # @Synopsis  log the result of a pair once all its files are processed
+        # @Args pair PairProgress
+        # @Returns   None
+        """
+        general_logger.info(('finished transfering {} --> {}, failure_cnt = {}/{}{}, '
+            'see in failure log').format(pair.hdfs_path, pair.bos_path, pair.failure_cnt,
+                pair.file_cnt, ', failed to list' if pair.listing_failed else ''))
+
+    def getPairsName(self):
+        """
+        # @Synopsis  name of the pairs of the transfer in log
+        # @Returns   "hdfs_path --> bos_path" of a single pair, or the number of
+        # pairs
+        """
+        if len(self.pairs) == 1:
+            return '{} --> {}'.format(self.pairs[0].hdfs_path, self.pairs[0].bos_path)
+        return '{} pairs'.format(len(self.pairs))
+
+    def loadTransferInfo(self, fields):
+        """
+        # @Synopsis  TransferInfo of a journal plan record. A journal written
+        # before pairs were recorded has no pair index, it is of a single pair
+        # @Args fields field list of the plan record
+        # @Returns   TransferInfo
+        """
+        if (len(fields) - 4) % 3 == 0:
+            pair_index, member_start = 0, 4
+        else:
+            pair_index, member_start = int(fields[4]), 5
+        return TransferInfo(fields[0], fields[1], fields[2], int(fields[3]),
+                tuple((fields[i], fields[i + 1], int(fields[i + 2]))
+                    for i in range(member_start, len(fields), 3)), pair_index)
+
+    def waitProcessed(self):
+        """
+        # @Synopsis  wait for all queued files to be processed, files being
+        # retried are put back to the queues later, so the threads are stopped
+        # only after that
+        # @Returns   None
+        """
+        self.processed_condition.acquire()
+        while self.processed_cnt < self.transfer_file_cnt:
+            self.processed_condition.wait()
+        self.processed_condition.release()
+
+    def retryTransfer(self, queue, queue_top, stage, e):
+        """
+        # @Synopsis  put a failed file to the retry queue if the error is
+        # retryable and the file has retries left
+        # @Args queue queue to put the file back to
+        # @Args queue_top item of the file taken from the queue
+        # @Args stage Download, Upload or Stream
+        # @Args e exception
+        # @Returns   True if the file is to be retried
+        """
+        index, transfer, retry_cnt = queue_top
+        if not isRetryable(e) or retry_cnt >= EnvConfig.RETRY_CNT:
+            return False
+        delay = getRetryDelay(retry_cnt + 1)
+        recordRetry(stage.lower(), delay)
+        general_logger.warning(('failed to {} {}/{}: {} --> {}, retry {}/{} in {:.1f}s, '
+            'message: {}').format(stage.lower(), index + 1, self.transfer_file_cnt,
+                transfer.hdfs_path, transfer.bos_path, retry_cnt + 1, EnvConfig.RETRY_CNT,
+                delay, e.message))
+        getRetryQueue().put(queue, (index, transfer, retry_cnt + 1), delay)
+        return True
+
+    def getJournalPath(self, src_dst_list):
+        """
+        # @Synopsis  path of the checkpoint journal of a transfer
+        # @Args src_dst_list list of tuples of hdfs_path and bos_path
+        # @Returns   journal path
+        """
+        journal_key = '\t'.join([self.bucket_name] + sum(map(list, src_dst_list), []))
+        journal_name = hashlib.md5(journal_key).hexdigest() + '.journal'
+        return os.path.join(EnvConfig.LOCAL_DATA_PATH, 'journal', journal_name)
+
+    def initBosClient(self):
+        """
+        # @Synopsis  initiate BOS client, the client and its connection pool are
+        # shared by all threads
+        # @Returns   None
+        """
+        self.bos_client = getBosClient()
+        self.multipart_uploader = MultipartUploader(self.bos_client, self.bucket_name)
+        self.pack_uploader = PackUploader(self.multipart_uploader)
+
+    def initWorker(self):
+        """
+        # @Synopsis  drop the webhdfs connections in a forked worker process,
+        # they are shared with the coordinator
+        # @Returns   None
+        """
+        if isinstance(self.hdfs_client, WebHDFSClient):
+            self.hdfs_client.connection_pool.reinit()
+
+    def runTask(self, name, transfer):
+        """
+        # @Synopsis  upload or stream a file by a worker process if there is a
+        # process pool, otherwise in the calling thread
+        # @Args name uploadCache or streamFile
+        # @Args transfer
+        # @Returns   md5 of the file, None if not known
+        """
+        if self.process_pool is not None:
+            return self.process_pool.call(name, transfer)
+        return getattr(self, name)(transfer)
+
+    def uploadCache(self, transfer):
+        """
+        # @Synopsis  upload a file or a pack from local cache to BOS, large files
+        # are uploaded by parts, files other than packs are compressed if
+        # compress is set
+        # @Args transfer
+        # @Returns   md5 of the file, None if not known
+        """
+        if len(transfer.members) > 0:
+            pack_size, md5 = self.pack_uploader.uploadFile(transfer.local_path,
+                    transfer.bos_path, map(lambda x: (x[1], x[2]), transfer.members))
+        elif self.compress is not None:
+            local_file = open(transfer.local_path, 'rb')
+            try:
+                size, md5 = self.uploadCompressed(local_file, transfer)
+            finally:
+                local_file.close()
+        else:
+            md5 = self.multipart_uploader.uploadFile(transfer.local_path,
+                    transfer.bos_path)
+        return md5
+
+    def streamFile(self, transfer):
+        """
+        # @Synopsis  stream a file or a pack from hdfs to BOS, files other than
+        # packs are compressed if compress is set
+        # @Args transfer
+        # @Returns   md5 of the file
+        """
+        if len(transfer.members) > 0:
+            stream = self.catPack(transfer)
+        else:
+            stream = self.hdfs_client.cat(transfer.hdfs_path)
+        # the size is checked at the end of the stream, before the object is
+        # committed
+        stream = SizeCheckReader(stream, transfer.size, transfer.hdfs_path)
+        try:
+            if len(transfer.members) > 0:
+                stream_size, md5 = self.pack_uploader.uploadStream(stream,
+                        transfer.bos_path, map(lambda x: (x[1], x[2]),
+                            transfer.members))
+            elif self.compress is not None:
+                stream_size, md5 = self.uploadCompressed(stream, transfer)
+            else:
+                stream_size, md5 = self.multipart_uploader.uploadStream(stream,
+                        transfer.bos_path, transfer.hdfs_path)
+        finally:
+            stream.close()
+        return md5
+
+    def uploadCompressed(self, stream, transfer):
+        """
+        # @Synopsis  compress a stream by the codec of the transferor while
+        # uploading it, the object is tagged with the codec and the raw size
+        # @Args stream file like object of the file
+        # @Args transfer
+        # @Returns   tuple of size of the file and md5 of the compressed data
+        """
+        compress_stream = CompressStream(stream, self.compress)
+        size, md5 = self.multipart_uploader.uploadStream(compress_stream, transfer.bos_path,
+                transfer.hdfs_path, compress_stream.getUserMetadata)
+        general_logger.debug('compressed {} by {}: {} --> {} bytes'.format(transfer.hdfs_path,
+            self.compress, compress_stream.raw_size, size))
+        return compress_stream.raw_size, md5
+
+    def startThreads(self, thread_class, thread_num):
+        """
+        # @Synopsis  start transfer threads
+        # @Args thread_class class of the threads, ListThread, DownloadThread,
+        # UploadThread or StreamThread
+        # @Args thread_num
+        # @Returns   list of started threads
+        """
+        threads = []
+        for i in range(thread_num):
+            thread = thread_class(self)
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        return threads
+
+    def joinThreads(self, threads):
+        """
+        # @Synopsis  wait for threads to finish
+        # @Args threads
+        # @Returns   None
+        """
+        for thread in threads:
+            thread.join()
+
+    def reportProgress(self, transfer, succeeded):
+        """
+        # @Synopsis  account a processed file to the transfer and its pair and
+        # log the progress, thread safe
+        # @Args transfer
+        # @Args succeeded whether the file was transferred successfully
+        # @Returns   None
+        """
+        cur_time = datetime.now()
+        time_elapsed = cur_time - self.start_time
+        hour_elapsed = float(time_elapsed.total_seconds()) / 3600
+        pair = self.pairs[transfer.pair_index]
+        self.processed_condition.acquire()
+        self.processed_cnt += 1
+        self.processed_size += transfer.size
+        pair.processed_cnt += 1
+        if not succeeded:
+            self.failure_cnt += 1
+            pair.failure_cnt += 1
+        processed_cnt = self.processed_cnt
+        processed_size = self.processed_size
+        total_size = self.total_size
+        transfer_file_cnt = self.transfer_file_cnt
+        listing_finished = self.listing_finished
+        pair_finished = pair.isFinished()
+        self.processed_condition.notify_all()
+        self.processed_condition.release()
+        estimate_remain_hours = float(total_size -
+                processed_size) / max(processed_size, 1) * hour_elapsed
+
+        # the totals keep growing until hdfs is listed, so is the estimate
+        general_logger.info(('processed file_cnt {}/{}={:.1f}%, '
+            'file_size {}/{}={:.1f}%, elapsed {:.2f} hours, '
+            'estimate to finish in {:.2f} hours{}')\
+                    .format(processed_cnt, transfer_file_cnt,
+                float(processed_cnt) / transfer_file_cnt * 100,
+                processed_size, total_size,
+                float(processed_size) / max(total_size, 1) * 100,
+                hour_elapsed, estimate_remain_hours,
+                '' if listing_finished else ' at least, still listing'))
+        if pair_finished:
+            self.logPairFinished(pair)
+
+    def initCache(self):
+        """
+        # @Synopsis  initialize local cache directory if not in stream mode,
+        # the cache left by a previous run is removed
+        # @Returns   None
+        """
+        if self.stream_mode:
+            return
         cache_base_path = os.path.join(EnvConfig.LOCAL_DATA_PATH, 'cache')
-        def cache_path_mapper(hdfs_path):
-            """
-            # @Synopsis  map source hdfs to corresponding dst bos path
-            # @Args hdfs_path
-            # @Returns   dst bos path
-            """
-            return os.path.join(cache_base_path, hdfs_path.strip('/'))
-        local_cache_paths = map(cache_path_mapper, hdfs_file_paths)
-
-        # initiate local cache path structure
         try:
             shutil.rmtree(cache_base_path)
         except OSError as e:
             pass
         os.mkdir(cache_base_path)
-        hdfs_dirs = filter(lambda x: x['type'] == 'd', hdfs_objects)
-        hdfs_dir_paths = map(lambda x: x['path'], hdfs_dirs)
-        local_dir_paths = map(cache_path_mapper, hdfs_dir_paths)
-        local_dir_paths += map(cache_path_mapper, [hdfs_path])
-        for dir_path in local_dir_paths:
-            try:
-                os.makedirs(dir_path)
-            except OSError as e:
-                print e.message
-
-        relative_paths = map(lambda x: os.path.relpath(x, hdfs_path), hdfs_file_paths)
-        bos_paths = map(lambda x: os.path.join(bos_path, x), relative_paths)
-        size_list = map(lambda x: x['size'], hdfs_files)
-        transfer_info_list = zip(hdfs_file_paths, local_cache_paths, bos_paths, size_list)
-        def info_mapper(x):
-            """
-            # @Synopsis  map tuple info dict
-            # @Args x
-            # @Returns   info dict
-            """
-            return dict({
-                'hdfs_path': x[0],
-                'local_path': x[1],
-                'bos_path': x[2],
-                'size': x[3]
-                })
-        transfer_info_list = map(info_mapper, transfer_info_list)
-        return transfer_info_list
+
+    def getTransferList(self, hdfs_path, bos_path, pair_index):
+        """
+        # @Synopsis  generate transfer infos lazily from the hdfs listing. Each
+        # pair is cached in its own directory of local cache, the cache
+        # directory of each file is created when it is downloaded
+        #
+        # @Args hdfs_path
+        # @Args bos_path
+        # @Args pair_index
+        #
+        # @Returns   generator of TransferInfo, each contains the infomation of
+        # the transfer of a single file, including source hdfs file, local
+        # cache path, destination bos path and file size
+        """
+        cache_pair_path = os.path.join(EnvConfig.LOCAL_DATA_PATH, 'cache', str(pair_index))
+        hdfs_objects = self.hdfs_client.lsr(hdfs_path)
+        for hdfs_object in hdfs_objects:
+            if hdfs_object.type != 'f':
+                continue
+            local_path = os.path.join(cache_pair_path, hdfs_object.path.strip('/'))
+            relative_path = os.path.relpath(hdfs_object.path, hdfs_path)
+            yield TransferInfo(hdfs_object.path, local_path,
+                    os.path.join(bos_path, relative_path), hdfs_object.size, (), pair_index)
+
+    def groupTransferList(self, bos_path, transfer_infos, pair_index):
+        """
+        # @Synopsis  group small files into packs, a pack is cached as a single
+        # file in the pack directory of the local cache of its pair
+        # @Args bos_path destination bos path
+        # @Args transfer_infos iterable of TransferInfo of single files
+        # @Args pair_index
+        # @Returns   generator of TransferInfo
+        """
+        cache_pair_path = os.path.join(EnvConfig.LOCAL_DATA_PATH, 'cache', str(pair_index))
+        for pack_key, transfers in groupPacks(transfer_infos, bos_path, lambda x: x.size):
+            if pack_key is None:
+                yield transfers[0]
+                continue
+            yield TransferInfo(pack_key, os.path.join(cache_pair_path, 'pack',
+                os.path.basename(pack_key)), pack_key, sum(map(lambda x: x.size, transfers)),
+                tuple(map(lambda x: (x.hdfs_path, x.bos_path, x.size), transfers)),
+                pair_index)
+
+    def catPack(self, transfer):
+        """
+        # @Synopsis  open the files of a pack as a stream of their concatenation
+        # @Args transfer TransferInfo of a pack
+        # @Returns   file like stream, the caller should close it after reading
+        """
+        hdfs_paths = map(lambda x: x[0], transfer.members)
+        if EnvConfig.HDFS_BACKEND == 'webhdfs':
+            # connections are kept alive, the files are simply read one by one
+            return ConcatStream(self.hdfs_client.cat, hdfs_paths)
+        return self.hdfs_client.catFiles(hdfs_paths)
+
+
+class CacheBudget(object):
+    """
+    # @Synopsis  byte budget of local cache, shared by download threads and
+    # upload threads
+    """
+    def __init__(self, size_limit):
+        self.size_limit = size_limit
+        self.cached_size = 0
+        self.condition = threading.Condition()
+
+    def acquire(self, size):
+        """
+        # @Synopsis  reserve cache for a file before downloading it, block while
+        # the cached bytes would exceed the limit. A file larger than the limit
+        # is admitted when nothing else is cached
+        # @Args size
+        # @Returns   None
+        """
+        self.condition.acquire()
+        while self.cached_size > 0 and self.cached_size + size > self.size_limit:
+            self.condition.wait()
+        self.cached_size += size
+        self.condition.release()
+
+    def release(self, size):
+        """
+        # @Synopsis  give back the cache reserved for a file once its cache is
+        # removed or its download failed
+        # @Args size
+        # @Returns   None
+        """
+        self.condition.acquire()
+        self.cached_size -= size
+        self.condition.notify_all()
+        self.condition.release()
+
+
+class ListThread(threading.Thread):
+    """
+    # @Synopsis  list thread, list the pairs taken from the list queue and
+    # queue their files for transfer
+    """
+    def __init__(self, transferor):
+        threading.Thread.__init__(self)
+        self.transferor = transferor
+
+    def run(self):
+        """
+        # @Synopsis  run thread
+        # @Returns   None
+        """
+        general_logger.debug('start listing thread')
+        while True:
+            pair_index = self.transferor.listQueue.get()
+            if pair_index is None:
+                break
+            self.transferor.listPair(pair_index)
+        general_logger.debug('end listing thread')
 
 
 class DownloadThread(threading.Thread):
@@ -145,60 +759,110 @@ class DownloadThread(threading.Thread):
         # @Synopsis  run thread
         # @Returns   None
         """
-        hdfs_client = HDFSClient(EnvConfig.HADOOP_CLIENT_PATH, EnvConfig.HDFS_LOG_NAME)
+        hdfs_client = self.transferor.hdfs_client
         general_logger.debug('start downloading thread')
-        for index, transfer in enumerate(self.transferor.transfer_info_list):
+        while True:
+            queue_top = self.transferor.transferQueue.get()
+            if queue_top is None:
+                break
+            index, transfer, retry_cnt = queue_top
+            start_time = time.time()
+            self.transferor.cache_budget.acquire(transfer.size)
+            recordStage('cache_wait', start_time)
+            self.prepareCachePath(transfer.local_path)
+            start_time = time.time()
             try:
-                hdfs_client.get(transfer['hdfs_path'], transfer['local_path'])
+                if len(transfer.members) > 0:
+                    self.downloadPack(transfer)
+                else:
+                    hdfs_client.get(transfer.hdfs_path, transfer.local_path)
+                recordStage('download', start_time, transfer.size)
                 general_logger.debug('succeeded to download {}/{}: {} --> {}'.format(
                     index + 1, self.transferor.transfer_file_cnt,
-                    transfer['hdfs_path'], transfer['local_path']))
+                    transfer.hdfs_path, transfer.local_path))
 
-                self.transferor.thread_lock.acquire()
-                self.transferor.cacheQueue.put(index)
-                self.transferor.thread_lock.release()
-            except HDFSError as e:
+                self.transferor.cacheQueue.put(queue_top)
+            except Exception as e:
+                recordStage('download', start_time, succeeded=False)
+                self.transferor.cache_budget.release(transfer.size)
+                if self.transferor.retryTransfer(self.transferor.transferQueue, queue_top,
+                        'Download', e):
+                    continue
                 general_logger.warning('failed to download {}/{}: {} --> {}, message: {}'.format(
                     index + 1, self.transferor.transfer_file_cnt,
-                    transfer['hdfs_path'], transfer['local_path'], e.message))
+                    transfer.hdfs_path, transfer.local_path, e.message))
                 failure_logger.debug(('{} --> {} --> {} on stage Download, '
-                    'message: {}').format(transfer['hdfs_path'], transfer['local_path'],
-                        transfer['bos_path'], e.message))
+                    'message: {}').format(transfer.hdfs_path, transfer.local_path,
+                        transfer.bos_path, e.message))
+                self.transferor.reportProgress(transfer, False)
 
-                self.transferor.thread_lock.acquire()
-                self.transferor.processed_size += transfer['size']
-                self.transferor.failure_cnt += 1
-                self.transferor.thread_lock.release()
-
-        self.transferor.download_completed = True
         general_logger.debug('end downloading thread')
 
+    def downloadPack(self, transfer):
+        """
+        # @Synopsis  download the files of a pack into a single cache file
+        # @Args transfer TransferInfo of a pack
+        # @Returns   None
+        """
+        stream = self.transferor.catPack(transfer)
+        try:
+            local_file = open(transfer.local_path, 'wb')
+            try:
+                while True:
+                    data = stream.read(1024 * 1024)
+                    if not data:
+                        break
+                    local_file.write(data)
+            finally:
+                local_file.close()
+        finally:
+            stream.close()
+        cache_size = os.path.getsize(transfer.local_path)
+        if cache_size != transfer.size:
+            raise HDFSError('size mismatch of pack {}, {} expected but {} downloaded'.format(
+                transfer.hdfs_path, transfer.size, cache_size))
+
+    def prepareCachePath(self, local_path):
+        """
+        # @Synopsis  make sure the cache directory exists and remove the cache
+        # left by a previous run, which is possible when resuming
+        # @Args local_path
+        # @Returns   None
+        """
+        try:
+            os.makedirs(os.path.dirname(local_path))
+        except OSError as e:
+            pass
+        try:
+            os.remove(local_path)
+        except OSError as e:
+            pass
+
 
 class UploadThread(threading.Thread):
     """
     # @Synopsis  upload thread, upload file from local cache to BOS, then delete
-    # local cache
+    # local cache. Large files are uploaded by parts. Each upload holds a slot
+    # of the concurrency controller. While the queue is empty, the thread helps
+    # with the parts of large files
     """
     def __init__(self, transferor):
         threading.Thread.__init__(self)
         self.transferor = transferor
-        self.bucket_name = self.transferor.bucket_name
-        self.initBosClient()
 
-    def initBosClient(self):
+    def logSuccess(self, transfer, md5):
         """
-        # @Synopsis  initiate BOS client
+        # @Synopsis  log a transferred file, or each file of a transferred pack
+        # @Args transfer
+        # @Args md5 md5 of the file or the pack, None if not known
         # @Returns   None
         """
-        bos_host = EnvConfig.BOS_HOST
-        access_key_id = EnvConfig.ACCESS_KEY_ID
-        secret_access_key = EnvConfig.SECRET_ACCEESS_KEY
-        config = BceClientConfiguration(credentials=BceCredentials(access_key_id,
-            secret_access_key), endpoint = bos_host)
-        config.connection_timeout_in_mills = EnvConfig.BOS_TIMEOUT
-        config.recv_buf_size = EnvConfig.BOS_RECV_BUF_SIZE
-        config.send_buf_size = EnvConfig.BOS_SEND_BUF_SIZE
-        self.bos_client = BosClient(config)
+        if len(transfer.members) == 0:
+            success_logger.debug('{0} --> {1}, md5 = {2}'.format(transfer.hdfs_path,
+                transfer.bos_path, md5))
+        for hdfs_path, bos_path, size in transfer.members:
+            success_logger.debug('{0} --> {1} in pack {2}, pack md5 = {3}'.format(hdfs_path,
+                bos_path, transfer.bos_path, md5))
 
     def run(self):
         """
@@ -207,59 +871,100 @@ class UploadThread(threading.Thread):
         """
         general_logger.debug("start uploading thread")
         while True:
-            self.transferor.thread_lock.acquire()
-            if not self.transferor.cacheQueue.empty():
-                queue_top_index = self.transferor.cacheQueue.get()
-                self.transferor.thread_lock.release()
-
-                transfer = self.transferor.transfer_info_list[queue_top_index]
-                try:
-                    self.bos_client.put_object_from_file(self.bucket_name,
-                            transfer['bos_path'], transfer['local_path'])
-
-                    general_logger.debug('succeeded to upload {}/{}: {} --> {}'.format(
-                        queue_top_index + 1, self.transferor.transfer_file_cnt,
-                        transfer['local_path'], transfer['bos_path']))
-                    success_logger.debug('{0} --> {1}'.format(transfer['hdfs_path'],
-                        transfer['bos_path']))
-                except Exception as e:
-                    general_logger.warning('failed to upload {}/{}: {} --> {}, message: {}'.format(
-                        queue_top_index + 1, self.transferor.transfer_file_cnt,
-                        transfer['local_path'], transfer['bos_path'], e.message))
-                    failure_logger.debug(('{} --> {} --> {} on stage Upload, '
-                        'message: {}').format(transfer['hdfs_path'], transfer['local_path'],
-                            transfer['bos_path'], e.message))
-                    self.transferor.thread_lock.acquire()
-                    self.transferor.failure_cnt += 1
-                    self.transferor.thread_lock.release()
-
-                cur_time = datetime.now()
-                time_elapsed = cur_time - self.transferor.start_time
-                hour_elapsed = float(time_elapsed.total_seconds()) / 3600
-                self.transferor.thread_lock.acquire()
-                self.transferor.processed_size += transfer['size']
-                processed_size = self.transferor.processed_size
-                self.transferor.thread_lock.release()
-                estimate_remain_hours = float(self.transferor.total_size -
-                        processed_size) / processed_size * hour_elapsed
-
-                general_logger.info(('processed file_cnt {}/{}={:.1f}%, '
-                    'file_size {}/{}={:.1f}%, elapsed {:.2f} hours, '
-                    'estimate to finish in {:.2f} hours')\
-                            .format(queue_top_index + 1, self.transferor.transfer_file_cnt,
-                        float(queue_top_index + 1) / self.transferor.transfer_file_cnt * 100,
-                        processed_size, self.transferor.total_size,
-                        float(processed_size) / self.transferor.total_size * 100,
-                        hour_elapsed, estimate_remain_hours))
-                os.remove(transfer['local_path'])
+            queue_top = getOrHelp(self.transferor.cacheQueue)
+            if queue_top is None:
+                break
 
-            else:
-                self.transferor.thread_lock.release()
-                if self.transferor.download_completed:
-                    return 0
-                else:
-                    time.sleep(1)
+            queue_top_index, transfer, retry_cnt = queue_top
+            self.transferor.controller.acquire()
+            start_time = time.time()
+            try:
+                md5 = self.transferor.runTask('uploadCache', transfer)
+                self.transferor.controller.release(transfer.size, time.time() - start_time,
+                        True)
+                recordStage('upload', start_time, transfer.size)
+
+                general_logger.debug('succeeded to upload {}/{}: {} --> {}'.format(
+                    queue_top_index + 1, self.transferor.transfer_file_cnt,
+                    transfer.local_path, transfer.bos_path))
+                self.logSuccess(transfer, md5)
+                self.transferor.journal.record(transfer.hdfs_path)
+                succeeded = True
+            except Exception as e:
+                self.transferor.controller.release(0, time.time() - start_time, False)
+                recordStage('upload', start_time, succeeded=False)
+                if self.transferor.retryTransfer(self.transferor.cacheQueue, queue_top,
+                        'Upload', e):
+                    # the cache is kept for the retry
+                    continue
+                general_logger.warning('failed to upload {}/{}: {} --> {}, message: {}'.format(
+                    queue_top_index + 1, self.transferor.transfer_file_cnt,
+                    transfer.local_path, transfer.bos_path, e.message))
+                failure_logger.debug(('{} --> {} --> {} on stage Upload, '
+                    'message: {}').format(transfer.hdfs_path, transfer.local_path,
+                        transfer.bos_path, e.message))
+                succeeded = False
+
+            # the transfer is accounted even if its cache is left behind, which
+            # is removed before the file is downloaded again
+            try:
+                os.remove(transfer.local_path)
+            except OSError as e:
+                general_logger.warning('failed to remove cache {}: {}'.format(
+                    transfer.local_path, e.strerror))
+            self.transferor.cache_budget.release(transfer.size)
+            self.transferor.reportProgress(transfer, succeeded)
         general_logger.debug("end uploading thread")
 
+
+class StreamThread(UploadThread):
+    """
+    # @Synopsis  stream thread, stream hdfs file to BOS by reading the output of
+    # hadoop fs -cat in chunks and uploading them as parts, without local cache.
+    # Each stream holds a slot of the concurrency controller. While the queue
+    # is empty, the thread helps with the parts of large files
+    """
+    def run(self):
+        """
+        # @Synopsis  run thread
+        # @Returns   None
+        """
+        general_logger.debug('start streaming thread')
+        while True:
+            queue_top = getOrHelp(self.transferor.transferQueue)
+            if queue_top is None:
+                break
+            index, transfer, retry_cnt = queue_top
+            self.transferor.controller.acquire()
+            start_time = time.time()
+            try:
+                md5 = self.transferor.runTask('streamFile', transfer)
+                self.transferor.controller.release(transfer.size, time.time() - start_time,
+                        True)
+                recordStage('stream', start_time, transfer.size)
+
+                general_logger.debug('succeeded to stream {}/{}: {} --> {}'.format(
+                    index + 1, self.transferor.transfer_file_cnt,
+                    transfer.hdfs_path, transfer.bos_path))
+                self.logSuccess(transfer, md5)
+                self.transferor.journal.record(transfer.hdfs_path)
+                succeeded = True
+            except Exception as e:
+                self.transferor.controller.release(0, time.time() - start_time, False)
+                recordStage('stream', start_time, succeeded=False)
+                if self.transferor.retryTransfer(self.transferor.transferQueue, queue_top,
+                        'Stream', e):
+                    continue
+                general_logger.warning('failed to stream {}/{}: {} --> {}, message: {}'.format(
+                    index + 1, self.transferor.transfer_file_cnt,
+                    transfer.hdfs_path, transfer.bos_path, e.message))
+                failure_logger.debug(('{} --> {} on stage Stream, '
+                    'message: {}').format(transfer.hdfs_path, transfer.bos_path,
+                        e.message))
+                succeeded = False
+
+            self.transferor.reportProgress(transfer, succeeded)
+        general_logger.debug('end streaming thread')
+
 if __name__ == '__main__':
     pass
@@ -1,20 +1,75 @@
 """
 # @file init_logger.py
-# @Synopsis  init logger
+# @Synopsis  init logger, records are queued by the logging threads and
+# written by a background log writer thread in batches, so that logging never
+# blocks a transfer on disk or mail
 # @author Ming Gu(guming02@baidu.com))
 # @version 1.0
 # @date 2015-09-19
 """
 import sys
+import time
+import atexit
+import threading
+import Queue
 import logging
 import logging.handlers
 from conf.env_config import EnvConfig
 from dao.mail import MailClient
 
+# max number of records written before the handlers are flushed
+BATCH_SIZE = 1000
+# max number of records included in an alarm digest, the rest are counted
+DIGEST_RECORD_CNT = 50
+
+
+class BatchFlushMixin(object):
+    """
+    # @Synopsis  handler mixin, the stream is not flushed for each record but
+    # once for each batch by the log writer
+    """
+    def flush(self):
+        """
+        # @Synopsis  override the flush for each record, does nothing
+        # @Returns   None
+        """
+        pass
+
+    def flushBatch(self):
+        """
+        # @Synopsis  flush the stream after a batch of records
+        # @Returns   None
+        """
+        super(BatchFlushMixin, self).flush()
+
+
+class BatchFileHandler(BatchFlushMixin, logging.handlers.TimedRotatingFileHandler):
+    """
+    # @Synopsis  daily rotating file handler flushed by batch
+    """
+    pass
+
+
+class BatchStreamHandler(BatchFlushMixin, logging.StreamHandler):
+    """
+    # @Synopsis  stream handler flushed by batch
+    """
+    pass
+
+
 class MailHandler(logging.Handler):
     """
-    # @Synopsis  customized handler, to email critical log
+    # @Synopsis  customized handler, to email critical log. Records are
+    # coalesced into digests, at most one digest is sent every interval
+    # seconds, the first record after a quiet interval is sent at once
     """
+    def __init__(self, interval=EnvConfig.MAIL_INTERVAL):
+        logging.Handler.__init__(self)
+        self.interval = interval
+        self.mail_client = MailClient(EnvConfig.GENERAL_LOG_NAME)
+        self.msgs = []
+        self.record_cnt = 0
+        self.last_send_time = None
 
     def emit(self, record):
         """
@@ -25,61 +80,193 @@ class MailHandler(logging.Handler):
         #
         # @Returns nothing
         """
-        msg = self.format(record)
-        mail_client = MailClient(EnvConfig.GENERAL_LOG_NAME)
-        mail_client.send(EnvConfig.ALARM_RECEIVERS, 'PROGRAM ALARM', msg)
+        if len(self.msgs) < DIGEST_RECORD_CNT:
+            self.msgs.append(self.format(record))
+        self.record_cnt += 1
+        self.sendDigest()
+
+    def getWaitSeconds(self):
+        """
+        # @Synopsis  seconds until the pending digest is due
+        # @Returns   seconds, None if there is nothing pending
+        """
+        if self.record_cnt == 0:
+            return None
+        if self.last_send_time is None:
+            return 0
+        return max(self.last_send_time + self.interval - time.time(), 0)
+
+    def sendDigest(self, force=False):
+        """
+        # @Synopsis  send the pending records as a digest if it is due
+        # @Args force send even if it is not due
+        # @Returns   None
+        """
+        self.acquire()
+        try:
+            wait_seconds = self.getWaitSeconds()
+            if wait_seconds is None or (wait_seconds > 0 and not force):
+                return
+            msg = '\n'.join(self.msgs)
+            if self.record_cnt > len(self.msgs):
+                msg += '\n... and {} more'.format(self.record_cnt - len(self.msgs))
+            title = 'PROGRAM ALARM'
+            if self.record_cnt > 1:
+                title = 'PROGRAM ALARM x {}'.format(self.record_cnt)
+            self.mail_client.send(EnvConfig.ALARM_RECEIVERS, title, msg)
+            self.msgs = []
+            self.record_cnt = 0
+            self.last_send_time = time.time()
+        finally:
+            self.release()
+
+    def close(self):
+        """
+        # @Synopsis  send the pending records before the handler is closed
+        # @Returns   None
+        """
+        self.sendDigest(True)
+        logging.Handler.close(self)
+
+
+class QueueHandler(logging.Handler):
+    """
+    # @Synopsis  handler putting records to the log writer, which passes them
+    # to the target handlers of the logger in its own thread
+    """
+    def __init__(self, log_writer, handlers):
+        logging.Handler.__init__(self)
+        self.log_writer = log_writer
+        self.handlers = handlers
+
+    def emit(self, record):
+        """
+        # @Synopsis  queue a record, the message and the traceback are
+        # formatted here since the arguments may change before written
+        # @Args record
+        # @Returns   None
+        """
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        self.log_writer.put(self.handlers, record)
+
+
+class LogWriter(threading.Thread):
+    """
+    # @Synopsis  log writer thread, take the queued records in batches and
+    # write them by their handlers, the handlers are flushed once for each
+    # batch. Pending mail digests are sent once they are due
+    """
+    def __init__(self):
+        threading.Thread.__init__(self)
+        self.queue = Queue.Queue()
+        self.mail_handlers = []
+
+    def put(self, handlers, record):
+        """
+        # @Synopsis  queue a record, never blocks
+        # @Args handlers target handlers
+        # @Args record
+        # @Returns   None
+        """
+        self.queue.put((handlers, record))
+
+    def getWaitSeconds(self):
+        """
+        # @Synopsis  seconds until the first pending mail digest is due
+        # @Returns   seconds, None if there is nothing pending
+        """
+        wait_seconds = filter(lambda x: x is not None,
+                map(lambda x: x.getWaitSeconds(), self.mail_handlers))
+        return min(wait_seconds) if len(wait_seconds) > 0 else None
+
+    def run(self):
+        """
+        # @Synopsis  run thread, until a None is taken
+        # @Returns   None
+        """
+        stopped = False
+        while not stopped:
+            try:
+                batch = [self.queue.get(True, self.getWaitSeconds())]
+            except Queue.Empty:
+                batch = []
+            try:
+                while len(batch) < BATCH_SIZE:
+                    batch.append(self.queue.get_nowait())
+            except Queue.Empty:
+                pass
+
+            written_handlers = set()
+            for item in batch:
+                if item is None:
+                    stopped = True
+                    continue
+                handlers, record = item
+                for handler in handlers:
+                    if record.levelno >= handler.level:
+                        handler.handle(record)
+                        written_handlers.add(handler)
+            for handler in written_handlers:
+                if hasattr(handler, 'flushBatch'):
+                    handler.flushBatch()
+            for mail_handler in self.mail_handlers:
+                mail_handler.sendDigest()
+
+    def stop(self):
+        """
+        # @Synopsis  write the queued records and stop the thread
+        # @Returns   None
+        """
+        self.queue.put(None)
+        self.join()
 
 
 def initLogger():
     """
-    # @Synopsis  initialize logger
+    # @Synopsis  initialize logger, the handlers of each logger are attached
+    # to the log writer behind a queue handler. The log writer is stopped at
+    # exit after all queued records are written
     # @Returns   None
     """
+    log_writer = LogWriter()
+    log_writer.daemon = True
+
     general_logger = logging.getLogger(EnvConfig.GENERAL_LOG_NAME)
     general_logger.setLevel(logging.DEBUG)
-    file_hdlr = logging.handlers.TimedRotatingFileHandler(
+    file_hdlr = BatchFileHandler(
             EnvConfig.GENERAL_LOG_FILE_PATH, when='D', backupCount=EnvConfig.LOG_ROTATE_DAY)
-    stdout_hdler = logging.StreamHandler(sys.stdout)
+    stdout_hdler = BatchStreamHandler(sys.stdout)
     stdout_hdler.setLevel(logging.INFO)
     email_hdler = MailHandler()
     email_hdler.setLevel(logging.ERROR)
+    log_writer.mail_handlers.append(email_hdler)
     formatter = logging.Formatter('%(asctime)s %(levelname)s: %(message)s',
             "%Y-%m-%d %H:%M:%S")
     file_hdlr.setFormatter(formatter)
     stdout_hdler.setFormatter(formatter)
     email_hdler.setFormatter(formatter)
-    general_logger.addHandler(file_hdlr)
-    general_logger.addHandler(stdout_hdler)
-    general_logger.addHandler(email_hdler)
-
-    bos_logger = logging.getLogger(EnvConfig.BOS_LOG_NAME)
-    bos_logger.setLevel(logging.DEBUG)
-    fh = logging.handlers.TimedRotatingFileHandler(
-            EnvConfig.BOS_LOG_FILE_PATH, when='D', backupCount=EnvConfig.LOG_ROTATE_DAY)
-    fh.setFormatter(formatter)
-    bos_logger.addHandler(fh)
-
-
-    hdfs_logger = logging.getLogger(EnvConfig.HDFS_LOG_NAME)
-    hdfs_logger.setLevel(logging.DEBUG)
-    fh = logging.handlers.TimedRotatingFileHandler(
-            EnvConfig.HDFS_LOG_FILE_PATH, when='D', backupCount=EnvConfig.LOG_ROTATE_DAY)
-    fh.setFormatter(formatter)
-    hdfs_logger.addHandler(fh)
-
-    success_logger = logging.getLogger(EnvConfig.SUCCESS_LOG_NAME)
-    success_logger.setLevel(logging.DEBUG)
-    fh = logging.handlers.TimedRotatingFileHandler(
-            EnvConfig.SUCCESS_LOG_FILE_PATH, when='D', backupCount=EnvConfig.LOG_ROTATE_DAY)
-    fh.setFormatter(formatter)
-    success_logger.addHandler(fh)
-
-    failure_logger = logging.getLogger(EnvConfig.FAILURE_LOG_NAME)
-    failure_logger.setLevel(logging.DEBUG)
-    fh = logging.handlers.TimedRotatingFileHandler(
-            EnvConfig.FAILURE_LOG_FILE_PATH, when='D', backupCount=EnvConfig.LOG_ROTATE_DAY)
-    fh.setFormatter(formatter)
-    failure_logger.addHandler(fh)
+    general_logger.addHandler(QueueHandler(log_writer, [file_hdlr, stdout_hdler,
+        email_hdler]))
+
+    for log_name, log_file_path in [
+            (EnvConfig.BOS_LOG_NAME, EnvConfig.BOS_LOG_FILE_PATH),
+            (EnvConfig.HDFS_LOG_NAME, EnvConfig.HDFS_LOG_FILE_PATH),
+            (EnvConfig.SUCCESS_LOG_NAME, EnvConfig.SUCCESS_LOG_FILE_PATH),
+            (EnvConfig.FAILURE_LOG_NAME, EnvConfig.FAILURE_LOG_FILE_PATH)]:
+        logger = logging.getLogger(log_name)
+        logger.setLevel(logging.DEBUG)
+        fh = BatchFileHandler(
+                log_file_path, when='D', backupCount=EnvConfig.LOG_ROTATE_DAY)
+        fh.setFormatter(formatter)
+        logger.addHandler(QueueHandler(log_writer, [fh]))
+
+    log_writer.start()
+    # registered after logging, so run before logging closes the handlers
+    atexit.register(log_writer.stop)
 
 if __name__ == '__main__':
-    InitLogger()
+    initLogger()
@@ -7,14 +7,85 @@
 """
 import commands
 import os
+import subprocess
+import tempfile
 import logging
+import collections
+
+# compact record of a hdfs file or directory, type is 'f' or 'd'
+HDFSObject = collections.namedtuple('HDFSObject', ['type', 'path', 'size'])
+
+# stderr of hadoop fs of the errors which retrying does not fix
+FATAL_ERROR_PATTERNS = ['No such file or directory', 'FileNotFoundException',
+        'Permission denied', 'AccessControlException', 'ChecksumException',
+        'Checksum error', 'Is a directory']
 
 class HDFSError(Exception):
     """
-    # @Synopsis  HDFS error class
+    # @Synopsis  HDFS error class. Unless told, the error is retryable, such
+    # as I/O errors and timeouts, except that the output of hadoop fs in the
+    # message shows a missing or inaccessible file or a checksum error
     """
-    def __init__(self, message=''):
+    def __init__(self, message='', retryable=None):
         self.message = message
+        if retryable is None:
+            retryable = not any(map(lambda x: x in message, FATAL_ERROR_PATTERNS))
+        self.retryable = retryable
+
+class HDFSReadStream(object):
+    """
+    # @Synopsis  file like stream of a hdfs file, read from the stdout of a
+    # hadoop fs -cat process
+    """
+    def __init__(self, process, stderr_file, sh_cmd, logger):
+        self.process = process
+        self.stderr_file = stderr_file
+        self.sh_cmd = sh_cmd
+        self.logger = logger
+        self.status = None
+
+    def read(self, size):
+        """
+        # @Synopsis  read at most size bytes, less only at the end of the file.
+        # The hadoop process is waited for at the end, a process which failed
+        # part way raises instead of the file being taken as read to the end
+        # @Args size
+        # @Returns   data read, empty string at the end of the file
+        """
+        if self.status is not None:
+            return ''
+        data = self.process.stdout.read(size)
+        if len(data) < size:
+            self.wait()
+            if self.status != 0:
+                raise HDFSError(self.output)
+        return data
+
+    def wait(self):
+        """
+        # @Synopsis  wait for the hadoop process and log its output
+        # @Returns   None
+        """
+        self.process.stdout.close()
+        self.status = self.process.wait()
+        self.stderr_file.seek(0)
+        self.output = self.stderr_file.read()
+        self.stderr_file.close()
+        self.logger.debug('Returned {0}: {1}\n{2}'.format(self.status, self.sh_cmd,
+            self.output))
+
+    def close(self):
+        """
+        # @Synopsis  close the stream, the hadoop process is killed if the
+        # stream is not read to the end
+        # @Returns   None
+        """
+        if self.status is not None:
+            return
+        if self.process.poll() is None:
+            self.process.kill()
+        self.wait()
+
 
 class HDFSClient(object):
     """
@@ -29,37 +100,45 @@ class HDFSClient(object):
 
     def lsr(self, hdfs_path):
         """
-        # @Synopsis  lsr
+        # @Synopsis  lsr, the output of hadoop fs -lsr is parsed line by line
+        # while it is being listed, instead of being buffered as a whole, so
+        # that huge directories can be processed before the listing finishes
         # @Args hdfs_path
-        # @Returns   file info list, including type, path and size
-        """
-        hdfs_cmd = '-lsr {0}'.format(hdfs_path)
-        sh_cmd = ' '.join([self.bin_path, 'fs', hdfs_cmd])
-        status, output = commands.getstatusoutput(sh_cmd)
-        self.logger.debug('Returned {0}: {1}\n{2}'.format(status, sh_cmd, output))
+        # @Returns   generator of HDFSObject, including type, path and size
+        """
+        env = dict(os.environ)
+        env['HADOOP_CONF_DIR'] = self.conf_path
+        cmd = [self.bin_path, 'fs', '-lsr', hdfs_path]
+        sh_cmd = ' '.join(cmd)
+        stderr_file = tempfile.TemporaryFile()
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr_file,
+                env=env)
+        object_cnt = 0
+        try:
+            for line in iter(process.stdout.readline, ''):
+                # permission, replication, owner, group, size, date, time, path,
+                # the path may contain spaces
+                fields = line.rstrip('\n').split(None, 7)
+                if len(fields) < 8:
+                    continue
+                if fields[0][0] == 'd':
+                    object_type = 'd'
+                else:
+                    object_type = 'f'
+                object_cnt += 1
+                yield HDFSObject(object_type, fields[7], int(fields[4]))
+        finally:
+            if process.poll() is None:
+                process.kill()
+            process.stdout.close()
+            status = process.wait()
+            stderr_file.seek(0)
+            output = stderr_file.read()
+            stderr_file.close()
+            self.logger.debug('Returned {0}: {1}, {2} objects listed\n{3}'.format(status,
+                sh_cmd, object_cnt, output))
         if status != 0:
-            pass
-        output_lines = output.split('\n')
-        def output_parser(line):
-            """
-            # @Synopsis  map hadoop fs -lsr output to desired format
-            # @Args line
-            # @Returns   file info dict
-            """
-            fields = line.split()
-            if fields[0][0] == 'd':
-                object_type = 'd'
-            else:
-                object_type = 'f'
-            object_path = fields[7]
-            object_size = int(fields[4])
-            return dict({
-                'type': object_type,
-                'path': object_path,
-                'size': object_size
-                })
-        objects = map(output_parser, output_lines)
-        return objects
+            raise HDFSError(output)
 
     def mkdir(self, hdfs_path):
         """
@@ -75,6 +154,29 @@ class HDFSClient(object):
         cmd = ' '.join(['-get', hdfs_path, local_path])
         return self._exec(cmd)
 
+    def cat(self, hdfs_path):
+        """
+        # @Synopsis  open a hdfs file as a stream, without caching it on local disk
+        # @Args hdfs_path
+        # @Returns   HDFSReadStream, the caller should close it after reading
+        """
+        return self.catFiles([hdfs_path])
+
+    def catFiles(self, hdfs_paths):
+        """
+        # @Synopsis  open hdfs files as a stream of their concatenation, read by
+        # a single hadoop process
+        # @Args hdfs_paths
+        # @Returns   HDFSReadStream, the caller should close it after reading
+        """
+        env = dict(os.environ)
+        env['HADOOP_CONF_DIR'] = self.conf_path
+        cmd = [self.bin_path, 'fs', '-cat'] + list(hdfs_paths)
+        stderr_file = tempfile.TemporaryFile()
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr_file,
+                env=env)
+        return HDFSReadStream(process, stderr_file, ' '.join(cmd), self.logger)
+
     def getmerge(self, hdfs_path, local_path):
         """
         # @Synopsis  get a director from hdfs and merge into one local file
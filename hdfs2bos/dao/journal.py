@@ -0,0 +1,151 @@
+"""
+# @file journal.py
+# @Synopsis  persistent checkpoint journal of a transfer
+# @author Ming Gu(guming@itv.baidu.com))
+# @version 1.0
+# @date 2016-12-15
+"""
+import os
+import threading
+import logging
+
+PLAN_RECORD = 'P'
+PLAN_END_RECORD = 'E'
+DONE_RECORD = 'D'
+
+
+class TransferJournal(object):
+    """
+    # @Synopsis  append-only checkpoint journal of a transfer. The journal holds
+    # the transfer plan, one record per file followed by an end record, and a
+    # done record is appended whenever a file is transferred. The plan may be
+    # appended while files are being transferred, so done records can come
+    # before the end record. Records are tab separated lines, a torn last line
+    # left by a crash is ignored when the journal is loaded
+    """
+    def __init__(self, journal_path, log_name):
+        self.journal_path = journal_path
+        self.logger = logging.getLogger(log_name)
+        self.journal_file = None
+        self.lock = threading.Lock()
+
+    def load(self):
+        """
+        # @Synopsis  load the journal of a previous run
+        # @Returns   tuple of transfer plan, set of done files and whether the
+        # plan is complete. The plan is a list of field lists, None if there is
+        # no journal, a plan not complete is the part recorded before the
+        # previous run stopped. Files are identified by the first field of
+        # their plan
+        """
+        plan = []
+        plan_completed = False
+        done_files = set()
+        if not os.path.exists(self.journal_path):
+            return None, done_files, False
+        journal_file = open(self.journal_path)
+        try:
+            for line in journal_file:
+                if not line.endswith('\n'):
+                    break
+                fields = line[:-1].split('\t')
+                if fields[0] == PLAN_RECORD:
+                    plan.append(fields[1:])
+                elif fields[0] == PLAN_END_RECORD:
+                    plan_completed = True
+                elif fields[0] == DONE_RECORD:
+                    done_files.add(fields[1])
+        finally:
+            journal_file.close()
+        self.logger.debug('loaded journal {}: plan_cnt = {}, done_cnt = {}'.format(
+            self.journal_path, len(plan), len(done_files)))
+        return plan, done_files, plan_completed
+
+    def start(self, plan):
+        """
+        # @Synopsis  start a new journal with the transfer plan, any previous
+        # journal is discarded
+        # @Args plan list of field lists, one for each file
+        # @Returns   None
+        """
+        self.begin()
+        for fields in plan:
+            self.plan(fields)
+        self.endPlan()
+
+    def begin(self):
+        """
+        # @Synopsis  start a new journal whose plan is appended file by file
+        # while the transfer is running, any previous journal is discarded
+        # @Returns   None
+        """
+        journal_dir = os.path.dirname(self.journal_path)
+        if not os.path.isdir(journal_dir):
+            os.makedirs(journal_dir)
+        self.journal_file = open(self.journal_path, 'w')
+
+    def plan(self, fields):
+        """
+        # @Synopsis  append the plan of a file, thread safe. Plan records are
+        # not flushed one by one, the plan only counts once its end is recorded
+        # @Args fields field list of the file
+        # @Returns   None
+        """
+        self.lock.acquire()
+        try:
+            self.journal_file.write('\t'.join([PLAN_RECORD] + map(str, fields)) + '\n')
+        finally:
+            self.lock.release()
+
+    def endPlan(self):
+        """
+        # @Synopsis  record the end of the plan and sync it to disk
+        # @Returns   None
+        """
+        self.lock.acquire()
+        try:
+            self.journal_file.write(PLAN_END_RECORD + '\n')
+            self.journal_file.flush()
+            os.fsync(self.journal_file.fileno())
+        finally:
+            self.lock.release()
+
+    def resume(self):
+        """
+        # @Synopsis  reopen the journal of a previous run to append to it, a torn
+        # last line is terminated first so that it stays apart from new records
+        # @Returns   None
+        """
+        self.journal_file = open(self.journal_path, 'a+')
+        self.journal_file.seek(0, os.SEEK_END)
+        if self.journal_file.tell() > 0:
+            self.journal_file.seek(-1, os.SEEK_END)
+            torn = self.journal_file.read(1) != '\n'
+            self.journal_file.seek(0, os.SEEK_END)
+            if torn:
+                self.journal_file.write('\n')
+
+    def record(self, file_id):
+        """
+        # @Synopsis  record a transferred file, thread safe
+        # @Args file_id first field of the plan of the file
+        # @Returns   None
+        """
+        self.lock.acquire()
+        try:
+            self.journal_file.write('\t'.join([DONE_RECORD, file_id]) + '\n')
+            self.journal_file.flush()
+        finally:
+            self.lock.release()
+
+    def close(self):
+        """
+        # @Synopsis  sync and close the journal
+        # @Returns   None
+        """
+        if self.journal_file is None:
+            return
+        self.journal_file.flush()
+        os.fsync(self.journal_file.fileno())
+        self.journal_file.close()
+        self.journal_file = None
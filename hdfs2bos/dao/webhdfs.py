@@ -0,0 +1,266 @@
+"""
+# @file webhdfs.py
+# @Synopsis  hdfs operations through WebHDFS REST API, over pooled keep-alive
+# http connections instead of starting a hadoop JVM for each operation
+# @author Ming Gu(guming@itv.baidu.com))
+# @version 1.0
+# @date 2016-12-20
+"""
+import httplib
+import urllib
+import urlparse
+import json
+import threading
+import logging
+
+from dao.hdfs import HDFSError
+from dao.hdfs import HDFSObject
+
+WEBHDFS_PREFIX = '/webhdfs/v1'
+MAX_REDIRECT_CNT = 3
+
+
+def isRetryableStatus(status):
+    """
+    # @Synopsis  whether an error status of WebHDFS may go away by retrying,
+    # 5xx are retryable, 4xx such as 403 of an inaccessible file and 404 of a
+    # missing file are fatal
+    # @Args status http status
+    # @Returns   bool
+    """
+    return status >= httplib.INTERNAL_SERVER_ERROR
+
+
+class HTTPConnectionPool(object):
+    """
+    # @Synopsis  pool of keep-alive http connections, keyed by host and port,
+    # thread safe
+    """
+    def __init__(self, timeout, max_idle_cnt):
+        self.timeout = timeout
+        self.max_idle_cnt = max_idle_cnt
+        self.idle_connections = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, host, port):
+        """
+        # @Synopsis  take an idle connection to the given address, or open a new
+        # one if there is none
+        # @Args host
+        # @Args port
+        # @Returns   http connection
+        """
+        self.lock.acquire()
+        try:
+            connections = self.idle_connections.get((host, port), [])
+            if len(connections) > 0:
+                return connections.pop()
+        finally:
+            self.lock.release()
+        return httplib.HTTPConnection(host, port, timeout=self.timeout)
+
+    def release(self, connection, response):
+        """
+        # @Synopsis  give back a connection after its response is read to the
+        # end, the connection is closed instead if it can not be reused
+        # @Args connection
+        # @Args response
+        # @Returns   None
+        """
+        if not response.isclosed() or response.will_close:
+            connection.close()
+            return
+        self.lock.acquire()
+        try:
+            connections = self.idle_connections.setdefault(
+                    (connection.host, connection.port), [])
+            if len(connections) < self.max_idle_cnt:
+                connections.append(connection)
+                return
+        finally:
+            self.lock.release()
+        connection.close()
+
+    def reinit(self):
+        """
+        # @Synopsis  drop the idle connections in a forked process, they are
+        # shared with the parent process and must not be used by both
+        # @Returns   None
+        """
+        self.lock = threading.Lock()
+        self.idle_connections = {}
+
+
+class WebHDFSReadStream(object):
+    """
+    # @Synopsis  file like stream of a hdfs file, read from a WebHDFS OPEN
+    # response
+    """
+    def __init__(self, connection_pool, connection, response, hdfs_path):
+        self.connection_pool = connection_pool
+        self.connection = connection
+        self.response = response
+        self.hdfs_path = hdfs_path
+
+    def read(self, size):
+        """
+        # @Synopsis  read at most size bytes, less only at the end of the file.
+        # httplib returns an empty string instead of raising if the connection
+        # is closed before Content-Length bytes are read, such a response
+        # raises instead of the file being taken as read to the end
+        # @Args size
+        # @Returns   data read, empty string at the end of the file
+        """
+        chunks = []
+        remain_size = size
+        while remain_size > 0:
+            chunk = self.response.read(remain_size)
+            if not chunk:
+                if self.response.length:
+                    raise HDFSError('OPEN {} closed with {} bytes unread'.format(
+                        self.hdfs_path, self.response.length))
+                break
+            chunks.append(chunk)
+            remain_size -= len(chunk)
+        return ''.join(chunks)
+
+    def close(self):
+        """
+        # @Synopsis  close the stream, the connection is given back to the pool
+        # if the file is read to the end
+        # @Returns   None
+        """
+        if self.response.length:
+            # closed by the server part way, the response is closed as well
+            self.connection.close()
+            return
+        self.connection_pool.release(self.connection, self.response)
+
+
+class WebHDFSClient(object):
+    """
+    # @Synopsis  WebHDFS client, provides the same lsr, get and cat operations as
+    # HDFSClient. Connections to namenode and datanodes are kept alive and
+    # shared by threads
+    """
+    def __init__(self, host, port, user, log_name, timeout=60, max_idle_cnt=32):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.logger = logging.getLogger(log_name)
+        self.connection_pool = HTTPConnectionPool(timeout, max_idle_cnt)
+
+    def lsr(self, hdfs_path):
+        """
+        # @Synopsis  lsr, directories are listed one by one and their objects
+        # are yielded as soon as each listing returns
+        # @Args hdfs_path
+        # @Returns   generator of HDFSObject, including type, path and size
+        """
+        dir_paths = [hdfs_path]
+        while len(dir_paths) > 0:
+            dir_path = dir_paths.pop()
+            response_data = self._request(dir_path, 'LISTSTATUS')
+            for status in json.loads(response_data)['FileStatuses']['FileStatus']:
+                if status['pathSuffix'] == '':
+                    object_path = dir_path
+                else:
+                    object_path = '/'.join([dir_path.rstrip('/'), status['pathSuffix']])
+                if status['type'] == 'DIRECTORY':
+                    object_type = 'd'
+                    dir_paths.append(object_path)
+                else:
+                    object_type = 'f'
+                yield HDFSObject(object_type, object_path, int(status['length']))
+
+    def get(self, hdfs_path, local_path):
+        """
+        # @Synopsis  get single file from hdfs
+        """
+        stream = self.cat(hdfs_path)
+        local_file = open(local_path, 'wb')
+        try:
+            while True:
+                data = stream.read(1024 * 1024)
+                if not data:
+                    break
+                local_file.write(data)
+        finally:
+            local_file.close()
+            stream.close()
+        return True
+
+    def cat(self, hdfs_path):
+        """
+        # @Synopsis  open a hdfs file as a stream, the namenode redirection to
+        # datanode is followed
+        # @Args hdfs_path
+        # @Returns   WebHDFSReadStream, the caller should close it after reading
+        """
+        host, port = self.host, self.port
+        url = self._getUrl(hdfs_path, 'OPEN')
+        for i in range(MAX_REDIRECT_CNT + 1):
+            connection, response = self._send(host, port, url)
+            if response.status not in (httplib.TEMPORARY_REDIRECT, httplib.FOUND):
+                break
+            location = urlparse.urlparse(response.getheader('location'))
+            response.read()
+            self.connection_pool.release(connection, response)
+            host, port = location.hostname, location.port or httplib.HTTP_PORT
+            url = location.path + '?' + location.query
+        if response.status != httplib.OK:
+            message = response.read()
+            self.connection_pool.release(connection, response)
+            raise HDFSError('OPEN {} returned {}: {}'.format(hdfs_path,
+                response.status, message), isRetryableStatus(response.status))
+        return WebHDFSReadStream(self.connection_pool, connection, response, hdfs_path)
+
+    def _getUrl(self, hdfs_path, op):
+        """
+        # @Synopsis  url of a WebHDFS operation
+        # @Args hdfs_path
+        # @Args op
+        # @Returns   url
+        """
+        return '{}{}?{}'.format(WEBHDFS_PREFIX, urllib.quote(hdfs_path),
+                urllib.urlencode({'op': op, 'user.name': self.user}))
+
+    def _request(self, hdfs_path, op):
+        """
+        # @Synopsis  execute a WebHDFS operation on namenode
+        # @Args hdfs_path
+        # @Args op
+        # @Returns   response body
+        """
+        connection, response = self._send(self.host, self.port, self._getUrl(hdfs_path, op))
+        response_data = response.read()
+        self.connection_pool.release(connection, response)
+        self.logger.debug('Returned {0}: {1} {2}'.format(response.status, op, hdfs_path))
+        if response.status != httplib.OK:
+            raise HDFSError('{} {} returned {}: {}'.format(op, hdfs_path,
+                response.status, response_data), isRetryableStatus(response.status))
+        return response_data
+
+    def _send(self, host, port, url):
+        """
+        # @Synopsis  send a GET request through a pooled connection. A pooled
+        # connection may have been closed by the server while idle, so the
+        # request is sent once more through a new connection on failure
+        # @Args host
+        # @Args port
+        # @Args url
+        # @Returns   tuple of connection and response
+        """
+        connection = self.connection_pool.acquire(host, port)
+        try:
+            connection.request('GET', url)
+            return connection, connection.getresponse()
+        except (httplib.HTTPException, IOError) as e:
+            connection.close()
+            connection = httplib.HTTPConnection(host, port, timeout=self.connection_pool.timeout)
+            try:
+                connection.request('GET', url)
+                return connection, connection.getresponse()
+            except (httplib.HTTPException, IOError) as e:
+                connection.close()
+                raise HDFSError('GET {}:{}{} failed: {}'.format(host, port, url, e))
@@ -22,6 +22,15 @@ if __name__ == '__main__':
 
     parser = argparse.ArgumentParser(description='Transfer data from HDFS to BOS')
     parser.add_argument('bucket_name', help='destination BOS bucket name')
+    parser.add_argument('-s', '--stream', action='store_true', help=('stream data from HDFS '
+        'to BOS without caching it on local disk'))
+    parser.add_argument('-r', '--resume', action='store_true', help=('resume the previous '
+        'transfer of the same src and dst, skipping the files already transferred'))
+    parser.add_argument('-p', '--pack', action='store_true', help=('pack small files into '
+        'large pack objects, which can be unpacked by bos-client get'))
+    parser.add_argument('-z', '--compress', choices=['gzip', 'zstd'], help=('compress files '
+        'by the codec while uploading, the objects keep the keys of the files and are '
+        'decompressed by bos-client get. Packed files are not compressed'))
 
     subparsers = parser.add_subparsers(title='mode selection', description=('make single transfer '
             'by specifying src and dst as args in command line mode or make multiple transfers by '
@@ -43,7 +52,8 @@ if __name__ == '__main__':
     args = parser.parse_args()
     bucket_name = args.bucket_name
     if args.command == 'line':
-        transferor = Transferor(bucket_name)
+        transferor = Transferor(bucket_name, args.stream, args.resume, args.pack,
+                args.compress)
         hdfs_path = args.src
         bos_path = args.dst
         logger.debug('start transferring')
@@ -51,15 +61,17 @@ if __name__ == '__main__':
     else:
         try:
             input_obj = open(args.file)
-            src_dst_list = map(lambda l: l.strip().split(), input_obj)
+            src_dst_list = map(lambda l: tuple(l.strip().split()),
+                    filter(lambda l: l.strip() != '', input_obj))
             input_obj.close()
         except Exception as e:
             logger.critical('failed to read input file')
             exit(1)
+        # all pairs are transferred as a single plan by shared threads
+        transferor = Transferor(bucket_name, args.stream, args.resume, args.pack,
+                args.compress)
         logger.debug('start transferring')
-        for src, dst in src_dst_list:
-            transferor = Transferor(bucket_name)
-            transferor.tranfer(src, dst)
+        transferor.transferAll(src_dst_list)
 
     end_time = datetime.now()
     time_span = end_time - start_time